@@ -0,0 +1,119 @@
+"""
+Cached lock checks for Paxboards.
+
+Listing the boards checks the read lock on every board, for every listing, and the web views
+check read and post access separately on each page.  Since board locks almost always depend only
+on who the player is and what permissions they hold, the decisions are cached, keyed on:
+
+    (account id, superuser flag, permission set, quell flag, board id, lock string, access type,
+     default)
+
+Changing a board's locks or a player's permissions, or the player quelling, changes the key, so
+stale decisions are never used; they just age out.  Locks using any lock function other than the ones in STABLE_LOCKFUNCS
+(which might depend on attributes, tags, location, time and so on) are always checked directly,
+as are checks by anything other than an account.
+
+The cache holds at most PAXBOARDS_ACCESS_CACHE_SIZE decisions (default 10000), and is emptied
+when full.  Its hit and miss counts are shown by `bbadmin/stats`.
+
+"""
+import re
+
+from django.conf import settings
+
+ACCESS_CACHE_SIZE = getattr(settings, "PAXBOARDS_ACCESS_CACHE_SIZE", 10000)
+
+# Lock functions whose result depends only on the accessing account's identity and permissions.
+STABLE_LOCKFUNCS = frozenset(("all", "none", "true", "false", "perm", "perm_above", "pperm", "pperm_above",
+                              "id", "pid", "dbref", "pdbref", "superuser"))
+
+_LOCKFUNC = re.compile(r"(\w+)\s*\(")
+_CACHE = {}
+_STATS = {"hits": 0, "misses": 0, "uncached": 0}
+
+
+def access_key(board, accessing_obj, access_type, default, no_superuser_bypass=False):
+    """
+    Works out the cache key for a lock check, if the check can be cached at all.
+
+    Args:
+        board (DefaultBoard): The board being accessed.
+        accessing_obj (AccountDB): Whoever is trying to access it.
+        access_type (str): The access type being checked.
+        default (bool): The result if the board has no lock for the access type.
+        no_superuser_bypass (bool): Whether superusers are checked like anyone else.
+
+    Returns:
+        A tuple, or None if the check shouldn't be cached.
+
+    """
+    lock_storage = board.db_lock_storage or ""
+    if not STABLE_LOCKFUNCS.issuperset(_LOCKFUNC.findall(lock_storage)):
+        return None
+
+    if getattr(accessing_obj, "__dbclass__", None) is None or \
+            accessing_obj.__dbclass__.__name__ != "AccountDB":
+        return None
+
+    # Quelling drops a player to their lowest permissions without changing the permission set.
+    perms = tuple(sorted(accessing_obj.permissions.all()))
+    quelled = bool(accessing_obj.attributes.get("_quell"))
+    return (accessing_obj.id, accessing_obj.is_superuser, perms, quelled, board.id, lock_storage, access_type,
+            default, no_superuser_bypass)
+
+
+def cached_access(board, check, accessing_obj, access_type, default, no_superuser_bypass=False):
+    """
+    Returns the result of a lock check, from the cache if possible.
+
+    Args:
+        board (DefaultBoard): The board being accessed.
+        check (callable): Does the real check, when called with no arguments.
+        accessing_obj (AccountDB): Whoever is trying to access it.
+        access_type (str): The access type being checked.
+        default (bool): The result if the board has no lock for the access type.
+        no_superuser_bypass (bool): Whether superusers are checked like anyone else.
+
+    Returns:
+        True or False.
+
+    """
+    key = access_key(board, accessing_obj, access_type, default, no_superuser_bypass)
+    if key is None:
+        _STATS["uncached"] += 1
+        return check()
+
+    try:
+        result = _CACHE[key]
+        _STATS["hits"] += 1
+        return result
+    except KeyError:
+        _STATS["misses"] += 1
+
+    result = check()
+    if len(_CACHE) >= ACCESS_CACHE_SIZE:
+        _CACHE.clear()
+    _CACHE[key] = result
+    return result
+
+
+def clear_access_cache():
+    """
+    Throws away every cached decision.  This is never needed for correctness, but frees the
+    memory held by decisions which can no longer be used.
+
+    """
+    _CACHE.clear()
+
+
+def access_cache_stats():
+    """
+    Returns the access cache's counters.
+
+    Returns:
+        A dictionary of 'hits', 'misses', 'uncached' (checks which couldn't be cached) and 'size'.
+
+    """
+    stats = dict(_STATS)
+    stats["size"] = len(_CACHE)
+    return stats
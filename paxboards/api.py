@@ -0,0 +1,159 @@
+"""
+A read-only JSON API for Paxboards, for dashboards and bots.
+
+    /boards/api/                         The boards you can read.
+    /boards/api/<board>/                 The threads on a board, most recently active first.
+    /boards/api/<board>/<post>/          A thread, with its replies.
+
+The thread and reply lists are paged like the web pages, with 'next' and 'previous' cursors to pass
+back as ?after= or ?before=.  Every response carries an ETag and Last-Modified header worked out
+from the boards' posts, so a client which sends them back with If-None-Match or If-Modified-Since
+gets an empty 304 response (costing one query) whenever nothing has changed.
+
+Only boards whose read lock lets the player in are served.  Boards with no read lock at all, which
+anyone can read in-game, are left out; give them one (e.g. `read:all()`) to publish them here.
+
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.http import JsonResponse
+from django.views.decorators.http import condition, require_safe
+
+from .boards import DefaultBoard
+from .models import Post
+from .paging import keyset_page
+from .routers import request_actor
+from .views import BOARD_PAGE_SIZE, THREAD_PAGE_SIZE
+
+THREAD_ORDERING = ['-db_pinned', '-db_last_post_on', '-id']
+REPLY_ORDERING = ['db_date_created', 'id']
+
+
+def _readable(request, board_id=None):
+    """
+    Returns the boards a request may read: all of them, or just the one asked for.  Unlike
+    in-game, boards without a read lock aren't readable here.
+
+    """
+    if not request.user.is_authenticated:
+        return []
+
+    if board_id is None:
+        return [board for board in DefaultBoard.objects.get_readable_boards(request.user)
+                if board.access(request.user, access_type="read", default=False)]
+
+    board = DefaultBoard.objects.filter(pk=board_id).first()
+    if board and board.access(request.user, access_type="read", default=False):
+        return [board]
+
+    return []
+
+
+def _stamp(request, board_id=None, post_id=None):
+    """
+    Works out how up to date the boards behind a request are, as a tuple of (etag, last_modified),
+    or (None, None) if the request can't read them.  This is one aggregate query, and is worked
+    out once per request.
+
+    """
+    if hasattr(request, "paxboards_stamp"):
+        return request.paxboards_stamp
+
+    boards = _readable(request, board_id)
+    stamp = (None, None)
+
+    if boards:
+        rows = Post.objects.filter(db_board__in=boards).order_by().values_list('db_board') \
+            .annotate(count=Count('id'), created=Max('db_date_created'), modified=Max('db_date_modified'))
+        stamps = sorted((b, count, max(d for d in (created, modified) if d))
+                        for b, count, created, modified in rows)
+
+        # The visible boards are part of the tag, so it changes if a board is added or a lock changes.
+        key = repr(([b.id for b in boards], stamps, request.GET.get('after'), request.GET.get('before')))
+        etag = hashlib.md5(key.encode('utf-8')).hexdigest()
+        last_modified = max(s[2] for s in stamps) if stamps else None
+        stamp = (etag, last_modified)
+
+    request.paxboards_stamp = stamp
+    return stamp
+
+
+def _etag(request, *args, **kwargs):
+    return _stamp(request, *args, **kwargs)[0]
+
+
+def _last_modified(request, *args, **kwargs):
+    return _stamp(request, *args, **kwargs)[1]
+
+
+def _board_json(board, total=None, last_post_on=None):
+    return {"id": board.id, "name": board.name, "total_posts": total, "last_post_on": last_post_on}
+
+
+def _post_json(post, text=False):
+    result = {"id": post.id, "subject": post.db_subject, "poster": post.db_poster_name, "pinned": post.db_pinned,
+              "created": post.db_date_created}
+    if text:
+        result["text"] = post.plaintext
+        result["html"] = post.html
+
+    return result
+
+
+def _thread_json(thread):
+    result = _post_json(thread)
+    result.update({"last_post_on": thread.db_last_post_on, "last_poster": thread.db_last_poster,
+                   "total_posts": thread.db_total_posts})
+    return result
+
+
+def _forbidden():
+    return JsonResponse({"error": "No such board or post, or you don't have access to it."}, status=404)
+
+
+@request_actor
+@require_safe
+@condition(etag_func=_etag, last_modified_func=_last_modified)
+def api_boards(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "You must be logged in."}, status=403)
+
+    # Counted like the in-game board list, so expired posts are left out.
+    boards = DefaultBoard.objects.annotate_counts(_readable(request))
+
+    return JsonResponse({"boards": [_board_json(b, b.total_count, b.last_post.db_date_created if b.last_post else None)
+                                    for b in boards]})
+
+
+@request_actor
+@require_safe
+@condition(etag_func=_etag, last_modified_func=_last_modified)
+def api_board(request, board_id):
+    boards = _readable(request, board_id)
+    if not boards:
+        return _forbidden()
+
+    board = boards[0]
+    threads = keyset_page(board.threads(), THREAD_ORDERING, BOARD_PAGE_SIZE,
+                          after=request.GET.get('after'), before=request.GET.get('before'))
+
+    return JsonResponse({"board": _board_json(board), "threads": [_thread_json(t) for t in threads],
+                         "next": threads.next_cursor, "previous": threads.previous_cursor})
+
+
+@request_actor
+@require_safe
+@condition(etag_func=_etag, last_modified_func=_last_modified)
+def api_thread(request, board_id, post_id):
+    boards = _readable(request, board_id)
+    post = Post.objects.filter(pk=post_id, db_board__in=boards).first() if boards else None
+    if not post:
+        return _forbidden()
+
+    replies = keyset_page(Post.objects.filter(db_parent=post), REPLY_ORDERING, THREAD_PAGE_SIZE,
+                          after=request.GET.get('after'), before=request.GET.get('before'))
+
+    return JsonResponse({"board": _board_json(boards[0]), "post": _post_json(post, text=True),
+                         "replies": [_post_json(r, text=True) for r in replies],
+                         "next": replies.next_cursor, "previous": replies.previous_cursor})
@@ -1,5 +1,33 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def setup_search(sender, using=None, **kwargs):
+    """
+    Creates the search index tables, which live outside the migrations since they depend on the
+    database backend.
+
+    """
+    from .search import get_backend
+    get_backend().setup(using)
+
+
+def setup_indexes(sender, using=None, **kwargs):
+    """
+    Creates the indexes which can't be declared on the models; see paxboards.indexes.
+
+    """
+    from .indexes import setup_indexes
+    setup_indexes(using)
 
 
 class PaxboardsConfig(AppConfig):
     name = 'paxboards'
+
+    def ready(self):
+        from evennia.server.signals import SIGNAL_ACCOUNT_POST_LOGIN
+        from .notify import at_account_login
+
+        post_migrate.connect(setup_search, sender=self)
+        post_migrate.connect(setup_indexes, sender=self)
+        SIGNAL_ACCOUNT_POST_LOGIN.connect(at_account_login)
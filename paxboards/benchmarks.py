@@ -0,0 +1,231 @@
+"""
+Load benchmarks for Paxboards.
+
+This builds a synthetic set of boards, posts and players, then times the paths that matter most
+as a game grows: listing boards, listing a board's posts and threads, searching, posting, catching
+up and looking up a post by number.  For each one it reports the wall time and the number of
+database queries, as a dictionary which can be saved as JSON and compared against a later run.
+
+It's normally run through the management command:
+
+    evennia paxboards_benchmark --boards 10 --posts 2000 --accounts 50 --output before.json
+    ... make changes ...
+    evennia paxboards_benchmark --boards 10 --posts 2000 --accounts 50 --compare before.json
+
+Everything is done inside a transaction which is rolled back at the end, so it can be pointed at
+a copy of a real game database without leaving anything behind.
+
+"""
+import random
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+WORDS = ("dragon", "market", "council", "harbor", "festival", "letter", "rumor", "storm", "guild", "wedding",
+         "tax", "bandit", "treaty", "ship", "tournament", "plague", "harvest", "temple", "crown", "duel")
+
+
+def _text(rng, words=40):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def generate(boards=5, posts=500, accounts=20, read_ratio=0.5, thread_depth=2, days=60, seed=0):
+    """
+    Builds a synthetic dataset.
+
+    Args:
+        boards (int): How many boards to make.
+        posts (int): How many posts to make on each board, replies included.
+        accounts (int): How many players to make.  Each subscribes to about half the boards.
+        read_ratio (float): The fraction of posts each player has read, from 0 to 1.
+        thread_depth (int): How many replies each thread gets, each replying to the one before.
+        days (int): How far back the posts are spread.
+        seed (int): Seed for the random choices, so runs can be repeated exactly.
+
+    Returns:
+        A dictionary with the 'boards', 'accounts' and 'posts' made.
+
+    """
+    from evennia.utils import create
+    from paxboards.boards import DefaultBoard
+    from paxboards.models import Post
+    from paxboards.readstate import get_read_state
+    from paxboards.search import index_posts
+
+    rng = random.Random(seed)
+    now = timezone.now()
+    queryset = Post.objects.get_queryset()
+
+    players = [create.create_account("bench%i_%i" % (seed, i), "bench%i_%i@example.com" % (seed, i), "benchmark")
+               for i in range(accounts)]
+
+    made_boards = []
+    for b in range(boards):
+        board = DefaultBoard(db_key="Bench%i-%03i" % (seed, b))
+        board.save()
+        made_boards.append(board)
+
+        threads = max(1, posts // (thread_depth + 1))
+        layer = []
+        for t in range(threads):
+            poster = rng.choice(players)
+            layer.append(Post(db_board=board, db_poster_player=poster, db_poster_name=poster.key,
+                              db_subject=" ".join(rng.choice(WORDS) for _ in range(3)), db_text=_text(rng),
+                              db_pinned=(t < 2)))
+        dates = [now - timedelta(minutes=rng.randint(60, days * 1440)) for _ in layer]
+        layer = Post.objects.bulk_create_dated(layer, dates)
+
+        for depth in range(thread_depth):
+            replies = []
+            for parent in layer:
+                poster = rng.choice(players)
+                replies.append(Post(db_board=board, db_poster_player=poster, db_poster_name=poster.key,
+                                    db_subject=("Re: " + parent.db_subject)[:40], db_text=_text(rng, 20),
+                                    db_pinned=False, db_parent=parent))
+            dates = [parent.db_date_created + timedelta(minutes=rng.randint(1, 59)) for parent in layer]
+            layer = Post.objects.bulk_create_dated(replies, dates)
+
+        queryset.renumber(board)
+        for root in Post.objects.filter(db_board=board, db_parent__isnull=True):
+            root.update_thread_summary()
+
+    all_posts = list(Post.objects.filter(db_board__in=made_boards))
+    for post in all_posts:
+        post.update_renderings()
+    Post.objects.bulk_update(all_posts, ['db_plaintext', 'db_html'])
+    index_posts(all_posts)
+
+    read_state = get_read_state()
+    for player in players:
+        for board in made_boards:
+            if rng.random() < 0.5:
+                board.set_subscribed(player, True)
+        read_state.mark_read([p for p in all_posts if rng.random() < read_ratio], player)
+
+    return {"boards": made_boards, "accounts": players, "posts": all_posts}
+
+
+def measure(func, repeat=5):
+    """
+    Times a function, counting the database queries it makes.
+
+    Args:
+        func (callable): The function to time.  It's called with the run number, from 0.
+        repeat (int): How many times to run it.
+
+    Returns:
+        A dictionary of 'seconds' (the median wall time), 'min', 'max' and 'queries' (the most
+        queries made by any one run).
+
+    """
+    times = []
+    queries = 0
+    for run in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            func(run)
+            times.append(time.perf_counter() - started)
+        queries = max(queries, len(context.captured_queries))
+
+    times.sort()
+    return {"seconds": round(times[len(times) // 2], 6), "min": round(times[0], 6), "max": round(times[-1], 6),
+            "queries": queries}
+
+
+def run(data, repeat=5):
+    """
+    Times the key paths against a generated dataset.  While it runs, the generated players are
+    all taken to be connected, so posting pays for telling the subscribers about new posts.
+
+    Args:
+        data (dict): The dataset, as returned by generate().
+        repeat (int): How many times to run each path.
+
+    Returns:
+        A dictionary of path name to measure() results.
+
+    """
+    from evennia import SESSION_HANDLER
+    from paxboards.boards import DefaultBoard
+    from paxboards.commands import BoardCmd
+    from paxboards.models import Post
+    from paxboards.notify import dispatch
+    from paxboards.readstate import get_read_state
+
+    boards, players = data["boards"], data["accounts"]
+    board, player = boards[0], players[0]
+    middle = max(1, len(board.posts()) // 2)
+
+    command = BoardCmd()
+    command.account = player
+    command.msg = lambda *args, **kwargs: None
+
+    def resolve_id(run):
+        command.lhs = board.name + "/" + str(middle)
+        command.resolve_id(command.lhs)
+
+    def create_post(run):
+        board.create_post("Benchmark " + str(run), "Benchmark post.", author_name=player.key, author_player=player)
+        dispatch()
+
+    def catchup(run):
+        reader = players[(run + 1) % len(players)]
+        get_read_state().mark_boards_read(DefaultBoard.objects.get_readable_boards(reader), reader)
+
+    paths = [
+        ("get_all_visible_boards", lambda run: DefaultBoard.objects.get_all_visible_boards(player)),
+        ("by_board_for_player", lambda run: list(Post.objects.get_queryset().by_board_for_player(board, player))),
+        ("threads", lambda run: list(board.threads(player))),
+        ("search", lambda run: list(Post.objects.search(WORDS[run % len(WORDS)],
+                                                        boards=DefaultBoard.objects.get_readable_boards(player))[:20])),
+        ("resolve_id", resolve_id),
+        ("create_post", create_post),
+        ("catchup", catchup),
+    ]
+
+    # No one is really connected, so dispatch() would otherwise have no one to tell.
+    with mock.patch.object(SESSION_HANDLER, "all_connected_accounts", return_value=players):
+        return dict((name, measure(func, repeat)) for name, func in paths)
+
+
+def describe(options):
+    """
+    Returns the settings a benchmark ran under, to be stored alongside its results.
+
+    Args:
+        options (dict): The dataset options.
+
+    Returns:
+        A dictionary.
+
+    """
+    return {"options": options, "database": connection.vendor,
+            "read_state": getattr(settings, "PAXBOARDS_READ_STATE", "readers"),
+            "search_backend": getattr(settings, "PAXBOARDS_SEARCH_BACKEND", None),
+            "date": timezone.now().isoformat()}
+
+
+def compare(results, previous):
+    """
+    Lines up two sets of results.
+
+    Args:
+        results (dict): The path results from this run.
+        previous (dict): The path results from an earlier run.
+
+    Returns:
+        A list of (name, seconds, previous seconds, queries, previous queries) tuples; the
+        previous values are None for paths the earlier run didn't have.
+
+    """
+    rows = []
+    for name, result in results.items():
+        old = previous.get(name, {})
+        rows.append((name, result["seconds"], old.get("seconds"), result["queries"], old.get("queries")))
+
+    return rows
@@ -1,10 +1,18 @@
 from evennia.typeclasses.models import TypeclassBase
-from paxboards.models import Post, BoardDB
+from paxboards.models import Post, BoardDB, SubscriptionMode, PendingDigest
 from paxboards.managers import BoardManager
+from paxboards.search import index_posts
+from paxboards.notify import queue_post, DELIVERY_MODES
+from paxboards.access import cached_access
+from paxboards.readstate import get_read_state
 from future.utils import with_metaclass
 from server.conf import settings
+from django.db import transaction, IntegrityError
 from django.utils import timezone
 
+# How many times to try allocating a new post's number before giving up.
+SEQ_ATTEMPTS = 5
+
 
 class DefaultBoard(with_metaclass(TypeclassBase, BoardDB)):
 
@@ -29,6 +37,28 @@ class DefaultBoard(with_metaclass(TypeclassBase, BoardDB)):
     def at_board_creation(self):
         pass
 
+    def access(self, accessing_obj, access_type='read', default=False, no_superuser_bypass=False, **kwargs):
+        """
+        Determines if an account has the given access to this board.  This is the usual lock
+        check, but the decisions are cached (see paxboards.access), so listing many boards doesn't
+        run the lock parser over and over.
+
+        Args:
+            accessing_obj (AccountDB): The account trying to access the board.
+            access_type (str): The type of access sought.
+            default (bool): What to return if no lock of access_type was found.
+            no_superuser_bypass (bool): Turn off the superuser lock bypass.
+
+        Returns:
+            True or False.
+
+        """
+        def check():
+            return super(DefaultBoard, self).access(accessing_obj, access_type=access_type, default=default,
+                                                    no_superuser_bypass=no_superuser_bypass, **kwargs)
+
+        return cached_access(self, check, accessing_obj, access_type, default, no_superuser_bypass)
+
     def posts(self, player=None):
         """
         Convenience function, pulls all the posts for a given player's viewpoint.
@@ -65,13 +95,15 @@ class DefaultBoard(with_metaclass(TypeclassBase, BoardDB)):
         """
         return self.db_subscriptions.all()
 
-    def set_subscribed(self, player, subscribed):
+    def set_subscribed(self, player, subscribed, mode=None):
         """
         Sets whether or not a given player is subscribed to the board.
 
         Args:
             player (AccountDB): A player to subscribe or unsubscribe.
             subscribed (boolean): Whether or not to be subscribed.
+            mode (str): How the player hears about new posts, one of notify.DELIVERY_MODES.  If
+                None, an existing subscription keeps its mode, and a new one is "immediate".
 
         Returns:
             None
@@ -79,10 +111,51 @@ class DefaultBoard(with_metaclass(TypeclassBase, BoardDB)):
         """
         if subscribed:
             self.db_subscriptions.add(player)
+            if mode:
+                self.set_subscription_mode(player, mode)
         else:
             self.db_subscriptions.remove(player)
+            SubscriptionMode.objects.filter(db_account=player, db_board=self).delete()
+            PendingDigest.objects.filter(db_account=player, db_board=self).delete()
         self.save()
 
+    def subscription_mode(self, player):
+        """
+        Returns how a given player hears about new posts on the board.
+
+        Args:
+            player (AccountDB): The player to check.
+
+        Returns:
+            One of notify.DELIVERY_MODES.
+
+        """
+        mode = SubscriptionMode.objects.filter(db_account=player, db_board=self).values_list('db_mode', flat=True)
+        return mode.first() or "immediate"
+
+    def set_subscription_mode(self, player, mode):
+        """
+        Sets how a given player hears about new posts on the board.  Any digest already waiting
+        still goes out as it would have.
+
+        Args:
+            player (AccountDB): The player, who should be subscribed to the board.
+            mode (str): One of notify.DELIVERY_MODES.
+
+        Returns:
+            True if the mode was set, False if it isn't a known mode.
+
+        """
+        if mode not in DELIVERY_MODES:
+            return False
+
+        if mode == "immediate":
+            SubscriptionMode.objects.filter(db_account=player, db_board=self).delete()
+        else:
+            SubscriptionMode.objects.update_or_create(db_account=player, db_board=self, defaults={'db_mode': mode})
+
+        return True
+
     def mark_all_read(self, caller):
         """
         Mark all the posts on a given board read.
@@ -91,18 +164,13 @@ class DefaultBoard(with_metaclass(TypeclassBase, BoardDB)):
             caller: The player for whom these posts should be marked read.
 
         Returns:
-            None
+            The number of posts marked read.
 
         """
         if not self.access(caller, access_type="read", default=True):
-            return
-
-        posts = self.posts(caller)
-        for p in posts:
-            if p.is_unread:
-                p.mark_read(caller, True)
+            return 0
 
-        return
+        return get_read_state().mark_boards_read([self], caller)
 
     def is_unread(self):
         if hasattr(self, 'unread_count'):
@@ -136,34 +204,42 @@ class DefaultBoard(with_metaclass(TypeclassBase, BoardDB)):
         if not text or len(text) == 0:
             return False
 
-        p = Post(db_poster_player=author_player,
-                 db_poster_object=author_object,
-                 db_date_created=timezone.now(),
-                 db_subject=subject,
-                 db_board=self,
-                 db_text=text,
-                 db_poster_name=author_name,
-                 db_pinned=False,
-                 db_parent=parent)
-        p.save()
+        # Where the database can't lock the board (SQLite), two posts made at once can be given
+        # the same number; the unique (board, seq) constraint turns one away, and it tries again.
+        for attempt in range(SEQ_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    p = Post(db_poster_player=author_player,
+                             db_poster_object=author_object,
+                             db_date_created=timezone.now(),
+                             db_subject=subject,
+                             db_board=self,
+                             db_poster_name=author_name,
+                             db_pinned=False,
+                             db_parent=parent,
+                             db_seq=Post.objects.get_queryset().next_seq(self))
+                    p.set_text(text)
+                    p.save()
+                break
+            except IntegrityError:
+                if attempt == SEQ_ATTEMPTS - 1:
+                    raise
 
         # If we are a player, mark our own post read.
         if author_player:
-            p.db_readers.add(author_player)
+            get_read_state().mark_read([p], author_player)
 
+        p.db_last_post = p
+        p.db_last_post_on = p.db_date_created
+        p.db_last_poster = p.db_poster_name
         p.save()
 
-        postnum = p.post_num or None
-
-        # Give up
-        if not postnum:
-            return p
+        if parent:
+            parent.thread.update_thread_summary(reply=p)
 
-        announcement = "|/New post by |555" + p.db_poster_name + ":|n (" + self.name + "/" + \
-                       str(postnum) + ") |555" + p.db_subject + "|n|/"
+        index_posts([p])
 
-        subs = self.subscribers()
-        for s in subs:
-            s.msg(announcement)
+        # Subscribers are told about it shortly, in the background.
+        queue_post(p)
 
         return p
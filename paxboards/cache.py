@@ -0,0 +1,95 @@
+"""
+In-memory caches for Paxboards.
+
+The rendered text of posts read in-game is kept in RENDER_CACHE, a bounded least-recently-used
+cache, so a popular post is only built once rather than each time someone reads it.  Its size is
+set by PAXBOARDS_RENDER_CACHE_SIZE (default 500 posts), and its hit and miss counts are shown by
+`bbadmin/stats`.
+
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class LRUCache(object):
+    """
+    A dictionary-like cache which holds at most a given number of entries, throwing out the least
+    recently used one to make room for a new one.  Entries can also be dropped by a 'group' (the
+    first element of their key), which is how all the renderings of one post are invalidated at
+    once.
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the entry for a key, or None if there isn't one.
+
+        Args:
+            key (tuple): The key to look up.
+
+        Returns:
+            The cached value, or None.
+
+        """
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Stores the entry for a key, making room for it if need be.
+
+        Args:
+            key (tuple): The key to store under.
+            value: The value to store.
+
+        """
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, groups):
+        """
+        Drops every entry whose key begins with one of the given values.
+
+        Args:
+            groups (iterable): The first key elements (e.g. post ids) to drop entries for.
+
+        """
+        groups = set(groups)
+        for key in [k for k in self.entries if k[0] in groups]:
+            del self.entries[key]
+
+    def clear(self):
+        """
+        Drops every entry.
+
+        """
+        self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache's counters.
+
+        Returns:
+            A dictionary of 'hits', 'misses' and 'size'.
+
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+RENDER_CACHE = LRUCache(getattr(settings, "PAXBOARDS_RENDER_CACHE_SIZE", 500))
@@ -1,13 +1,24 @@
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.utils import timezone
 from evennia import default_cmds
 from evennia.locks.lockhandler import LockException
-from evennia import CmdSet
-from evennia.utils import evtable
+from evennia import CmdSet, create_script, search_script
+from evennia.utils import evtable, delay
 from typeclasses.characters import Character
 from typeclasses.objects import Object
 
 from .board_utils import *
 from .boards import DefaultBoard
-from .models import Post
+from .models import Post, SubscriptionMode
+from .search import index_posts, rebuild_index, SEARCH_PAGE_SIZE
+from .readstate import get_read_state, migrate_readers
+from .access import access_cache_stats, clear_access_cache
+from .cache import RENDER_CACHE
+from .notify import DELIVERY_MODES
+from .routers import command_actor
 
 def is_positive_int(string):
     """
@@ -27,10 +38,42 @@ def is_positive_int(string):
     except ValueError:
         return False
 
+def parse_date(string):
+    """
+    Parses a date given as YYYY/MM/DD (or YYYY-MM-DD), as midnight in the server's time zone.
+
+    Args:
+        string (str): A string to parse.
+
+    Returns:
+        A datetime, or None if the string isn't a date.
+    """
+    for fmt in ("%Y/%m/%d", "%Y-%m-%d"):
+        try:
+            date = datetime.strptime(string.strip(), fmt)
+        except ValueError:
+            continue
+
+        return timezone.make_aware(date) if settings.USE_TZ else date
+
+    return None
+
+
 class BoardAdminCmd(default_cmds.MuxCommand):
     """
     bbadmin/create <name>
     bbadmin/lock <board>[=lock]
+    bbadmin/maxdays <board>[=days]
+    bbadmin/maxposts <board>[=posts]
+    bbadmin/reindex
+    bbadmin/rerender
+    bbadmin/migratereads
+    bbadmin/expire
+    bbadmin/stats
+    bbadmin/delete <board>/<post>[-<post>]
+    bbadmin/move <board>/<post>[-<post>]=<board>
+    bbadmin/purge <board or "all">=<poster>
+    bbadmin/purge/before <board or "all">=<YYYY/MM/DD>
 
     The first form of the command will create a new board.  The name must be unique,
     and cannot be solely an integer string.
@@ -46,12 +89,40 @@ class BoardAdminCmd(default_cmds.MuxCommand):
 
     Wizards and Immortals have all permissions by default.
 
+    The maxdays and maxposts forms set how long posts on a board stay visible, and
+    how many are shown at most; leave the value off to clear the limit.
+
+    The reindex form rebuilds the search index from every post on the game.  It
+    runs in the background, a batch at a time, and reports when it is done.
+
+    The rerender form works out the stored plaintext and HTML versions of any
+    posts made before they were kept, for the web pages.  It also runs in the
+    background, a batch at a time.
+
+    The migratereads form builds per-board read watermarks from the existing
+    per-post read records, one board at a time, in preparation for switching
+    PAXBOARDS_READ_STATE to "watermark".
+
+    The expire form starts the background script which clears expired posts off
+    the boards (archiving or deleting them, per PAXBOARDS_EXPIRY_POLICY), if it
+    isn't already running, and shows what its last run did.
+
+    The stats form shows how well the board caches are doing.
+
+    The delete form deletes a post, or a range of posts by number, at once; any
+    replies left behind move up, as with bboard/delete.  The move form moves a
+    post or range of posts to another board, taking the rest of their threads
+    along.  The purge forms delete every post by a given poster, or every post
+    made before a given date, on a board or on all of them.  Each is done in a
+    single transaction, and reports how many rows it changed.
+
     """
     key = "bbadmin"
     aliases = ["@bbadmin", "forumadmin", "@forumadmin"]
     locks = "cmd:perm(Wizards) OR perm(bbadmin)"
     help_category = "Forum"
 
+    @command_actor
     def func(self):
         if "create" in self.switches:
             testboard = DefaultBoard.objects.get_board_exact(self.args)
@@ -98,6 +169,8 @@ class BoardAdminCmd(default_cmds.MuxCommand):
                 self.msg(err)
                 return
 
+            # Decisions made under the old locks can't be used again, so don't keep them around.
+            clear_access_cache()
             self.msg("Lock(s) applied.")
             string = "Current locks on %s: %s" % (board.name, board.locks)
             self.msg(string)
@@ -129,6 +202,10 @@ class BoardAdminCmd(default_cmds.MuxCommand):
                 self.msg("Board expiry set to " + str(board.db_expiry_duration) + " days.")
 
             board.save()
+
+            # Expired posts may have been cleared off the board, leaving gaps in its sequence
+            # numbers below the window; close them up before a bigger window can reach them.
+            Post.objects.get_queryset().renumber(board)
             return
 
         if "maxposts" in self.switches:
@@ -157,17 +234,208 @@ class BoardAdminCmd(default_cmds.MuxCommand):
                 self.msg("Board post maximum set to " + str(board.db_expiry_maxposts) + " posts.")
 
             board.save()
+
+            # Expired posts may have been cleared off the board, leaving gaps in its sequence
+            # numbers below the window; close them up before a bigger window can reach them.
+            Post.objects.get_queryset().renumber(board)
+            return
+
+        if "reindex" in self.switches:
+            self.msg("Rebuilding the board search index...")
+            self.reindex_batch(0, 0)
+            return
+
+        if "rerender" in self.switches:
+            self.msg("Converting old posts for the web...")
+            self.rerender_batch(0, 0)
+            return
+
+        if "migratereads" in self.switches:
+            self.msg("Migrating board read state to watermarks...")
+            self.migrate_reads_batch(list(DefaultBoard.objects.all().values_list('id', flat=True)))
+            return
+
+        if "expire" in self.switches:
+            script = search_script("paxboards_expiry").first()
+            if not script:
+                script = create_script("paxboards.scripts.BoardExpiryScript")
+                self.msg("Started the board expiry script.")
+
+            run = script.db.last_run
+            if not run:
+                self.msg("The board expiry script hasn't finished a run yet.")
+                return
+
+            totals = script.db.totals
+            self.msg("Last expiry run: " + str(run["posts"]) + " posts (" + str(run["readers"]) +
+                     " reader records) " + ("deleted" if run["policy"] == "delete" else "archived") + " from " +
+                     str(run["boards"]) + " boards in " + str(run["seconds"]) + "s.")
+            self.msg("In total: " + str(totals["posts"]) + " posts, " + str(totals["readers"]) + " reader records.")
+            return
+
+        if "stats" in self.switches:
+            stats = access_cache_stats()
+            self.msg("Access cache: " + str(stats["hits"]) + " hits, " + str(stats["misses"]) + " misses, " +
+                     str(stats["uncached"]) + " uncacheable checks, " + str(stats["size"]) + " entries.")
+            stats = RENDER_CACHE.stats()
+            self.msg("Rendered post cache: " + str(stats["hits"]) + " hits, " + str(stats["misses"]) + " misses, " +
+                     str(stats["size"]) + " entries.")
+            return
+
+        if "delete" in self.switches:
+            result = self.resolve_range(self.lhs)
+            if not result:
+                return
+
+            counts = Post.objects.delete_posts(result["posts"])
+            self.msg("Deleted " + self.describe_counts(counts) + ".")
+            return
+
+        if "move" in self.switches:
+            result = self.resolve_range(self.lhs)
+            if not result:
+                return
+
+            if not self.rhs:
+                self.msg("You must provide a board to move the posts to.")
+                return
+
+            target = DefaultBoard.objects.get_board(self.rhs)
+            if not target:
+                self.msg("No board matches '" + self.rhs + "'")
+                return
+
+            counts = Post.objects.move_posts(result["posts"], target)
+            self.msg("Moved " + str(counts["posts"]) + " posts (" + str(counts["threads"]) + " threads) to " +
+                     target.name + ".")
+            return
+
+        if "purge" in self.switches:
+            if not self.lhs or not self.rhs:
+                self.msg("You must provide a board (or 'all') and a " +
+                         ("date." if "before" in self.switches else "poster."))
+                return
+
+            posts = Post.objects.all()
+            if self.lhs.lower() != "all":
+                board = DefaultBoard.objects.get_board(self.lhs)
+                if not board:
+                    self.msg("No board matches '" + self.lhs + "'")
+                    return
+                posts = posts.filter(db_board=board)
+
+            if "before" in self.switches:
+                date = parse_date(self.rhs)
+                if not date:
+                    self.msg("The date must be in the form YYYY/MM/DD.")
+                    return
+                posts = posts.filter(db_date_created__lt=date)
+            else:
+                posts = posts.filter(db_poster_name__iexact=self.rhs)
+
+            counts = Post.objects.delete_posts(posts)
+            self.msg("Purged " + self.describe_counts(counts) + ".")
             return
 
         self.msg("Unknown switch.  Please see {555help " + self.cmdstring + "{n for help.")
 
+    def resolve_range(self, string):
+        """
+        Helper function which, given a string, will resolve it into a board and a range of its
+        posts.  The string should be in the format "<board>/<post>[-<post>]", where the posts
+        are numbered as in the board's listing.
+
+        Args:
+            string: The string to resolve
+
+        Returns:
+            A dictionary containing 'board' and 'posts' (a queryset), or None.
+
+        """
+        readargs = (string or "").split('/', 1)
+        if len(readargs) != 2:
+            self.msg("You must provide a board and post numbers, e.g. <board>/3 or <board>/3-10.")
+            return None
+
+        numbers = readargs[1].split('-', 1)
+        if not all(is_positive_int(n) for n in numbers) or int(numbers[0]) > int(numbers[-1]):
+            self.msg("The post numbers '" + readargs[1] + "' must be a positive integer or a range.")
+            return None
+
+        board = DefaultBoard.objects.get_board(readargs[0])
+        if not board:
+            self.msg("No board matches '" + readargs[0] + "'")
+            return None
+
+        posts = Post.objects.get_queryset().by_board_range(board, int(numbers[0]), int(numbers[-1]))
+        return {"board": board, "posts": posts}
+
+    def describe_counts(self, counts):
+        return str(counts["posts"]) + " posts (" + str(counts["replies"]) + " replies moved up, " + \
+            str(counts["readers"]) + " read records, " + str(counts["threads"]) + " thread summaries updated)"
+
+    def migrate_reads_batch(self, board_ids):
+        """
+        Migrates the read state of one board, then schedules the next one.
+
+        Args:
+            board_ids (list): The ids of the boards still to migrate.
+
+        """
+        if not board_ids:
+            self.msg("Read state migration complete.")
+            return
+
+        board = DefaultBoard.objects.get_board_id(board_ids[0])
+        count = migrate_readers(board)
+        self.msg("Migrated read state for " + str(count) + " players on " + board.name + ".")
+
+        delay(0, self.migrate_reads_batch, board_ids[1:])
+
+    def rerender_batch(self, after, total):
+        """
+        Converts one batch of posts, then schedules the next one.
+
+        Args:
+            after (int): The id of the last post converted so far.
+            total (int): The number of posts converted so far.
+
+        """
+        count, last_id = Post.objects.backfill_renderings(after)
+        total += count
+
+        if last_id is None:
+            self.msg("Post conversion complete: " + str(total) + " posts converted.")
+            return
+
+        delay(0, self.rerender_batch, last_id, total)
+
+    def reindex_batch(self, after, total):
+        """
+        Indexes one batch of posts, then schedules the next one, so a large archive never holds
+        up the server for long.
+
+        Args:
+            after (int): The id of the last post indexed so far.
+            total (int): The number of posts indexed so far.
+
+        """
+        count, last_id = rebuild_index(after)
+        total += count
+
+        if last_id is None:
+            self.msg("Search index rebuilt: " + str(total) + " posts indexed.")
+            return
+
+        delay(0, self.reindex_batch, last_id, total)
+
 
 class BoardCmd(default_cmds.MuxCommand):
     """
     bboard [board[/post]]
     bboard/read [board[/post]]
     bboard/post <board>/<subject>=<post>
-    bboard/sub <board>
+    bboard/sub <board>[=<immediate, hourly or login>]
     bboard/unsub <board>
     bboard/edit <board>/<post>=<newpost>
     bboard/delete <board>/<post>
@@ -175,6 +443,7 @@ class BoardCmd(default_cmds.MuxCommand):
     bboard/new [board]
     bboard/catchup [board or "all"]
     bboard/search [board/]<search>
+    bboard/search/more
     bboard/reply <board>/<post>=<reply>
     bboard/thread <board>/<post>
 
@@ -186,16 +455,22 @@ class BoardCmd(default_cmds.MuxCommand):
     The third form will make a post to a given bboard.
 
     The fourth and fifth will toggle your subscriptions on and off, controlling
-    whether or not you see notifications of new posts on that board.
+    whether or not you see notifications of new posts on that board.  A
+    subscription can be set to tell you about each new post as it's made
+    (immediate, the default), or to save them up for an hourly digest, or for
+    a digest when you next log in.
 
     The fifth will edit a post you have permissions to edit, The sixth will delete a
     post you have permission to delete.
 
     The seventh will show you only the boards with unread posts, the eighth will read
-    the next unread post on the given board, or globally, and the ninth will mark all
+    the next unread post on the given board, or on any board you're subscribed to
+    (pinned posts first, then the oldest), and the ninth will mark all
     posts read on the given board (or 'all').
 
-    The tenth will search bboards for posts containing a given term.
+    The tenth will search bboards for posts matching a given term, in their subject,
+    poster or text, best matches first.  Only the first page of matches is shown;
+    bboard/search/more shows the next page of your last search.
 
     The eleventh will reply to an existing post, creating a thread, while the twelfth
     will show all posts in a given thread.
@@ -233,7 +508,7 @@ class BoardCmd(default_cmds.MuxCommand):
                 self.msg("The post identifier '" + readargs[1] + "' must be a positive integer!")
                 return None
 
-        board = DefaultBoard.objects.get_visible_board(self.account, boardname)
+        board = DefaultBoard.objects.get_visible_board(self.account, boardname, counts=False)
         if not board:
             self.msg("Unable to find a board matching '" + string + "'!")
             return None
@@ -241,36 +516,50 @@ class BoardCmd(default_cmds.MuxCommand):
         if len(readargs) == 1:
             return {"board": board, "post": None, "postnum": 0}
 
-        posts = board.posts(self.account)
+        post = Post.objects.post_by_number(board, postnum, self.account)
 
-        if not (0 < postnum <= len(posts)):
+        if not post:
             self.msg("There's no post by that number.")
             return
 
-        post = posts[postnum - 1]
-
         return {"board": board, "post": post, "postnum": postnum}
 
+    def subscribed_labels(self, player):
+        """
+        Helper function which works out what to show in the "Sub'd" column of the board list
+        for each board a player is subscribed to.
+
+        Args:
+            player (AccountDB): The player whose subscriptions should be checked.
+
+        Returns:
+            A dictionary of board id to label: "Yes", or the delivery mode if it isn't immediate.
+
+        """
+        modes = dict(SubscriptionMode.objects.filter(db_account=player).values_list('db_board_id', 'db_mode'))
+        return dict((board_id, modes.get(board_id, "yes").capitalize())
+                    for board_id in player.board_subscriptions.values_list('id', flat=True))
+
     # This is overly long, and could potentially use a refactor to split the switches out
     # into their own functions.
+    @command_actor
     def func(self):
         caller = self.account
 
-        boards = DefaultBoard.objects.get_all_visible_boards(caller)
         shortcut = False
         if self.cmdstring in ["@bbread", "@bbnew"]:
             shortcut = True
 
         if "read" in self.switches or "thread" in self.switches or self.cmdstring == "@bbread" or (len(self.switches) == 0 and not shortcut):
             if not self.lhs:
+                boards = DefaultBoard.objects.get_all_visible_boards(caller)
+                subscribed = self.subscribed_labels(caller)
                 table = evtable.EvTable("#", "Name", "Unread", "Total", "Sub'd")
                 counter = 0
                 for board in boards:
                     counter += 1
 
-                    subbed = " "
-                    if board.subscribers().filter(pk=caller.pk).exists():
-                        subbed = "Yes"
+                    subbed = subscribed.get(board.id, " ")
 
                     table.add_row(counter, board.name, board.unread_count, board.total_count, subbed)
 
@@ -313,8 +602,7 @@ class BoardCmd(default_cmds.MuxCommand):
                             post = post.db_parent
 
                     post.display_post(caller, show_replies=("thread" in self.switches))
-                    post.db_readers.add(caller)
-                    post.save()
+                    post.mark_read(caller, True)
 
                     return
 
@@ -342,15 +630,15 @@ class BoardCmd(default_cmds.MuxCommand):
             return
 
         if "scan" in self.switches:
+            boards = DefaultBoard.objects.get_all_visible_boards(caller)
+            subscribed = self.subscribed_labels(caller)
             table = evtable.EvTable("#", "Name", "Unread", "Total", "Sub'd")
             counter = 0
             has_unread = False
             for board in boards:
                 counter += 1
 
-                subbed = " "
-                if board.subscribers().filter(pk=caller.pk).exists():
-                    subbed = "Yes"
+                subbed = subscribed.get(board.id, " ")
 
                 if board.unread_count > 0:
                     has_unread = True
@@ -364,34 +652,21 @@ class BoardCmd(default_cmds.MuxCommand):
 
         if "new" in self.switches or self.cmdstring == "@bbnew":
             if not self.lhs:
-                for b in boards:
-
-                    if b.subscribers().filter(pk=caller.pk).exists():
-                        posts = b.posts(caller)
-                        for p in posts:
-                            if p.is_unread:
-                                p.display_post(caller)
-                                p.mark_read(caller, True)
-                                return
+                subscribed = set(caller.board_subscriptions.values_list('id', flat=True))
+                boards = [b for b in DefaultBoard.objects.get_readable_boards(caller) if b.id in subscribed]
+            else:
+                result = self.resolve_id(self.lhs)
+                if not result:
+                    return
 
-                self.msg("No unread posts!")
-                return
+                boards = [result["board"]]
 
-            result = self.resolve_id(self.lhs)
-            board = result["board"]
-            if not board:
-                self.msg("Unable to find a board matching '" + self.lhs+ "'!")
+            post = Post.objects.get_queryset().first_unread(boards, caller)
+            if post:
+                post.display_post(caller)
+                post.mark_read(caller, True)
                 return
 
-            posts = board.posts(caller)
-            postcounter = 0
-            for p in posts:
-                postcounter += 1
-                if p.is_unread:
-                    p.display_post(caller)
-                    p.mark_read(caller, True)
-                    return
-
             self.msg("No unread posts!")
             return
 
@@ -401,11 +676,11 @@ class BoardCmd(default_cmds.MuxCommand):
                 return
 
             if self.lhs == "all":
-                boards = DefaultBoard.objects.get_all_visible_boards(caller)
-                for b in boards:
-                    b.mark_all_read(caller)
+                started = time.time()
+                boards = DefaultBoard.objects.get_readable_boards(caller)
+                count = get_read_state().mark_boards_read(boards, caller)
 
-                self.msg("All boards marked read.")
+                self.msg("All boards marked read (%d posts in %.2fs)." % (count, time.time() - started))
                 return
 
             result = self.resolve_id(self.lhs)
@@ -414,8 +689,8 @@ class BoardCmd(default_cmds.MuxCommand):
                 self.msg("Unable to find a board matching '" + self.lhs+ "'!")
                 return
 
-            board.mark_all_read(caller)
-            self.msg("All posts on " + board.name + " marked read.")
+            count = board.mark_all_read(caller)
+            self.msg("All posts on " + board.name + " marked read (" + str(count) + " posts).")
             return
 
         if "post" in self.switches:
@@ -434,7 +709,7 @@ class BoardCmd(default_cmds.MuxCommand):
                 self.msg("It wouldn't do much good to make an empty post, would it?")
                 return
 
-            board = DefaultBoard.objects.get_visible_board(caller, boardname)
+            board = DefaultBoard.objects.get_visible_board(caller, boardname, counts=False)
             if not board:
                 self.msg("Unable to find a unique board matching '" + self.lhs + "'")
                 return
@@ -525,51 +800,83 @@ class BoardCmd(default_cmds.MuxCommand):
                 self.msg("You must provide a bboard to " + ("subscribe" if sub else "unsubscribe") + "to.")
                 return
 
-            board = DefaultBoard.objects.get_visible_board(caller, self.lhs)
+            mode = self.rhs.strip().lower() if sub and self.rhs else None
+            if mode and mode not in DELIVERY_MODES:
+                self.msg("The delivery mode must be one of: " + ", ".join(DELIVERY_MODES) + ".")
+                return
+
+            board = DefaultBoard.objects.get_visible_board(caller, self.lhs, counts=False)
             if not board:
                 self.msg("Unable to find a unique board matching '" + self.lhs + "'")
                 return
 
-            board.set_subscribed(caller, sub)
-            self.msg("Subscribed to " + board.name if sub else "Unsubscribed from " + board.name)
+            board.set_subscribed(caller, sub, mode=mode)
+
+            if mode == "hourly" and not search_script("paxboards_digest"):
+                create_script("paxboards.scripts.DigestScript")
+
+            if not sub:
+                self.msg("Unsubscribed from " + board.name)
+            elif mode and mode != "immediate":
+                self.msg("Subscribed to " + board.name + ", with " +
+                         ("an hourly digest." if mode == "hourly" else "a digest when you log in."))
+            else:
+                self.msg("Subscribed to " + board.name)
             return
 
         if "search" in self.switches:
-            if not self.lhs:
-                self.msg("You must provide a search term.")
-                return
+            if "more" in self.switches:
+                search = caller.ndb.bboard_search
+                if not search:
+                    self.msg("You don't have a search in progress.")
+                    return
+            else:
+                if not self.lhs:
+                    self.msg("You must provide a search term.")
+                    return
 
-            readargs = self.lhs.split('/', 1)
-            searchterm = None
-            boardname = None
-            board = None
-            if len(readargs) == 1:
-                if self.rhs:
-                    searchterm = self.rhs
-                    boardname = self.lhs
-                else:
-                    searchterm = self.lhs
-            elif len(readargs) == 2:
-                searchterm = readargs[1]
-                boardname = readargs[0]
+                readargs = self.lhs.split('/', 1)
+                searchterm = None
+                boardname = None
+                board = None
+                if len(readargs) == 1:
+                    if self.rhs:
+                        searchterm = self.rhs
+                        boardname = self.lhs
+                    else:
+                        searchterm = self.lhs
+                elif len(readargs) == 2:
+                    searchterm = readargs[1]
+                    boardname = readargs[0]
+
+                if boardname:
+                    board = DefaultBoard.objects.get_visible_board(caller, boardname, counts=False)
+                    if not board:
+                        self.msg("Unable to find a unique board batching '" + boardname + "'")
+                        return
 
-            if boardname:
-                board = DefaultBoard.objects.get_visible_board(caller, boardname)
-                if not board:
-                    self.msg("Unable to find a unique board batching '" + boardname + "'")
-                    return
+                search = {"term": searchterm, "board": board, "boardname": boardname, "offset": 0}
 
-            posts = Post.objects.search(searchterm, board)
-            if len(posts) == 0:
-                self.msg("No posts matching search term.")
+            if search["board"]:
+                posts = Post.objects.search(search["term"], board=search["board"])
+            else:
+                posts = Post.objects.search(search["term"],
+                                            boards=DefaultBoard.objects.get_readable_boards(caller))
+
+            offset = search["offset"]
+            page = list(posts[offset:offset + SEARCH_PAGE_SIZE])
+            if not page:
+                caller.ndb.bboard_search = None
+                self.msg("No posts matching search term." if not offset else "No more posts matching search term.")
                 return
 
+            numbers = Post.objects.get_queryset().post_numbers(page)
             table = evtable.EvTable("", "Poster", "Subject", "Date")
-            for post in posts:
-                postnum = post.post_num
+            for post in page:
+                postnum = numbers[post.id]
                 if postnum:
-                    if boardname:
-                        postid = boardname + "/" + str(postnum)
+                    if search["boardname"]:
+                        postid = search["boardname"] + "/" + str(postnum)
                     else:
                         postid = post.db_board.name + "/" + str(postnum)
                 else:
@@ -583,6 +890,15 @@ class BoardCmd(default_cmds.MuxCommand):
                               post.db_subject, datestring)
 
             self.msg(table)
+
+            total = posts.count()
+            search["offset"] = offset + len(page)
+            if search["offset"] < total:
+                caller.ndb.bboard_search = search
+                self.msg("Showing " + str(offset + 1) + "-" + str(search["offset"]) + " of " + str(total) +
+                         " matches.  Use |555" + self.cmdstring + "/search/more|n to see more.")
+            else:
+                caller.ndb.bboard_search = None
             return
 
         if "edit" in self.switches:
@@ -603,8 +919,9 @@ class BoardCmd(default_cmds.MuxCommand):
                 self.msg("You can't edit that post!")
                 return
 
-            post.db_text = self.rhs
+            post.set_text(self.rhs)
             post.save()
+            index_posts([post])
             self.msg("Post updated.")
             return
 
@@ -626,13 +943,8 @@ class BoardCmd(default_cmds.MuxCommand):
                 self.msg("You can't delete that post!")
                 return
 
-            # TODO: Should we delete this or just unlink it?
-            replies = Post.objects.filter(db_parent=post)
-            for r in replies:
-                r.db_parent = post.db_parent
-                r.save()
-
-            post.delete()
+            # The replies are kept, moved up to whatever the post replied to.
+            Post.objects.delete_posts(Post.objects.filter(pk=post.pk))
             self.msg("Post deleted.")
             return
 
@@ -0,0 +1,157 @@
+"""
+Index support for Paxboards.
+
+Most of the indexes the boards rely on are declared on the models (see Post.Meta), and are made
+by `evennia makemigrations paxboards` and `evennia migrate` like any others.  The one exception is
+the (player, post) index on the Post.db_readers table: Django makes that table itself, and it only
+comes with a (post, player) unique index, which is no help when looking for everything one player
+has read.  It's added here instead, whenever `evennia migrate` is run.
+
+To check that the database's plans for the main board queries actually use the indexes, run
+
+    evennia paxboards_explain [--board <name>] [--account <name>] [--verbose]
+
+which runs EXPLAIN on each of them against the configured database and lists any which fall back
+to scanning a whole Paxboards table.
+
+"""
+import re
+
+from django.db import connection, connections, router, transaction
+from django.db.models import Count, Index
+
+READERS_INDEX = "paxboards_readers_account"
+
+# How each database reports a full scan of a table in its EXPLAIN output.  SQLite's is a SCAN
+# without an index (naming the table's alias, if it has one, in newer versions); PostgreSQL's a
+# sequential scan; MySQL's (in JSON format) an access type of ALL.
+SCANS = {
+    "sqlite": re.compile(r"\bSCAN (?:TABLE \w+ AS |TABLE )?(\w+)\s*$", re.MULTILINE),
+    "postgresql": re.compile(r"\bSeq Scan on (\w+)"),
+    "mysql": re.compile(r'"table_name": "(\w+)",\s*"access_type": "ALL"'),
+}
+
+# The aliases Django gives tables in subqueries and joins (U0, T2 and so on), as they appear in SQL.
+ALIASES = re.compile(r'(?:FROM|JOIN)\s+["`]?(\w+)["`]?\s+(?:AS\s+)?["`]?([A-Z]\d+)["`]?')
+
+
+def setup_indexes(using=None):
+    """
+    Adds the (player, post) index to the Post.db_readers table, if it isn't there already.
+
+    Args:
+        using (str): The database to add it to; by default, the one the boards write to.
+
+    """
+    from .models import Post
+
+    readers = Post.db_readers.through
+    connection = connections[using or router.db_for_write(Post)]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, readers._meta.db_table)
+
+    if any(c["index"] and c["columns"] == ["accountdb_id", "post_id"] for c in constraints.values()):
+        return
+
+    with connection.schema_editor() as editor:
+        editor.add_index(readers, Index(fields=['accountdb', 'post'], name=READERS_INDEX))
+
+
+def board_queries(board, player):
+    """
+    Returns the main queries made against a board, as querysets, for checking their plans.
+
+    Args:
+        board (BoardDB): The board to query.
+        player (AccountDB): The player to check read state for.
+
+    Returns:
+        A list of (name, queryset) tuples.
+
+    """
+    from .models import Post
+    from .readstate import get_read_state
+
+    posts = Post.objects.get_queryset()
+    thread = posts.filter(db_board=board, db_parent__isnull=True).order_by('id').first()
+    pinned, first, last = posts.sequence_window(board)
+
+    queries = [
+        ("posts", posts.by_board(board).with_unread(player).order_by('-db_pinned', 'db_date_created', 'id')),
+        ("threads", posts.by_board_threaded_player(board, player)),
+        ("replies", posts.filter(db_parent=thread).order_by('db_date_created', 'id')),
+        ("post_by_number", posts.filter(db_board=board, db_seq=first)),
+        ("first_unread", posts.by_boards([board]).with_unread(player).filter(unread=True)
+            .order_by('-db_pinned', 'db_date_created', 'id')[:1]),
+        ("expiry_window", posts.filter(db_board=board, db_pinned=False).order_by('db_date_created', 'id')[:1]),
+        ("expired", posts.expired(board)),
+        ("read_counts", posts.filter(db_board=board, db_readers=player).order_by().values_list('db_board')
+            .annotate(read=Count('id'))),
+        ("unread_counts", get_read_state().annotate_unread(posts.by_boards([board]), player).filter(unread=True)
+            .order_by().values_list('db_board').annotate(unread=Count('id'))),
+        ("players_reads", Post.db_readers.through.objects.filter(accountdb_id=player.id)
+            .values_list('post_id', flat=True)),
+    ]
+
+    return queries
+
+
+def explain(queryset):
+    """
+    Returns the database's plan for a queryset, in whatever form it gives it.
+
+    """
+    if connection.vendor == "mysql":
+        return queryset.explain(format="json")
+
+    if connection.vendor == "postgresql":
+        # With only a few rows, the planner would rightly rather scan than use an index; this asks
+        # what it would do with the index as the only reasonable choice, i.e. on a large board.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            return queryset.explain()
+
+    return queryset.explain()
+
+
+def find_scans(plan, sql=""):
+    """
+    Finds the Paxboards tables a plan scans in full.
+
+    Args:
+        plan (str): The plan, as returned by explain().
+        sql (str): The query the plan is for, so that tables the plan names by their alias can
+            be recognized.
+
+    Returns:
+        A sorted list of table names.  This is always empty on databases whose plans aren't
+        understood.
+
+    """
+    pattern = SCANS.get(connection.vendor)
+    if not pattern:
+        return []
+
+    aliases = dict((alias, table) for table, alias in ALIASES.findall(sql))
+    tables = set(aliases.get(t, aliases.get(t.upper(), t)) for t in pattern.findall(plan))
+    return sorted(t for t in tables if t.startswith("paxboards_") and t != "paxboards_boarddb")
+
+
+def check_queries(board, player):
+    """
+    Explains each of the main board queries (see board_queries).
+
+    Args:
+        board (BoardDB): The board to query.
+        player (AccountDB): The player to check read state for.
+
+    Returns:
+        A list of (name, plan, scanned tables) tuples.
+
+    """
+    results = []
+    for name, queryset in board_queries(board, player):
+        plan = explain(queryset)
+        results.append((name, plan, find_scans(plan, str(queryset.query))))
+
+    return results
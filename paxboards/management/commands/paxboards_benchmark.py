@@ -0,0 +1,58 @@
+"""
+Runs the Paxboards load benchmarks; see paxboards.benchmarks.
+
+"""
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from paxboards import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Times the main Paxboards paths against a synthetic dataset, and reports the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--boards", type=int, default=5, help="Number of boards to generate.")
+        parser.add_argument("--posts", type=int, default=500, help="Number of posts per board, replies included.")
+        parser.add_argument("--accounts", type=int, default=20, help="Number of players to generate.")
+        parser.add_argument("--read-ratio", type=float, default=0.5, help="Fraction of posts each player has read.")
+        parser.add_argument("--thread-depth", type=int, default=2, help="Number of replies in each thread.")
+        parser.add_argument("--days", type=int, default=60, help="How many days back the posts go.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed, for repeatable datasets.")
+        parser.add_argument("--repeat", type=int, default=5, help="How many times to time each path.")
+        parser.add_argument("--output", help="File to write the results to, as JSON.")
+        parser.add_argument("--compare", help="A results file from an earlier run to compare against.")
+
+    def handle(self, *args, **options):
+        dataset = dict((key, options[key]) for key in ("boards", "posts", "accounts", "read_ratio", "thread_depth",
+                                                       "days", "seed"))
+
+        with transaction.atomic():
+            self.stderr.write("Generating dataset...")
+            data = benchmarks.generate(**dataset)
+
+            self.stderr.write("Timing...")
+            results = benchmarks.describe(dataset)
+            results["results"] = benchmarks.run(data, repeat=options["repeat"])
+
+            # Leave nothing behind.
+            transaction.set_rollback(True)
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                previous = json.load(f).get("results", {})
+
+            self.stderr.write("%-24s %12s %12s %8s %8s" % ("path", "seconds", "before", "queries", "before"))
+            for name, seconds, old_seconds, queries, old_queries in benchmarks.compare(results["results"], previous):
+                self.stderr.write("%-24s %12.6f %12s %8i %8s" % (name, seconds,
+                                                                 "-" if old_seconds is None else "%.6f" % old_seconds,
+                                                                 queries, "-" if old_queries is None else old_queries))
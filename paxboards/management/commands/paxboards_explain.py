@@ -0,0 +1,53 @@
+"""
+Checks the database's plans for the main Paxboards queries; see paxboards.indexes.
+
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from paxboards.boards import DefaultBoard
+from paxboards.indexes import check_queries
+
+
+class Command(BaseCommand):
+    help = "Runs EXPLAIN on the main Paxboards queries and reports any which scan a whole table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--board", help="The board to query; the default is the first one.")
+        parser.add_argument("--account", help="The player to check read state for; the default is the first one.")
+        parser.add_argument("--verbose", action="store_true", help="Show the full plan of every query.")
+
+    def handle(self, *args, **options):
+        from evennia.accounts.models import AccountDB
+
+        if options["board"]:
+            board = DefaultBoard.objects.get_board_exact(options["board"])
+        else:
+            board = DefaultBoard.objects.order_by('id').first()
+        if not board:
+            raise CommandError("No board to check against.")
+
+        if options["account"]:
+            player = AccountDB.objects.filter(username__iexact=options["account"]).first()
+        else:
+            player = AccountDB.objects.order_by('id').first()
+        if not player:
+            raise CommandError("No account to check against.")
+
+        self.stdout.write("Checking queries against '%s' for %s, on %s." % (board.name, player.username,
+                                                                            connection.vendor))
+
+        scanned = 0
+        for name, plan, scans in check_queries(board, player):
+            if scans:
+                scanned += 1
+                self.stdout.write("%-16s SCAN %s" % (name, ", ".join(scans)))
+            else:
+                self.stdout.write("%-16s ok" % name)
+
+            if options["verbose"] or scans:
+                self.stdout.write("    " + plan.replace("\n", "\n    "))
+
+        if scanned:
+            raise CommandError("%i queries scan a whole table; has `evennia migrate` been run since the last "
+                               "update?" % scanned)
@@ -0,0 +1,37 @@
+"""
+Exports Paxboards boards as JSON Lines; see paxboards.transfer.
+
+"""
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from paxboards.boards import DefaultBoard
+from paxboards.transfer import export_lines
+
+
+class Command(BaseCommand):
+    help = "Writes boards and their posts out as JSON Lines, for paxboards_import."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--board", action="append", help="A board to export (can be given more than once); "
+                                                             "the default is all of them.")
+        parser.add_argument("--output", help="File to write to; the default is standard output.")
+
+    def handle(self, *args, **options):
+        boards = None
+        if options["board"]:
+            boards = []
+            for name in options["board"]:
+                board = DefaultBoard.objects.get_board_exact(name)
+                if not board:
+                    raise CommandError("No board named '%s'." % name)
+                boards.append(board)
+
+        output = open(options["output"], "w") if options["output"] else sys.stdout
+        try:
+            for line in export_lines(boards):
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
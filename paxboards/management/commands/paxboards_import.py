@@ -0,0 +1,22 @@
+"""
+Imports Paxboards boards from JSON Lines, as written by paxboards_export; see paxboards.transfer.
+
+"""
+from django.core.management.base import BaseCommand
+
+from paxboards.transfer import BATCH_SIZE, import_lines
+
+
+class Command(BaseCommand):
+    help = "Loads boards and their posts from a JSON Lines file written by paxboards_export."
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="The file to import.")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Number of posts to insert at a time.")
+
+    def handle(self, *args, **options):
+        with open(options["file"]) as f:
+            counts = import_lines(f, batch_size=options["batch_size"])
+
+        self.stderr.write("Imported %(posts)i posts and %(readers)i reads; created %(boards)i boards; "
+                          "skipped %(skipped)i lines." % counts)
@@ -1,17 +1,24 @@
 from __future__ import print_function
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Q, F, Count, Max, Min, Exists, OuterRef, Case, When, Value
+from functools import reduce
+from operator import or_
 from itertools import chain
-from datetime import datetime
+from datetime import timedelta
+from django.utils import timezone
 from evennia.typeclasses.managers import (TypedObjectManager, TypeclassManager)
 
 _GA = object.__getattribute__
 _AccountDB = None
 _ObjectDB = None
 _BoardDB = None
+_Post = None
 _SESSIONS = None
 
+# Sequence numbers being shifted are parked this far up, well clear of any real post number.
+SEQ_OFFSET = 1 << 30
+
 
 def sort_date(post):
     result_time = 0
@@ -61,6 +68,21 @@ class PostQuerySet(models.query.QuerySet):
         """
         return self.filter(db_board=board)
 
+    def active_filter(self, board, window=None):
+        """
+        Returns a Q object matching the active posts on a board, honoring expiry limits.
+
+        Args:
+            board (Board): The BoardDB object to use.
+            window (tuple): The board's sequence window, if already known (see sequence_window).
+
+        Returns:
+            A Q object.
+
+        """
+        pinned, first, last = window or self.sequence_window(board)
+        return Q(db_board=board) & (Q(db_pinned=True) | Q(db_seq__gte=first, db_seq__lte=last))
+
     def by_board(self, board):
         """
         Returns all the active posts on a board, honoring expiry limits.
@@ -73,29 +95,420 @@ class PostQuerySet(models.query.QuerySet):
 
         """
         try:
-            if board.db_expiry_duration:
-                oldest = datetime.now() - timedelta(days=board.db_expiry_duration)
-                posts = self.filter(db_board=board).filter(Q(db_date_created__gte=oldest) | Q(db_pinned=True))\
-                    .order_by('-db_pinned', 'db_date_created')
+            return self.filter(self.active_filter(board)).order_by('-db_pinned', 'db_date_created')
+
+        except self.model.DoesNotExist:
+            return []
+
+    def by_boards(self, boards):
+        """
+        Returns all the active posts on any of the given boards, honoring each board's expiry
+        limits, as a single unordered queryset.
+
+        Args:
+            boards (list): The BoardDB objects to use.
+
+        Returns:
+            A queryset of Post objects.
+
+        """
+        if not boards:
+            return self.none()
+
+        windows = self.sequence_windows(boards)
+        return self.filter(reduce(or_, [self.active_filter(b, windows[b.id]) for b in boards]))
+
+    def next_seq(self, board):
+        """
+        Allocates the sequence number for a new post on a board.  This should be called inside
+        a transaction, as it locks the board row until the new post is saved.
+
+        Args:
+            board (BoardDB): The board the post is being made on.
+
+        Returns:
+            An integer.
+
+        """
+        global _BoardDB
+        if not _BoardDB:
+            from paxboards.models import BoardDB as _BoardDB
+
+        list(_BoardDB.objects.select_for_update().filter(pk=board.pk).values_list('pk', flat=True))
+        last = self.filter(db_board=board).aggregate(last=Max('db_seq'))['last']
+        return (last or 0) + 1
+
+    def renumber(self, board, after=None):
+        """
+        Reallocates the sequence numbers on a board so they run from 1 upwards, in the order
+        the posts were made.
+
+        Args:
+            board (BoardDB): The board to renumber.
+            after (int): If given, only a single post numbered 'after' has gone away, so every
+                later post is just shifted down by one (see close_gaps).
+
+        Returns:
+            None
+
+        """
+        if after:
+            self.close_gaps(board, [after])
+            return
+
+        # (board, seq) is unique, so the posts being renumbered are first taken out of the
+        # sequence; otherwise one could briefly take a number another has yet to give up.
+        renumbered = {}
+        with transaction.atomic():
+            ids = self.filter(db_board=board).order_by('db_date_created', 'id').values_list('id', 'db_seq')
+            for seq, (post_id, old_seq) in enumerate(ids, start=1):
+                if seq != old_seq:
+                    renumbered[post_id] = seq
+
+            # Only the posts whose numbers change are written, 500 to an UPDATE.
+            changed = list(renumbered.items())
+            if changed:
+                self.filter(db_board=board, pk__in=list(renumbered)).update(db_seq=None)
+            for start in range(0, len(changed), 500):
+                chunk = changed[start:start + 500]
+                self.filter(pk__in=[post_id for post_id, seq in chunk]).update(
+                    db_seq=Case(*[When(pk=post_id, then=Value(seq)) for post_id, seq in chunk],
+                                output_field=models.PositiveIntegerField()))
+
+        # The bulk updates bypass the idmapper, so any cached posts are brought into line by
+        # hand; otherwise a later save() of a cached post would write its stale number back.
+        for post in self.model.get_all_cached_instances():
+            if post.id in renumbered:
+                post.db_seq = renumbered[post.id]
+
+    def close_gaps(self, board, removed):
+        """
+        Shifts the sequence numbers on a board down to close the gaps left by posts which have
+        gone away, in two UPDATEs: each later post moves down by the number of posts removed
+        below it.
+
+        Args:
+            board (BoardDB): The board the posts were on.
+            removed (list): The sequence numbers of the posts removed.
+
+        Returns:
+            None
+
+        """
+        removed = sorted(set(s for s in removed if s))
+        if not removed:
+            return
+
+        # Each post moves down by the number removed below it, which only changes at the end of
+        # each run of consecutive removed numbers.
+        steps = [(seq, count) for count, seq in enumerate(removed, start=1)
+                 if count == len(removed) or removed[count] != seq + 1]
+        # (board, seq) is unique, and the database may check that row by row as it goes, so the
+        # later posts are first moved clear of every number in use, then down into place.
+        with transaction.atomic(savepoint=False):
+            self.filter(db_board=board, db_seq__gt=removed[0]).update(db_seq=F('db_seq') + SEQ_OFFSET)
+            shift = Case(*[When(db_seq__gt=seq + SEQ_OFFSET, then=Value(count + SEQ_OFFSET))
+                           for seq, count in reversed(steps)],
+                         default=Value(SEQ_OFFSET), output_field=models.PositiveIntegerField())
+            self.filter(db_board=board, db_seq__gt=SEQ_OFFSET).update(db_seq=F('db_seq') - shift)
+
+        for post in self.model.get_all_cached_instances():
+            if post.db_board_id == board.id and post.db_seq and post.db_seq > removed[0]:
+                post.db_seq -= len([seq for seq in removed if seq < post.db_seq])
+
+    def sequence_window(self, board):
+        """
+        Works out which stretch of a board's post sequence is active, honoring expiry limits.
+        Posts are numbered in the order they were made, and expiry only ever hides the oldest
+        unpinned posts, so the active unpinned posts are always one run of sequence numbers
+        (with any pinned posts that fall inside it skipped).
+
+        Both limits are resolved with indexed single-row lookups: the age limit by the oldest
+        unpinned post young enough to show, and the post limit by counting back from the newest
+        post, stepping over the (few) pinned posts.  No more than one row per lookup is read,
+        however large the board.
+
+        Args:
+            board (BoardDB): The board to check.
+
+        Returns:
+            A tuple of (pinned, first, last), where pinned is the list of sequence numbers of
+            the pinned posts in display order, and first and last bound the run of active
+            unpinned posts.  If there are no active unpinned posts, first is greater than last.
+
+        """
+        posts = self.filter(db_board=board)
+        if posts.filter(db_seq__isnull=True).exists():
+            self.renumber(board)
+
+        pinned = list(posts.filter(db_pinned=True).order_by('db_seq').values_list('db_seq', flat=True))
+
+        unpinned = posts.filter(db_pinned=False)
+        last = unpinned.order_by('-db_seq').values_list('db_seq', flat=True).first()
+        if not last:
+            return pinned, 1, 0
+
+        if board.db_expiry_duration:
+            oldest = timezone.now() - timedelta(days=board.db_expiry_duration)
+            unpinned = unpinned.filter(db_date_created__gte=oldest)
+
+        # Posting order and date order are the same, so this is one seek on the
+        # (board, pinned, date) index rather than a scan past every expired post.
+        first = unpinned.order_by('db_date_created', 'id').values_list('db_seq', flat=True).first()
+        return self._limit_window(board, pinned, first, last)
+
+    def sequence_windows(self, boards):
+        """
+        Works out the sequence windows (see sequence_window) of several boards at once, with a
+        fixed number of grouped queries however many boards there are.  Each board's posts are
+        aggregated rather than seeked into, so for a single board sequence_window is cheaper.
+
+        Args:
+            boards (list): The boards to check.
+
+        Returns:
+            A dictionary of board id to (pinned, first, last).
+
+        """
+        boards = dict((b.id, b) for b in boards)
+        posts = self.filter(db_board__in=list(boards)).order_by()
+
+        for board_id in set(posts.filter(db_seq__isnull=True).values_list('db_board', flat=True)):
+            self.renumber(boards[board_id])
+
+        pinned = dict((board_id, []) for board_id in boards)
+        for board_id, seq in posts.filter(db_pinned=True).order_by('db_seq').values_list('db_board', 'db_seq'):
+            pinned[board_id].append(seq)
+
+        unpinned = posts.filter(db_pinned=False)
+        last = dict(unpinned.values_list('db_board').annotate(last=Max('db_seq')))
+
+        first = {}
+        if last:
+            recent = []
+            for board_id in last:
+                duration = boards[board_id].db_expiry_duration
+                if duration:
+                    recent.append(Q(db_board=board_id, db_date_created__gte=timezone.now() - timedelta(days=duration)))
+                else:
+                    recent.append(Q(db_board=board_id))
+
+            first = dict(unpinned.filter(reduce(or_, recent)).values_list('db_board').annotate(first=Min('db_seq')))
+
+        windows = {}
+        for board_id, board in boards.items():
+            if not last.get(board_id):
+                windows[board_id] = (pinned[board_id], 1, 0)
             else:
-                posts = self.filter(db_board=board).order_by('-db_pinned', 'db_date_created')
+                windows[board_id] = self._limit_window(board, pinned[board_id], first.get(board_id), last[board_id])
 
-            # This is a little unfortunate
-            if board.db_expiry_maxposts and (board.db_expiry_maxposts > 0) and \
-                    (board.db_expiry_maxposts <= posts.count()):
-                pinned_count = self.filter(db_board=board, db_pinned=True).count()
-                max_normal = board.db_expiry_maxposts - (pinned_count + 1)
+        return windows
 
-                firstpost = posts[::-1][max_normal]
+    def _limit_window(self, board, pinned, first, last):
+        """
+        Applies a board's post limit to its window of unpinned posts.
 
-                posts = self.filter(Q(db_board=board) & (Q(db_pinned=True) | (Q(pk__gte=firstpost.id)))) \
-                        .order_by('-db_pinned','db_date_created')
+        Args:
+            board (BoardDB): The board.
+            pinned (list): The sequence numbers of the board's pinned posts, in order.
+            first (int): The first unpinned post young enough to show, or None if there isn't one.
+            last (int): The last unpinned post.
 
+        Returns:
+            A tuple of (pinned, first, last), as for sequence_window.
 
-            return posts
+        """
+        if not first:
+            return pinned, 1, 0
 
-        except self.model.DoesNotExist:
-            return []
+        if board.db_expiry_maxposts and (board.db_expiry_maxposts > 0):
+            max_normal = board.db_expiry_maxposts - len(pinned)
+            if max_normal <= 0:
+                return pinned, 1, 0
+
+            # Walk the cutoff back over any pinned posts inside the window.
+            cutoff = last - max_normal + 1
+            for seq in reversed(pinned):
+                if cutoff <= seq <= last:
+                    cutoff -= 1
+
+            first = max(first, cutoff)
+
+        return pinned, first, last
+
+    def expired(self, board):
+        """
+        Returns the unpinned posts on a board which have expired, and which no longer have any
+        replies.  A thread is only ever taken apart from its newest replies backwards, so a post
+        is never removed out from under a reply which is still to be kept.
+
+        Args:
+            board (BoardDB): The board to check.
+
+        Returns:
+            A queryset of Post objects.
+
+        """
+        pinned, first, last = self.sequence_window(board)
+        replies = self.model.objects.filter(db_parent=OuterRef('pk'))
+
+        return self.filter(db_board=board, db_pinned=False).exclude(db_seq__gte=first, db_seq__lte=last) \
+            .annotate(has_replies=Exists(replies)).filter(has_replies=False)
+
+    def post_number(self, post):
+        """
+        Returns the number a post is shown at on its board, without loading the other posts.
+
+        Args:
+            post (Post): The post to check.
+
+        Returns:
+            An integer, or None if the post isn't active on its board.
+
+        """
+        # Go to the database rather than trusting the cached instance, since renumbering is
+        # done with bulk updates.
+        row = self.filter(pk=post.pk).values_list('db_seq', 'db_pinned').first()
+        if not row or row[0] is None:
+            return None
+
+        seq, pinned_post = row
+        return self._number_in_window(seq, pinned_post, self.sequence_window(post.db_board))
+
+    def post_numbers(self, posts):
+        """
+        Returns the numbers several posts are shown at on their boards, with a fixed number of
+        queries however many posts or boards there are.
+
+        Args:
+            posts (list): The posts to check.
+
+        Returns:
+            A dictionary of post id to number, or None for posts which aren't active.
+
+        """
+        posts = list(posts)
+        if not posts:
+            return {}
+
+        rows = dict((post_id, (seq, pinned)) for post_id, seq, pinned in
+                    self.filter(pk__in=[p.pk for p in posts]).values_list('id', 'db_seq', 'db_pinned'))
+        windows = self.sequence_windows(set(p.db_board for p in posts))
+
+        numbers = {}
+        for p in posts:
+            seq, pinned = rows.get(p.pk, (None, False))
+            numbers[p.pk] = self._number_in_window(seq, pinned, windows[p.db_board_id]) if seq else None
+
+        return numbers
+
+    def _number_in_window(self, seq, pinned_post, window):
+        pinned, first, last = window
+
+        if pinned_post:
+            return pinned.index(seq) + 1 if seq in pinned else None
+
+        if not first <= seq <= last:
+            return None
+
+        return len(pinned) + (seq - first + 1) - len([s for s in pinned if first <= s <= seq])
+
+    def by_board_number(self, board, number):
+        """
+        Returns the post shown at the given number on a board, without loading the other posts.
+
+        Args:
+            board (BoardDB): The board to look on.
+            number (int): The post number, starting from 1.
+
+        Returns:
+            A Post object, or None.
+
+        """
+        if number < 1:
+            return None
+
+        seq = self._seq_for_number(number, self.sequence_window(board))
+        if seq is None:
+            return None
+
+        return self.filter(db_board=board, db_seq=seq).first()
+
+    def by_board_range(self, board, first_number, last_number):
+        """
+        Returns the posts shown at a range of numbers on a board, without loading the others.
+
+        Args:
+            board (BoardDB): The board to look on.
+            first_number (int): The first post number, starting from 1.
+            last_number (int): The last post number, inclusive.
+
+        Returns:
+            A queryset of Post objects.
+
+        """
+        window = self.sequence_window(board)
+        pinned, first, last = window
+        first_number = max(first_number, 1)
+
+        matches = Q(db_seq__in=pinned[first_number - 1:last_number])
+
+        start = self._seq_for_number(max(first_number, len(pinned) + 1), window)
+        if start is not None and last_number > len(pinned):
+            end = self._seq_for_number(last_number, window)
+            matches |= Q(db_pinned=False, db_seq__gte=start, db_seq__lte=end if end is not None else last)
+
+        return self.filter(db_board=board).filter(matches)
+
+    def _seq_for_number(self, number, window):
+        pinned, first, last = window
+
+        if number <= len(pinned):
+            return pinned[number - 1]
+
+        seq = first + (number - len(pinned)) - 1
+        for s in pinned:
+            if first <= s <= seq:
+                seq += 1
+
+        return seq if seq <= last else None
+
+    def with_unread(self, player, post_field='pk'):
+        """
+        Annotates each post with an 'unread' field based on the given player's read or unread
+        status, using the configured read state (see paxboards.readstate).  This is done with
+        correlated subqueries rather than a query per post.
+
+        Args:
+            player (AccountDB): The player whose read/unread status should be used.
+            post_field (str): The field naming the post whose read status counts; this lets a
+                thread take its status from its last post.
+
+        Returns:
+            A queryset of Post objects.
+
+        """
+        from paxboards.readstate import get_read_state
+
+        return get_read_state().annotate_unread(self, player, post_field)
+
+    def first_unread(self, boards, player):
+        """
+        Returns the post a player should read next across several boards: the first unread
+        pinned post, or failing that the oldest unread one, among the active posts on any of
+        the boards.  This is a single query (after working out the boards' sequence windows),
+        however many boards or posts there are.
+
+        Args:
+            boards (list): The BoardDB objects to look on.
+            player (AccountDB): The player whose read/unread status should be used.
+
+        Returns:
+            A Post object, or None if everything has been read.
+
+        """
+        return self.by_boards(boards).with_unread(player).filter(unread=True) \
+            .order_by('-db_pinned', 'db_date_created', 'id').first()
 
     def by_board_for_player(self, board, player):
         """
@@ -111,40 +524,34 @@ class PostQuerySet(models.query.QuerySet):
 
         """
         posts = self.by_board(board)
-        for p in posts:
-            if player.read_posts.filter(pk=p.id).exists():
-                setattr(p, "unread", False)
-            else:
-                setattr(p, "unread", True)
+        if not isinstance(posts, models.query.QuerySet):
+            return posts
 
-        return posts
+        return posts.with_unread(player)
 
     def by_board_threaded_player(self, board, player):
         """
-        Return just all the threads.
+        Return just all the threads, most recently active first.  Each thread's 'last_post_on',
+        'last_poster' and 'total_posts' come from its stored summary.
 
         Args:
             board: The board to get threads for
             player: The player whose unread states should be used
 
         Returns:
-            A list of Post objects
+            A queryset of Post objects
 
         """
-        posts = self.filter(db_board=board).filter(db_parent__isnull=True)
-        for p in posts:
-            lr = p.last_reply
-            setattr(p, "last_post_on", lr.db_date_created)
-            setattr(p, "last_poster", lr.db_poster_name)
-            replies = self.filter(db_parent=p)
-            setattr(p, "total_posts", replies.count() + 1)
-            if player:
-                if player.read_posts.filter(pk=lr.id).exists():
-                    setattr(p, "unread", False)
-                else:
-                    setattr(p, "unread", True)
+        threads = self.filter(db_board=board, db_parent__isnull=True)
+
+        # Threads from before the summary fields existed get summarized on first sight.
+        for thread in threads.filter(db_last_post__isnull=True):
+            thread.update_thread_summary()
 
-        return sorted(posts, key=lambda p: (p.db_pinned, p.date_for_sort), reverse=True)
+        if player:
+            threads = threads.with_unread(player, 'db_last_post')
+
+        return threads.order_by('-db_pinned', '-db_last_post_on', '-id')
 
 
 class PostManager(TypedObjectManager):
@@ -171,6 +578,25 @@ class PostManager(TypedObjectManager):
         else:
             return self.get_queryset().by_board_for_player(board, player)
 
+    def post_by_number(self, board, number, player=None):
+        """
+        Given a board, a post number and an optional player, returns the post at that number.
+
+        Args:
+            board (BoardDB): The board to look on.
+            number (int): The post number, as shown in the board's listing.
+            player (AccountDB): The player whose read/unread status should be used.
+
+        Returns:
+            A Post object, or None.
+
+        """
+        queryset = self.get_queryset()
+        if player:
+            queryset = queryset.with_unread(player)
+
+        return queryset.by_board_number(board, number)
+
     def threads(self, board, player=None):
         """
         Given a board and an optional player, return the threads.
@@ -184,14 +610,361 @@ class PostManager(TypedObjectManager):
         """
         return self.get_queryset().by_board_threaded_player(board, player)
 
-    def search(self, searchstring, board=None):
+    def search(self, searchstring, board=None, boards=None):
+        """
+        Searches the active posts on a board, or on a list of boards, using the configured search
+        backend.  See paxboards.search.
+
+        Args:
+            searchstring (str): What to search for.
+            board (BoardDB): A single board to search.
+            boards (list): The boards to search, if no single board is given.  If neither is
+                given, every post is searched.
+
+        Returns:
+            A queryset of Post objects, best matches first.
+
+        """
+        from paxboards.search import search_posts
+
         if board:
-            result = self.get_queryset().by_board(board).filter(db_text__icontains=searchstring).\
-                order_by('db_date_created')
+            boards = [board]
+
+        if boards is not None:
+            result = self.get_queryset().by_boards(boards)
         else:
-            result = self.get_queryset().filter(db_text__icontains=searchstring).order_by('db_date_created')
+            result = self.get_queryset()
+
+        return search_posts(result, searchstring)
+
+    def backfill_renderings(self, after=0, batch_size=500):
+        """
+        Works out the stored plaintext and HTML renderings for one batch of posts which don't have
+        them yet, in id order.  Call it repeatedly, passing back the returned id, until it returns
+        None.
+
+        Args:
+            after (int): Only look at posts with an id greater than this.
+            batch_size (int): The most posts to convert at once.
+
+        Returns:
+            A tuple of (count, last_id), where count is how many posts were converted and last_id
+            is the id to continue from, or None if there are no posts left.
+
+        """
+        posts = list(self.filter(pk__gt=after, db_plaintext__isnull=True).order_by('id')[:batch_size])
+        if not posts:
+            return 0, None
+
+        for post in posts:
+            post.update_renderings()
+
+        self.bulk_update(posts, ['db_plaintext', 'db_html'])
+        return len(posts), posts[-1].id
+
+    def expire(self, board, limit=500, archive=True):
+        """
+        Removes one batch of expired posts from a board (see PostQuerySet.expired), copying them
+        and who had read them (from whichever read state is in use) to the archive tables first if
+        asked to.  The batch is done in a single transaction.
+
+        The posts are removed with a bulk delete, which leaves a gap below the board's active
+        sequence numbers; since only posts older than every active unpinned post go, the post
+        numbers people see are unaffected and no renumbering is needed.
+
+        Args:
+            board (BoardDB): The board to expire posts from.
+            limit (int): The most posts to remove at once.
+            archive (bool): Whether to keep a copy of the posts in the ArchivedPost table, or
+                just delete them.
+
+        Returns:
+            A tuple of (posts, readers), the number of posts removed and of reads of them.
+
+        """
+        from paxboards.cache import RENDER_CACHE
+        from paxboards.models import ArchivedPost
+        from paxboards.readstate import get_read_state
+        from paxboards.search import remove_posts
+
+        archive_readers = ArchivedPost.db_readers.through
+
+        with transaction.atomic():
+            posts = list(self.get_queryset().expired(board).order_by('id')[:limit])
+            if not posts:
+                return 0, 0
+
+            post_ids = [p.id for p in posts]
+            read = [(post_id, account_id) for post_id, account_ids in get_read_state().readers(posts).items()
+                    for account_id in account_ids]
+
+            if archive:
+                ArchivedPost.objects.bulk_create([ArchivedPost.from_post(p) for p in posts])
+                archived = dict(ArchivedPost.objects.filter(db_original_id__in=post_ids)
+                                .values_list('db_original_id', 'id'))
+                archive_readers.objects.bulk_create([archive_readers(archivedpost_id=archived[post_id],
+                                                                     accountdb_id=account_id)
+                                                     for post_id, account_id in read],
+                                                    batch_size=500, ignore_conflicts=True)
+
+            # Every post above the expired ones is rendered with them as replies, up to the first
+            # post of the thread.
+            parents = set(p.db_parent_id for p in posts if p.db_parent_id) - set(post_ids)
+            above, threads = set(), set()
+            for post in self.filter(pk__in=parents):
+                above.add(post.id)
+                while post.db_parent:
+                    post = post.db_parent
+                    above.add(post.id)
+                threads.add(post.id)
+
+            self.filter(pk__in=post_ids).delete()
+            remove_posts(post_ids)
+
+            self.update_thread_summaries(threads)
+
+        RENDER_CACHE.invalidate(set(post_ids) | above)
+
+        return len(posts), len(read)
+
+    def bulk_create_dated(self, posts, dates):
+        """
+        Bulk creates posts with the given creation dates; db_date_created is otherwise set to
+        the current time on creation, whatever it's given.  This is for tools like the importer
+        and the benchmarks: where the database doesn't hand back the new ids, the posts are
+        found again as the newest rows, so nothing else should be posting at the same time.
+
+        Args:
+            posts (list): The unsaved Post objects.
+            dates (list): The creation date for each post.
 
-        return result
+        Returns:
+            The saved posts, in the same order.
+
+        """
+        with transaction.atomic():
+            before = self.aggregate(last=Max('id'))['last'] or 0
+            self.bulk_create(posts, batch_size=500)
+            if not all(p.pk for p in posts):
+                # Just the ids, so the posts aren't loaded again (and cached) as new objects.
+                ids = self.filter(pk__gt=before).order_by('id').values_list('id', flat=True)[:len(posts)]
+                for post, post_id in zip(posts, ids):
+                    post.pk = post_id
+                    post._state.adding = False
+                    post._state.db = self.db
+
+            for post, date in zip(posts, dates):
+                post.db_date_created = date
+            self.bulk_update(posts, ['db_date_created'], batch_size=500)
+
+        return posts
+
+    def thread_replies(self, thread_ids):
+        """
+        Finds every reply under some posts, however deeply nested, a level of replies at a time.
+
+        Args:
+            thread_ids (iterable): The ids of the posts to look under, usually the first posts of
+                threads.
+
+        Returns:
+            A dictionary of the id of each reply found to the id of the post it's under.
+
+        """
+        found = {}
+        level = dict((post_id, post_id) for post_id in thread_ids)
+        while level:
+            parents, level = level, {}
+            parent_ids = list(parents)
+            for start in range(0, len(parent_ids), 500):
+                replies = self.filter(db_parent__in=parent_ids[start:start + 500]).order_by() \
+                    .values_list('id', 'db_parent_id')
+                level.update((reply_id, parents[parent_id]) for reply_id, parent_id in replies
+                             if reply_id not in found)
+            found.update(level)
+
+        return found
+
+    def update_thread_summaries(self, thread_ids):
+        """
+        Refreshes the thread summaries (see Post.update_thread_summary) of several threads at
+        once, with a few queries per 500 threads rather than per thread.
+
+        Args:
+            thread_ids (list): The ids of the first posts of the threads.
+
+        Returns:
+            The number of threads updated.
+
+        """
+        thread_ids = list(thread_ids)
+        updated = 0
+
+        for start in range(0, len(thread_ids), 500):
+            threads = list(self.filter(pk__in=thread_ids[start:start + 500]))
+            if not threads:
+                continue
+
+            # Posting order and date order are the same, so the newest reply has the highest id.
+            totals = {}
+            for reply_id, thread_id in self.thread_replies(thread.id for thread in threads).items():
+                total, last_id = totals.get(thread_id, (0, 0))
+                totals[thread_id] = (total + 1, max(last_id, reply_id))
+            last_posts = dict((p.id, p) for p in self.filter(pk__in=[last_id for total, last_id in totals.values()]))
+
+            now = timezone.now()
+            for thread in threads:
+                total, last_id = totals.get(thread.id, (0, None))
+                last = last_posts.get(last_id, thread)
+
+                thread.db_last_post = last
+                thread.db_last_post_on = last.db_date_created
+                thread.db_last_poster = last.db_poster_name
+                thread.db_total_posts = total + 1
+                thread.db_date_modified = now
+
+            self.bulk_update(threads, ['db_last_post', 'db_last_post_on', 'db_last_poster', 'db_total_posts',
+                                       'db_date_modified'])
+            updated += len(threads)
+
+        return updated
+
+    def delete_posts(self, posts):
+        """
+        Deletes a set of posts in one transaction, with a few statements however many there are.
+        As with deleting a single post, any surviving replies are moved up to the nearest
+        surviving post above them (or become threads of their own), the boards' post numbers
+        close up, the posts leave the search index and the affected thread summaries are redone.
+
+        Args:
+            posts (QuerySet): The posts to delete.
+
+        Returns:
+            A dictionary of row counts: 'posts' deleted, 'replies' moved up, 'readers' (read
+            records deleted with the posts) and 'threads' whose summaries were redone.
+
+        """
+        global _BoardDB
+        if not _BoardDB:
+            from paxboards.models import BoardDB as _BoardDB
+        from paxboards.cache import RENDER_CACHE
+        from paxboards.search import remove_posts
+
+        counts = {"posts": 0, "replies": 0, "readers": 0, "threads": 0}
+
+        with transaction.atomic():
+            rows = list(posts.order_by().values_list('id', 'db_board', 'db_seq', 'db_parent'))
+            if not rows:
+                return counts
+
+            post_ids = set(row[0] for row in rows)
+            parents = dict((row[0], row[3]) for row in rows)
+
+            def surviving(parent_id):
+                while parent_id in post_ids:
+                    parent_id = parents[parent_id]
+                return parent_id
+
+            # Surviving replies are moved up in one UPDATE per 500, which bypasses the idmapper.
+            orphans = dict((post_id, surviving(parent_id)) for post_id, parent_id in
+                           self.filter(db_parent__in=post_ids).exclude(pk__in=post_ids)
+                           .values_list('id', 'db_parent'))
+            moved = list(orphans.items())
+            for start in range(0, len(moved), 500):
+                chunk = moved[start:start + 500]
+                self.filter(pk__in=[post_id for post_id, parent_id in chunk]).update(
+                    db_parent=Case(*[When(pk=post_id, then=Value(parent_id)) for post_id, parent_id in chunk],
+                                   output_field=models.IntegerField()))
+            new_parents = self.in_bulk([parent_id for parent_id in orphans.values() if parent_id])
+            for post in self.model.get_all_cached_instances():
+                if post.id in orphans:
+                    post.db_parent = new_parents.get(orphans[post.id])
+
+            # The threads which lose posts, and the replies which become threads themselves.
+            above = set(surviving(parents[post_id]) for post_id in post_ids) - {None}
+            threads = set(post.thread.id for post in self.filter(pk__in=above))
+            threads.update(post_id for post_id, parent_id in orphans.items() if not parent_id)
+
+            deleted, by_model = self.filter(pk__in=post_ids).delete()
+            remove_posts(list(post_ids))
+
+            removed = {}
+            for post_id, board_id, seq, parent_id in rows:
+                removed.setdefault(board_id, []).append(seq)
+            for board in _BoardDB.objects.filter(pk__in=list(removed)):
+                self.get_queryset().close_gaps(board, removed[board.id])
+
+            counts["threads"] = self.update_thread_summaries(threads)
+
+        RENDER_CACHE.invalidate(post_ids | set(orphans) | threads)
+
+        counts["posts"] = by_model.get(self.model._meta.label, 0)
+        counts["readers"] = by_model.get(self.model.db_readers.through._meta.label, 0)
+        counts["replies"] = len(orphans)
+        return counts
+
+    def move_posts(self, posts, board):
+        """
+        Moves posts to another board in one transaction.  Threads are never split, so every
+        post in a thread which any of the given posts belong to is moved.  The moved posts take
+        their place in posting order among the target board's posts, and the boards they came
+        from close up their post numbers.  Whoever had read the posts still has.
+
+        Args:
+            posts (QuerySet): The posts to move.
+            board (BoardDB): The board to move them to.
+
+        Returns:
+            A dictionary of row counts: 'posts' and 'threads' moved.
+
+        """
+        global _BoardDB
+        if not _BoardDB:
+            from paxboards.models import BoardDB as _BoardDB
+        from paxboards.cache import RENDER_CACHE
+        from paxboards.readstate import get_read_state
+
+        with transaction.atomic():
+            post_ids = set(posts.values_list('id', flat=True))
+
+            # Take in the rest of each thread; this only loops as many times as threads are deep.
+            while True:
+                above = set(self.filter(pk__in=post_ids, db_parent__isnull=False)
+                            .values_list('db_parent', flat=True)) - post_ids
+                below = set(self.filter(db_parent__in=post_ids).values_list('id', flat=True)) - post_ids
+                if not above and not below:
+                    break
+                post_ids |= above | below
+
+            rows = list(self.filter(pk__in=post_ids).exclude(db_board=board)
+                        .values_list('id', 'db_board', 'db_seq', 'db_parent'))
+            if not rows:
+                return {"posts": 0, "threads": 0}
+
+            moving = set(row[0] for row in rows)
+            read_state = get_read_state()
+            reads = read_state.before_move(moving)
+
+            # Lock the target board against new posts while its numbers are redone.
+            self.get_queryset().next_seq(board)
+            self.filter(pk__in=moving).update(db_board=board, db_seq=None)
+            for post in self.model.get_all_cached_instances():
+                if post.id in moving:
+                    post.db_board = board
+                    post.db_seq = None
+
+            removed = {}
+            for post_id, board_id, seq, parent_id in rows:
+                removed.setdefault(board_id, []).append(seq)
+            for source in _BoardDB.objects.filter(pk__in=list(removed)):
+                self.get_queryset().close_gaps(source, removed[source.id])
+
+            self.get_queryset().renumber(board)
+            read_state.after_move(moving, board, reads)
+
+        RENDER_CACHE.invalidate(moving)
+
+        return {"posts": len(moving), "threads": len([row for row in rows if not row[3]])}
 
 
 class BoardDBManager(TypedObjectManager):
@@ -259,9 +1032,57 @@ class BoardDBManager(TypedObjectManager):
         except self.model.DoesNotExist:
             return None
 
-    def get_all_visible_boards(self, caller):
+    def annotate_counts(self, boards, player=None):
         """
-        This function returns all the boards visible to a given viewer.
+        Annotates each board with 'unread_count', 'total_count' and 'last_post' fields.  The counts
+        are computed by aggregate queries across all the given boards at once, so the number of
+        queries doesn't grow with the number of boards or posts.
+
+        Args:
+            boards (list): The boards to annotate.
+            player (AccountDB): The player whose read/unread status should be used.  If None,
+                every post is considered read.
+
+        Returns:
+            The same list of boards.
+
+        """
+        global _Post
+        if not _Post:
+            from paxboards.models import Post as _Post
+        from paxboards.readstate import get_read_state
+
+        if not boards:
+            return boards
+
+        posts = _Post.objects.get_queryset().by_boards(boards).order_by()
+        totals = {row['db_board']: row for row in
+                  posts.values('db_board').annotate(total=Count('id'), newest=Max('db_date_created'))}
+
+        read = {}
+        if player:
+            read = get_read_state().read_counts(posts, player)
+
+        last_posts = {}
+        if totals:
+            newest = reduce(or_, [Q(db_board=board_id, db_date_created=row['newest'])
+                                  for board_id, row in totals.items()])
+            for p in posts.filter(newest).order_by('db_date_created', 'id'):
+                last_posts[p.db_board_id] = p
+
+        for b in boards:
+            total = totals[b.id]['total'] if b.id in totals else 0
+            unread = total - read.get(b.id, 0) if player else 0
+
+            setattr(b, "unread_count", unread)
+            setattr(b, "total_count", total)
+            setattr(b, "last_post", last_posts.get(b.id))
+
+        return boards
+
+    def get_readable_boards(self, caller):
+        """
+        This function returns all the boards visible to a given viewer, without any post counts.
 
         Args:
             caller (Player): The player whose visibility of boards should be checked.
@@ -269,63 +1090,57 @@ class BoardDBManager(TypedObjectManager):
         Returns:
             A list of DefaultBoard objects.
         """
-        filtered = []
-        if caller:
-            filtered = [b for b in self.all() if b.access(caller, access_type='read', default=True)]
+        if not caller:
+            return []
 
-        for b in filtered:
-            all_posts = b.posts(caller)
-            unread = 0
-            for p in all_posts:
-                if p.is_unread:
-                    unread = unread + 1
+        return [b for b in self.all() if b.access(caller, access_type='read', default=True)]
 
-            setattr(b, "unread_count", unread)
-            setattr(b, "total_count", len(all_posts))
+    def get_all_visible_boards(self, caller):
+        """
+        This function returns all the boards visible to a given viewer.
 
-            if all_posts:
-                last_post = list(all_posts)[-1]
-                setattr(b, "last_post", last_post)
+        Args:
+            caller (Player): The player whose visibility of boards should be checked.
 
-        return filtered
+        Returns:
+            A list of DefaultBoard objects.
+        """
+        return self.annotate_counts(self.get_readable_boards(caller), caller)
 
-    def get_visible_board(self, viewer, key):
+    def get_visible_board(self, viewer, key, counts=True):
         """
         This function returns a single board matching the key, provided it's unique.
 
         Args:
             viewer (Player): The player whose visibility of boards should be checked.
             key (str): The string to match board names again.
+            counts (bool): Whether to annotate the board with its post counts (see
+                annotate_counts).  Commands which only need the board itself should pass False,
+                since the counts cost several aggregate queries over the board's posts.
 
         Returns:
             A DefaultBoard object, or None.
         """
+        board = None
+
         if is_positive_int(key):
-            boards = self.get_all_visible_boards(viewer)
+            # Boards are numbered in the same order get_all_visible_boards lists them.
+            boards = self.get_readable_boards(viewer)
             boardnum = int(key)
             if 0 < boardnum <= len(boards):
-                return boards[boardnum - 1]
-
-            return None
-
-        boards = self.filter(db_key__istartswith=key)
-        if boards:
-            filtered = [b for b in boards if b.access(viewer, access_type='read', default=True)]
-            if len(filtered) == 1:
-                b = filtered[0]
+                board = boards[boardnum - 1]
 
-                all_posts = b.posts(viewer)
-                unread = 0
-                for p in all_posts:
-                    if p.is_unread:
-                        unread = unread + 1
-
-                setattr(b, "unread_count", unread)
-                setattr(b, "total_count", len(all_posts))
+        else:
+            boards = self.filter(db_key__istartswith=key)
+            if boards:
+                filtered = [b for b in boards if b.access(viewer, access_type='read', default=True)]
+                if len(filtered) == 1:
+                    board = filtered[0]
 
-                return b
+        if board and counts:
+            self.annotate_counts([board], viewer)
 
-        return None
+        return board
 
     def get_subscriptions(self, subscriber):
         """
@@ -340,7 +1155,7 @@ class BoardDBManager(TypedObjectManager):
         """
         clsname = subscriber.__dbclass__.__name__
         if clsname == "AccountDB":
-            return subscriber.board_subscriptions_set.all()
+            return subscriber.board_subscriptions.all()
 
         return []
 
@@ -1,9 +1,14 @@
 from django.db import models
 from evennia.typeclasses.models import TypedObject
+from evennia.utils import ansi
+from evennia.utils.text2html import parse_html
 from evennia.utils.idmapper.models import SharedMemoryModel
 from .managers import PostManager
+from .readstate import get_read_state
+from .cache import RENDER_CACHE
+from . import routers
 
-__all__ = ("Post", "BoardDB")
+__all__ = ("Post", "BoardDB", "BoardReadMark", "PostReadMark", "ArchivedPost", "SubscriptionMode", "PendingDigest")
 
 
 class Post(SharedMemoryModel):
@@ -18,10 +23,22 @@ class Post(SharedMemoryModel):
     - db_subject: The subject to use for the post, as a string.
     - db_board: The board on which this post was made.
     - db_date_created: The timestamp when this post was made.
+    - db_date_modified: The timestamp when this post (or, for a thread, its summary) last changed.
     - db_pinned: A boolean, determining if the post should be prevented from timing out.
     - db_readers: A list of players who have read this post.
     - db_parent: For threaded post chains, the parent to this post.
     - db_text: The actual text of the post.
+    - db_seq: The position of this post among all the posts on its board, in the order they were made.
+    - db_plaintext: The text of the post with ANSI markup stripped, for the web.
+    - db_html: The text of the post with ANSI markup converted to HTML.
+
+    The first post of a thread also keeps a summary of the whole thread, so a board's threads can be
+    listed without looking at their replies:
+
+    - db_last_post: The most recent post in the thread (the first post itself, if there are no replies).
+    - db_last_post_on: The timestamp of the most recent post in the thread.
+    - db_last_poster: The byline of the most recent post in the thread.
+    - db_total_posts: The number of posts in the thread, including the first.
 
     """
     db_poster_player = models.ForeignKey("accounts.AccountDB", related_name="+", null=True, blank=True,
@@ -36,6 +53,8 @@ class Post(SharedMemoryModel):
     db_board = models.ForeignKey("BoardDB", verbose_name='board', help_text='Board this post is on.', db_index=True, on_delete=models.CASCADE)
     db_date_created = models.DateTimeField('date created', editable=False,
                                            auto_now_add=True, db_index=True, help_text='Date post was made.')
+    db_date_modified = models.DateTimeField('date modified', auto_now=True, null=True, blank=True,
+                                            help_text='Date post was last changed.')
     db_pinned = models.BooleanField(verbose_name="pinned",
                                     help_text='Should the post remain visible even after expiration?')
     db_readers = models.ManyToManyField("accounts.AccountDB", related_name="read_posts", null=True, blank=True,
@@ -43,6 +62,21 @@ class Post(SharedMemoryModel):
     db_parent = models.ForeignKey('Post', verbose_name='parent', related_name='replies', null=True, blank=True,
                                   help_text='Parent/child map for threaded replies.', on_delete=models.CASCADE)
     db_text = models.TextField(verbose_name="post_text", null=True, blank=True, help_text='Text of the post.')
+    db_seq = models.PositiveIntegerField(verbose_name="sequence", null=True, blank=True,
+                                         help_text='Position of the post on its board, in posting order.')
+    db_last_post = models.ForeignKey('Post', verbose_name='last post', related_name='+', null=True, blank=True,
+                                     help_text='Most recent post in the thread (threads only).',
+                                     on_delete=models.SET_NULL)
+    db_last_post_on = models.DateTimeField('last post on', null=True, blank=True,
+                                           help_text='Date of the most recent post in the thread (threads only).')
+    db_last_poster = models.CharField(max_length=40, verbose_name="last poster", null=True, blank=True,
+                                      help_text='Byline of the most recent post in the thread (threads only).')
+    db_total_posts = models.PositiveIntegerField(verbose_name="total posts", default=1,
+                                                 help_text='Number of posts in the thread (threads only).')
+    db_plaintext = models.TextField(verbose_name="plaintext", null=True, blank=True,
+                                    help_text='Text of the post, with ANSI markup stripped.')
+    db_html = models.TextField(verbose_name="html", null=True, blank=True,
+                               help_text='Text of the post, with ANSI markup converted to HTML.')
 
     objects = PostManager()
 
@@ -50,6 +84,16 @@ class Post(SharedMemoryModel):
         "Define Django meta options"
         verbose_name = "Post"
         verbose_name_plural = "Posts"
+        indexes = [
+            models.Index(fields=['db_board', 'db_pinned', 'db_date_created']),
+            models.Index(fields=['db_board', 'db_parent', 'db_pinned', 'db_last_post_on']),
+            models.Index(fields=['db_parent', 'db_date_created']),
+        ]
+        constraints = [
+            # Post numbers are worked out from the sequence arithmetically, so no two posts on a
+            # board may ever share one; see PostQuerySet.sequence_window.
+            models.UniqueConstraint(fields=['db_board', 'db_seq'], name='paxboards_post_unique_seq'),
+        ]
 
     def __str__(self):
         return "<Post " + str(self.id) + " by " + self.db_poster_name + ": " + self.db_subject + \
@@ -58,6 +102,91 @@ class Post(SharedMemoryModel):
     def __repr__(self):
         return str(self)
 
+    # Kept up to date with bulk updates on the primary, so never saved from a copy read from the
+    # replica; see paxboards.routers.
+    MAINTAINED_FIELDS = ('db_board', 'db_parent', 'db_seq', 'db_last_post', 'db_last_post_on', 'db_last_poster',
+                         'db_total_posts')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        if routers.is_replica(db):
+            return routers.uncached_from_db(cls, db, field_names, values)
+
+        return super(Post, cls).from_db(db, field_names, values)
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the post, throwing out any cached renderings of it, and of the thread it's in.
+
+        """
+        replica = routers.is_replica(self._state.db)
+        if replica and not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name not in self.MAINTAINED_FIELDS]
+
+        super(Post, self).save(*args, **kwargs)
+        if replica:
+            # Still the replica's copy, however many times it's saved.
+            self._state.db = routers.READ_DATABASE
+        self.invalidate_rendered()
+
+    def invalidate_rendered(self):
+        """
+        Drops the cached renderings (see display_post) of this post and every post above it in
+        its thread, since a thread's rendering includes its replies.
+
+        """
+        ids = []
+        post = self
+        while post:
+            ids.append(post.id)
+            post = post.db_parent
+
+        RENDER_CACHE.invalidate(ids)
+
+    def delete(self, *args, **kwargs):
+        """
+        Deletes the post along with every reply under it (which the database would take with it
+        anyway), closing the gaps they leave in the board's sequence numbers, dropping them from
+        the search index and updating the summary of the thread it was in.  To keep the replies,
+        use Post.objects.delete_posts, which moves them up instead.
+
+        """
+        self.invalidate_rendered()
+
+        post_ids = {self.pk} | set(Post.objects.thread_replies([self.pk]))
+        counts = Post.objects.delete_posts(Post.objects.filter(pk__in=post_ids))
+        return counts["posts"], {self._meta.label: counts["posts"]}
+
+    def update_thread_summary(self, reply=None):
+        """
+        Refreshes the thread summary fields on the first post of a thread.  Replies to replies
+        count towards the thread as much as replies to the first post.
+
+        Args:
+            reply (Post): A reply which has just been made somewhere in this thread.  If given, the
+                summary is just bumped to include it; otherwise the thread is recounted from
+                scratch.
+
+        Returns:
+            None
+
+        """
+        if reply and self.db_last_post_id:
+            last = reply
+            self.db_total_posts = self.db_total_posts + 1
+        else:
+            # Posting order and date order are the same, so the newest reply has the highest id.
+            replies = Post.objects.thread_replies([self.id])
+            last = Post.objects.get(pk=max(replies)) if replies else self
+            self.db_total_posts = len(replies) + 1
+
+        self.db_last_post = last
+        self.db_last_post_on = last.db_date_created
+        self.db_last_poster = last.db_poster_name
+        self.save(update_fields=['db_last_post', 'db_last_post_on', 'db_last_poster', 'db_total_posts',
+                                'db_date_modified'])
+
     def has_access(self, player, access_key):
         """
         Checks if the given player has the given access key or is the originator.
@@ -83,6 +212,27 @@ class Post(SharedMemoryModel):
 
         return self.db_board.access(player, access_type=access_key, default=False)
 
+    def set_text(self, text):
+        """
+        Sets the text of the post, along with its plaintext and HTML renderings, so they don't
+        have to be worked out each time the post is shown on the web.  The post isn't saved.
+
+        Args:
+            text (str): The new text of the post, with ANSI markup.
+
+        """
+        self.db_text = text
+        self.update_renderings()
+
+    def update_renderings(self):
+        """
+        Works out the plaintext and HTML renderings of the post's text.  The post isn't saved.
+
+        """
+        text = self.db_text or ""
+        self.db_plaintext = ansi.strip_ansi(text)
+        self.db_html = parse_html(text)
+
     def mark_read(self, player, has_read):
         """
         Mark this post read for the given player.
@@ -98,10 +248,9 @@ class Post(SharedMemoryModel):
             return
 
         if has_read:
-            self.db_readers.add(player)
+            get_read_state().mark_read([self], player)
         else:
-            self.db_readers.remove(player)
-        self.save()
+            get_read_state().mark_unread([self], player)
 
     @property
     def post_num(self):
@@ -113,8 +262,22 @@ class Post(SharedMemoryModel):
             An integer.
 
         """
-        posts = Post.objects.posts(self.db_board)
-        return list(posts).index(self) + 1 if self in posts else None
+        return Post.objects.get_queryset().post_number(self)
+
+    @property
+    def thread(self):
+        """
+
+        Returns:
+            The first Post of the thread this post belongs to, which may be
+            the post itself.
+
+        """
+        post = self
+        while post.db_parent:
+            post = post.db_parent
+
+        return post
 
     @property
     def last_reply(self):
@@ -125,6 +288,9 @@ class Post(SharedMemoryModel):
             there are none.
 
         """
+        if self.db_last_post:
+            return self.db_last_post
+
         posts = Post.objects.filter(db_parent=self).order_by('db_date_created')
         if posts:
             return posts.last()
@@ -148,11 +314,25 @@ class Post(SharedMemoryModel):
 
     @property
     def date_for_sort(self):
-        if hasattr(self,'last_post_on'):
-            return getattr(self, 'last_post_on')
+        if self.db_last_post_on:
+            return self.db_last_post_on
 
         return self.db_date_created
 
+    @property
+    def plaintext(self):
+        if self.db_plaintext is None:
+            return ansi.strip_ansi(self.db_text or "")
+
+        return self.db_plaintext
+
+    @property
+    def html(self):
+        if self.db_html is None:
+            return parse_html(self.db_text or "")
+
+        return self.db_html
+
     @property
     def posted_by(self):
         return self.db_poster_name
@@ -164,6 +344,30 @@ class Post(SharedMemoryModel):
     def display_post(self, player, show_replies=False):
         post_num = self.post_num
 
+        # The post number and board name can change without the post being saved, so they're
+        # part of the key; anything else that changes the rendering goes through save().
+        key = (self.id, show_replies, post_num, self.db_board.name)
+        post_string = RENDER_CACHE.get(key)
+        if post_string is None:
+            post_string = self.render_post(post_num, show_replies)
+            RENDER_CACHE.set(key, post_string)
+
+        player.msg(" ")
+        player.msg(post_string)
+        player.msg(" ")
+
+    def render_post(self, post_num, show_replies=False):
+        """
+        Builds the text of the post as read in-game.
+
+        Args:
+            post_num (int): The number the post is shown at on its board, or None.
+            show_replies (bool): Whether to include the replies to the post.
+
+        Returns:
+            A string.
+
+        """
         if post_num:
             postid = self.db_board.name + " / " + str(post_num)
         else:
@@ -198,9 +402,7 @@ class Post(SharedMemoryModel):
 
         post_string += "==========================================================================="
 
-        player.msg(" ")
-        player.msg(post_string)
-        player.msg(" ")
+        return post_string
 
 
 class BoardDB(TypedObject):
@@ -232,7 +434,177 @@ class BoardDB(TypedObject):
         verbose_name = "Board"
         verbose_name_plural = "Boards"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Boards read from the replica stay out of the shared cache, like posts.
+        if routers.is_replica(db):
+            return routers.uncached_from_db(cls, db, field_names, values)
+
+        return super(BoardDB, cls).from_db(db, field_names, values)
+
     def __str__(self):
         "Echoes the text representation of the board."
         return "Board '%s' (%s)" % (self.key, self.db.desc)
 
+
+
+class BoardReadMark(models.Model):
+    """
+    How far a player has read on a board, when the "watermark" read state is in use (see
+    paxboards.readstate).
+
+    - db_account: The player.
+    - db_board: The board.
+    - db_read_through: The highest post id the player has read up to.
+
+    """
+    db_account = models.ForeignKey("accounts.AccountDB", related_name="+", verbose_name="account",
+                                   help_text='Player whose read state this is.', on_delete=models.CASCADE)
+    db_board = models.ForeignKey("BoardDB", related_name="+", verbose_name="board",
+                                 help_text='Board the read state is for.', on_delete=models.CASCADE)
+    db_read_through = models.PositiveIntegerField(verbose_name="read through", default=0,
+                                                  help_text='Highest post id the player has read up to.')
+
+    class Meta(object):
+        "Define Django meta options"
+        verbose_name = "Board Read Mark"
+        verbose_name_plural = "Board Read Marks"
+        unique_together = (('db_account', 'db_board'),)
+
+
+class PostReadMark(models.Model):
+    """
+    A post a player has read above their watermark, or marked unread below it, when the
+    "watermark" read state is in use (see paxboards.readstate).
+
+    - db_account: The player.
+    - db_post: The post.
+    - db_read: True if the post has been read, False if it has been marked unread.
+
+    """
+    db_account = models.ForeignKey("accounts.AccountDB", related_name="+", verbose_name="account",
+                                   help_text='Player whose read state this is.', on_delete=models.CASCADE)
+    db_post = models.ForeignKey("Post", related_name="+", verbose_name="post",
+                                help_text='Post the read state is for.', on_delete=models.CASCADE)
+    db_read = models.BooleanField(verbose_name="read", default=True,
+                                  help_text='Whether the post has been read or marked unread.')
+
+    class Meta(object):
+        "Define Django meta options"
+        verbose_name = "Post Read Mark"
+        verbose_name_plural = "Post Read Marks"
+        unique_together = (('db_account', 'db_post'),)
+
+
+class ArchivedPost(models.Model):
+    """
+    A copy of a post which has expired off its board and been archived (see
+    paxboards.scripts.BoardExpiryScript).  Archived posts are never shown on the boards.
+
+    - db_original_id: The id the post had.
+    - db_original_parent: The id of the post it was a reply to, if any.
+    - db_board: The board the post was on.
+    - db_poster_player: The player object (if there is one) who made the post.
+    - db_poster_object: The object (if there is one) that made the post.
+    - db_poster_name: The byline of the post.
+    - db_subject: The subject of the post.
+    - db_text: The text of the post.
+    - db_date_created: The timestamp when the post was made.
+    - db_date_archived: The timestamp when the post was archived.
+    - db_readers: The players who had read the post.
+
+    """
+    db_original_id = models.PositiveIntegerField(verbose_name="original id", db_index=True,
+                                                 help_text='Id of the original post.')
+    db_original_parent = models.PositiveIntegerField(verbose_name="original parent", null=True, blank=True,
+                                                     help_text='Id of the post this was a reply to.')
+    db_board = models.ForeignKey("BoardDB", related_name="+", verbose_name='board',
+                                 help_text='Board this post was on.', on_delete=models.CASCADE)
+    db_poster_player = models.ForeignKey("accounts.AccountDB", related_name="+", null=True, blank=True,
+                                         verbose_name="poster(player)", help_text='Post origin (if player).',
+                                         on_delete=models.SET_NULL)
+    db_poster_object = models.ForeignKey("objects.ObjectDB", related_name="+", null=True, blank=True,
+                                         verbose_name="poster(object)", help_text='Post origin (if object).',
+                                         on_delete=models.SET_NULL)
+    db_poster_name = models.CharField(max_length=40, verbose_name="poster", help_text='Poster display name.')
+    db_subject = models.CharField(max_length=40, verbose_name="subject", help_text='Subject of post.')
+    db_text = models.TextField(verbose_name="post_text", null=True, blank=True, help_text='Text of the post.')
+    db_date_created = models.DateTimeField('date created', help_text='Date post was made.')
+    db_date_archived = models.DateTimeField('date archived', auto_now_add=True,
+                                            help_text='Date post was archived.')
+    db_readers = models.ManyToManyField("accounts.AccountDB", related_name="+", blank=True,
+                                        verbose_name="readers", help_text='Players who had read this post.')
+
+    class Meta(object):
+        "Define Django meta options"
+        verbose_name = "Archived Post"
+        verbose_name_plural = "Archived Posts"
+
+    @classmethod
+    def from_post(cls, post):
+        """
+        Makes an unsaved archive copy of a post, without its readers.
+
+        Args:
+            post (Post): The post to copy.
+
+        Returns:
+            An ArchivedPost object.
+
+        """
+        return cls(db_original_id=post.id, db_original_parent=post.db_parent_id, db_board_id=post.db_board_id,
+                   db_poster_player_id=post.db_poster_player_id, db_poster_object_id=post.db_poster_object_id,
+                   db_poster_name=post.db_poster_name, db_subject=post.db_subject, db_text=post.db_text,
+                   db_date_created=post.db_date_created)
+
+
+class SubscriptionMode(models.Model):
+    """
+    How a player wants to hear about new posts on a board they subscribe to, if not straight away
+    (see paxboards.notify).  Subscriptions with no row here are told about each post as it's made.
+
+    - db_account: The player.
+    - db_board: The board.
+    - db_mode: "hourly" for an hourly digest, or "login" for a digest when they next log in.
+
+    """
+    db_account = models.ForeignKey("accounts.AccountDB", related_name="+", verbose_name="account",
+                                   help_text='Player whose subscription this is.', on_delete=models.CASCADE)
+    db_board = models.ForeignKey("BoardDB", related_name="+", verbose_name="board",
+                                 help_text='Board the subscription is to.', on_delete=models.CASCADE)
+    db_mode = models.CharField(max_length=10, verbose_name="mode", help_text='How new posts are delivered.')
+
+    class Meta(object):
+        "Define Django meta options"
+        verbose_name = "Subscription Mode"
+        verbose_name_plural = "Subscription Modes"
+        unique_together = (('db_account', 'db_board'),)
+
+
+class PendingDigest(models.Model):
+    """
+    The new posts waiting to go out in a player's digest for one board (see paxboards.notify).
+    There's at most one row per player and board, however many posts are waiting.
+
+    - db_account: The player.
+    - db_board: The board.
+    - db_posts: How many new posts are waiting.
+    - db_first_post: The earliest of them, if it still exists.
+    - db_since: The timestamp of the earliest of them.
+
+    """
+    db_account = models.ForeignKey("accounts.AccountDB", related_name="+", verbose_name="account",
+                                   help_text='Player the digest is for.', on_delete=models.CASCADE)
+    db_board = models.ForeignKey("BoardDB", related_name="+", verbose_name="board",
+                                 help_text='Board the posts are on.', on_delete=models.CASCADE)
+    db_posts = models.PositiveIntegerField(verbose_name="posts", default=0,
+                                           help_text='Number of new posts waiting.')
+    db_first_post = models.ForeignKey("Post", related_name="+", null=True, blank=True, verbose_name="first post",
+                                      help_text='Earliest new post waiting.', on_delete=models.SET_NULL)
+    db_since = models.DateTimeField('since', help_text='Date of the earliest new post waiting.')
+
+    class Meta(object):
+        "Define Django meta options"
+        verbose_name = "Pending Digest"
+        verbose_name_plural = "Pending Digests"
+        unique_together = (('db_account', 'db_board'),)
@@ -0,0 +1,257 @@
+"""
+New post notifications for Paxboards.
+
+Posting a message doesn't announce it to the board's subscribers straight away.  The new post is
+queued, and a moment later (PAXBOARDS_NOTIFY_DELAY seconds, default 2) everything queued since is
+sent out in one pass, off the poster's command.  Only subscribers who are connected at that point
+are messaged, each with a single message; if several posts went up on one board in the meantime
+(PAXBOARDS_NOTIFY_COALESCE or more, default 3), they get a count instead of a line per post.
+
+Subscribers who were offline hear about what they missed when they next log in, from their unread
+counts, so nothing needs to be kept for them in the meantime.
+
+A subscription can instead be set to a digest, with `bboard/sub <board>=hourly` or `=login`.  New
+posts on those boards aren't announced at all; each player and board just keeps a running count
+in the PendingDigest table, and the counts go out together, one message per player, either from
+DigestScript every PAXBOARDS_DIGEST_INTERVAL seconds (default 3600) or when the player next logs
+in.  Any digest still waiting at login, hourly or not, goes out then.
+
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Exists, OuterRef
+from evennia.utils import delay, logger
+
+_QUEUE = []
+_SCHEDULED = False
+
+NOTIFY_DELAY = getattr(settings, "PAXBOARDS_NOTIFY_DELAY", 2)
+NOTIFY_COALESCE = getattr(settings, "PAXBOARDS_NOTIFY_COALESCE", 3)
+
+# The ways a subscriber can hear about new posts; "immediate" is the default, and isn't stored.
+DELIVERY_MODES = ("immediate", "hourly", "login")
+
+
+def queue_post(post):
+    """
+    Queues a new post to be announced to its board's subscribers.
+
+    Args:
+        post (Post): The post which has just been made.
+
+    """
+    global _SCHEDULED
+
+    _QUEUE.append(post.id)
+    if not _SCHEDULED:
+        _SCHEDULED = True
+        delay(NOTIFY_DELAY, dispatch)
+
+
+def dispatch():
+    """
+    Announces every queued post to the connected subscribers of its board, and adds it to the
+    digests of those who take one.  This is a fixed number of queries for the whole queue, plus a
+    few for each board with digest subscribers and a post number lookup for each post which is
+    announced individually.
+
+    """
+    global _QUEUE, _SCHEDULED
+
+    post_ids, _QUEUE = _QUEUE, []
+    _SCHEDULED = False
+
+    try:
+        _announce(post_ids)
+    except Exception:
+        logger.log_trace("Paxboards: unable to send new post notifications.")
+
+
+def _announce(post_ids):
+    from evennia import SESSION_HANDLER
+    from paxboards.models import Post, BoardDB, SubscriptionMode
+
+    if not post_ids:
+        return
+
+    # Posts deleted in the meantime simply drop out here.
+    by_board = {}
+    for post in Post.objects.filter(pk__in=post_ids).select_related('db_board').order_by('id'):
+        by_board.setdefault(post.db_board_id, []).append(post)
+
+    digests = {}
+    for account_id, board_id in SubscriptionMode.objects.filter(db_board_id__in=list(by_board)) \
+            .values_list('db_account_id', 'db_board_id'):
+        digests.setdefault(board_id, set()).add(account_id)
+
+    _add_to_digests(by_board, digests)
+
+    connected = dict((a.id, a) for a in SESSION_HANDLER.all_connected_accounts())
+    if not connected:
+        return
+
+    subscriptions = BoardDB.db_subscriptions.through.objects.filter(boarddb_id__in=list(by_board),
+                                                                    accountdb_id__in=list(connected))
+    listeners = {}
+    for board_id, account_id in subscriptions.values_list('boarddb_id', 'accountdb_id'):
+        if account_id not in digests.get(board_id, ()):
+            listeners.setdefault(account_id, []).append(board_id)
+
+    announcements = {}
+    for account_id, board_ids in listeners.items():
+        lines = []
+        for board_id in sorted(board_ids):
+            if board_id not in announcements:
+                announcements[board_id] = board_announcement(by_board[board_id])
+            if announcements[board_id]:
+                lines.append(announcements[board_id])
+
+        if lines:
+            connected[account_id].msg("|/" + "|/".join(lines) + "|/")
+
+
+def _add_to_digests(by_board, digests):
+    """
+    Adds new posts to the pending digests of the players who take them, with a few queries per
+    board rather than per post or per player.
+
+    Args:
+        by_board (dict): The new posts, as a dictionary of board id to list of posts, oldest first.
+        digests (dict): The players who take a digest, as a dictionary of board id to account ids.
+
+    """
+    from paxboards.models import PendingDigest
+
+    with transaction.atomic():
+        for board_id, account_ids in digests.items():
+            posts = by_board[board_id]
+            pending = PendingDigest.objects.filter(db_board_id=board_id, db_account_id__in=account_ids)
+            waiting = set(pending.values_list('db_account_id', flat=True))
+
+            pending.update(db_posts=F('db_posts') + len(posts))
+            PendingDigest.objects.bulk_create([
+                PendingDigest(db_account_id=account_id, db_board_id=board_id, db_posts=len(posts),
+                              db_first_post=posts[0], db_since=posts[0].db_date_created)
+                for account_id in account_ids if account_id not in waiting])
+
+
+def flush_digests(mode=None, accounts=None):
+    """
+    Sends out waiting digests, one message per player, and clears them.  This is a fixed number
+    of queries however many players, boards or posts there are.
+
+    Args:
+        mode (str): If given, only the digests for subscriptions in this mode are sent.
+        accounts (list): If given, only the digests for these account ids are sent.
+
+    Returns:
+        The number of players messaged.
+
+    """
+    from paxboards.models import Post, PendingDigest, SubscriptionMode
+
+    pending = PendingDigest.objects.select_related('db_account', 'db_board', 'db_first_post')
+    if accounts is not None:
+        pending = pending.filter(db_account_id__in=accounts)
+
+    if mode:
+        modes = SubscriptionMode.objects.filter(db_account=OuterRef('db_account'), db_board=OuterRef('db_board'),
+                                                db_mode=mode)
+        pending = pending.annotate(in_mode=Exists(modes)).filter(in_mode=True)
+
+    pending = list(pending.order_by('db_account', 'db_board__db_key'))
+    if not pending:
+        return 0
+
+    numbers = Post.objects.get_queryset().post_numbers([d.db_first_post for d in pending if d.db_first_post])
+
+    by_account = {}
+    for digest in pending:
+        by_account.setdefault(digest.db_account, []).append(
+            digest_line(digest, numbers.get(digest.db_first_post_id)))
+
+    PendingDigest.objects.filter(pk__in=[d.pk for d in pending]).delete()
+
+    for account, lines in by_account.items():
+        account.msg("|/|555Bulletin board digest:|n|/" + "|/".join(lines) + "|/")
+
+    return len(by_account)
+
+
+def digest_line(digest, postnum=None):
+    """
+    Builds the line for one board in a digest.
+
+    Args:
+        digest (PendingDigest): The waiting digest.
+        postnum (int): The number the first new post is shown at on the board, if it's still active.
+
+    Returns:
+        A string.
+
+    """
+    board = digest.db_board
+    line = "|555" + str(digest.db_posts) + " new post" + ("s" if digest.db_posts != 1 else "") + "|n on " + \
+        board.name + " since " + digest.db_since.strftime("%Y/%m/%d %H:%M")
+    if postnum:
+        line += " (from " + board.name + "/" + str(postnum) + ")"
+
+    return line + "."
+
+
+def board_announcement(posts):
+    """
+    Builds the announcement for a run of new posts on one board.
+
+    Args:
+        posts (list): The new Post objects, oldest first, all on the same board.
+
+    Returns:
+        A string, or None if none of the posts are active on the board any more.
+
+    """
+    board = posts[0].db_board
+
+    if len(posts) >= NOTIFY_COALESCE:
+        return "|555" + str(len(posts)) + " new posts|n on " + board.name + "."
+
+    lines = []
+    for p in posts:
+        postnum = p.post_num
+        if postnum:
+            lines.append("New post by |555" + p.db_poster_name + ":|n (" + board.name + "/" + str(postnum) +
+                         ") |555" + p.db_subject + "|n")
+
+    return "|/".join(lines) or None
+
+
+def login_summary(account):
+    """
+    Sends a player who has just logged in any digests waiting for them, and tells them how many
+    unread posts are waiting on the boards they subscribe to.
+
+    Args:
+        account (AccountDB): The player who has logged in.
+
+    """
+    from paxboards.boards import DefaultBoard
+
+    flush_digests(accounts=[account.id])
+
+    boards = [b for b in DefaultBoard.objects.get_subscriptions(account)
+              if b.access(account, access_type="read", default=True)]
+    DefaultBoard.objects.annotate_counts(boards, account)
+
+    lines = [str(b.unread_count) + " unread post" + ("s" if b.unread_count != 1 else "") + " on " + b.name
+             for b in sorted(boards, key=lambda b: b.name) if b.unread_count]
+    if lines:
+        account.msg("|/|555Bulletin boards:|n " + ", ".join(lines) + ".|/")
+
+
+def at_account_login(sender, **kwargs):
+    """
+    Signal handler for SIGNAL_ACCOUNT_POST_LOGIN, which sends the login summary once the login
+    itself is out of the way.
+
+    """
+    delay(0, login_summary, sender)
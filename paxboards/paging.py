@@ -0,0 +1,159 @@
+"""
+Keyset (cursor) paging for Paxboards' web pages.
+
+Rather than counting off OFFSET rows, each page starts from a cursor naming the sort key of the
+row just before (or after) it, so fetching page 100 is as cheap as fetching page 1, and rows posted
+in the meantime don't shift anything between pages.  The ordering must end with a unique field
+(normally 'id') for this to work.
+
+Cursors are passed around as short strings, e.g. '1.1572307200000000.42' for a pinned thread last
+posted to at that many microseconds past the epoch, with id 42.
+
+"""
+from datetime import datetime, timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import Q, BooleanField, DateTimeField
+from django.utils import timezone
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class KeysetPage(object):
+    """
+    One page of rows, with the cursors for the pages either side of it.
+
+    - rows: The rows on this page, in display order.
+    - next_cursor: The cursor for the following page, or None if this is the last.
+    - previous_cursor: The cursor for the preceding page, or None if this is the first.
+
+    """
+
+    def __init__(self, rows, next_cursor, previous_cursor):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def encode_cursor(row, ordering):
+    """
+    Builds the cursor string for a row.
+
+    Args:
+        row (Model): The row.
+        ordering (list): The ordering of the page, as given to order_by().
+
+    Returns:
+        A string.
+
+    """
+    parts = []
+    for field in ordering:
+        value = getattr(row, field.lstrip('-'))
+        if isinstance(value, datetime):
+            delta = value - (_EPOCH if timezone.is_aware(value) else _EPOCH.replace(tzinfo=None))
+            value = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+        parts.append(str(int(value)))
+
+    return ".".join(parts)
+
+
+def decode_cursor(cursor, model, ordering):
+    """
+    Turns a cursor string back into the values of the ordering fields.
+
+    Args:
+        cursor (str): The cursor, as made by encode_cursor.
+        model (Model): The model being paged through.
+        ordering (list): The ordering of the page, as given to order_by().
+
+    Returns:
+        A list of values, or None if the cursor isn't valid.
+
+    """
+    parts = cursor.split(".") if cursor else []
+    if len(parts) != len(ordering):
+        return None
+
+    values = []
+    for field, part in zip(ordering, parts):
+        try:
+            value = int(part)
+        except ValueError:
+            return None
+
+        model_field = model._meta.get_field(field.lstrip('-'))
+        if isinstance(model_field, DateTimeField):
+            value = (_EPOCH if settings.USE_TZ else _EPOCH.replace(tzinfo=None)) + timedelta(microseconds=value)
+        elif isinstance(model_field, BooleanField):
+            value = bool(value)
+        values.append(value)
+
+    return values
+
+
+def keyset_page(queryset, ordering, page_size, after=None, before=None):
+    """
+    Fetches one page of a queryset, starting just after (or ending just before) a cursor.
+
+    Args:
+        queryset (QuerySet): The rows to page through.
+        ordering (list): The ordering of the rows, as given to order_by(), ending in a unique field.
+        page_size (int): The most rows to put on a page.
+        after (str): The cursor of the row just before this page, if any.
+        before (str): The cursor of the row just after this page, if any; used when paging back.
+
+    Returns:
+        A KeysetPage object.
+
+    """
+    backwards = bool(before) and not after
+    values = decode_cursor(before if backwards else after, queryset.model, ordering)
+
+    if values:
+        clauses = []
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            lookup = name + ('__lt' if descending != backwards else '__gt')
+            clauses.append(Q(**dict(equal, **{lookup: value})))
+            equal[name] = value
+        queryset = queryset.filter(reduce(or_, clauses))
+
+    if backwards:
+        queryset = queryset.order_by(*[f[1:] if f.startswith('-') else '-' + f for f in ordering])
+    else:
+        queryset = queryset.order_by(*ordering)
+
+    rows = list(queryset[:page_size + 1])
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage(rows, None, None)
+
+    first, last = encode_cursor(rows[0], ordering), encode_cursor(rows[-1], ordering)
+    if backwards:
+        return KeysetPage(rows, last, first if more else None)
+
+    return KeysetPage(rows, last if more else None, first if values else None)
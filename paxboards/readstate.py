@@ -0,0 +1,522 @@
+"""
+Read/unread tracking for Paxboards.
+
+There are two ways of storing which posts a player has read, chosen with the PAXBOARDS_READ_STATE
+setting:
+
+- "readers" (the default): one row in the Post.db_readers table for every post a player has read.
+  Simple, but it grows with posts times players.
+
+- "watermark": one BoardReadMark per player and board, recording the highest post id read up to,
+  plus a PostReadMark for each post read out of order (or marked unread again).  Catching up on a
+  board is a single update, and checking a post is mostly a comparison against the watermark.
+
+To switch an existing game over to watermarks, run `evennia makemigrations paxboards` and `evennia
+migrate`, then `bbadmin/migratereads` to build watermarks from the readers table, and only then set
+
+    PAXBOARDS_READ_STATE = "watermark"
+
+The readers table is left untouched, so you can switch back.
+
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (F, Exists, OuterRef, Subquery, Count, Max, Case, When, Value,
+                              BooleanField, IntegerField)
+from django.db.models.functions import Coalesce
+
+
+class ReadersReadState(object):
+    """
+    Keeps read state as one row per (post, player) in the Post.db_readers table.
+
+    """
+
+    def annotate_unread(self, queryset, player, post_field='pk'):
+        """
+        Annotates each post in a queryset with an 'unread' field for the given player.
+
+        Args:
+            queryset (QuerySet): The posts to annotate.
+            player (AccountDB): The player whose read/unread status should be used.
+            post_field (str): The field naming the post whose read status counts.
+
+        Returns:
+            A queryset of Post objects.
+
+        """
+        readers = queryset.model.db_readers.through.objects.filter(post=OuterRef(post_field), accountdb=player)
+        return queryset.annotate(unread=~Exists(readers))
+
+    def read_counts(self, queryset, player):
+        """
+        Counts how many of the given posts the player has read, per board.
+
+        Args:
+            queryset (QuerySet): The posts to count.
+            player (AccountDB): The player whose read/unread status should be used.
+
+        Returns:
+            A dictionary of board id to number of posts read.
+
+        """
+        return dict(queryset.filter(db_readers=player).order_by().values_list('db_board')
+                    .annotate(read=Count('id')))
+
+    def mark_read(self, posts, player):
+        """
+        Marks the given posts read for the player.  The ones already read are found with one
+        query, and the rest are marked with one bulk insert, or no write at all if there are none.
+
+        Args:
+            posts (list): The Post objects to mark.
+            player (AccountDB): The player who has read them.
+
+        """
+        from paxboards.models import Post
+
+        post_ids = [p.id for p in posts]
+        if not post_ids:
+            return
+
+        readers = Post.db_readers.through
+        read = set(readers.objects.filter(accountdb_id=player.id, post_id__in=post_ids)
+                   .values_list('post_id', flat=True))
+        missing = [i for i in post_ids if i not in read]
+        if missing:
+            readers.objects.bulk_create([readers(post_id=i, accountdb_id=player.id) for i in missing],
+                                        ignore_conflicts=True)
+
+    def mark_unread(self, posts, player):
+        """
+        Marks the given posts unread for the player.
+
+        Args:
+            posts (list): The Post objects to mark.
+            player (AccountDB): The player who should see them as unread.
+
+        """
+        for p in posts:
+            p.db_readers.remove(player)
+
+    def mark_boards_read(self, boards, player):
+        """
+        Marks every active post on the given boards read for the player.  The unread posts are
+        found with one query, and the missing reader rows are added with bulk inserts in a
+        single transaction.
+
+        Args:
+            boards (list): The boards to catch up on.
+            player (AccountDB): The player catching up.
+
+        Returns:
+            The number of posts which were marked read.
+
+        """
+        from paxboards.models import Post
+
+        readers = Post.db_readers.through
+        with transaction.atomic():
+            posts = Post.objects.get_queryset().by_boards(boards)
+            unread = list(self.annotate_unread(posts, player).filter(unread=True).values_list('id', flat=True))
+            readers.objects.bulk_create([readers(post_id=i, accountdb_id=player.id) for i in unread],
+                                        batch_size=500, ignore_conflicts=True)
+
+        return len(unread)
+
+
+    def readers(self, posts):
+        """
+        Finds who has read each of the given posts, with a fixed number of queries.
+
+        Args:
+            posts (list): The Post objects to check, or anything else with their 'id' and
+                'db_board_id', such as rows from values_list(..., named=True).
+
+        Returns:
+            A dictionary of post id to a set of the ids of the players who have read it.
+
+        """
+        from paxboards.models import Post
+
+        readers = dict((p.id, set()) for p in posts)
+        for post_id, account_id in Post.db_readers.through.objects.filter(post_id__in=list(readers)) \
+                .values_list('post_id', 'accountdb_id'):
+            readers[post_id].add(account_id)
+
+        return readers
+
+    def add_reads(self, reads):
+        """
+        Marks posts read for many players at once, e.g. when importing boards.  Reads which are
+        already recorded are left alone.
+
+        Args:
+            reads (list): (post id, account id) pairs.
+
+        """
+        from paxboards.models import Post
+
+        readers = Post.db_readers.through
+        readers.objects.bulk_create([readers(post_id=post_id, accountdb_id=account_id) for post_id, account_id in reads],
+                                    batch_size=500, ignore_conflicts=True)
+
+    def before_move(self, post_ids):
+        """
+        Called just before posts are moved to another board, to note down whatever after_move
+        will need to keep who has read them the same.
+
+        Args:
+            post_ids (iterable): The ids of the posts about to move.
+
+        Returns:
+            Whatever should be passed to after_move.
+
+        """
+        # The reader rows belong to the posts, so they move with them.
+        return None
+
+    def after_move(self, post_ids, board, before):
+        """
+        Called just after posts have been moved to another board.
+
+        Args:
+            post_ids (iterable): The ids of the posts which moved.
+            board (BoardDB): The board they moved to.
+            before: What before_move returned.
+
+        """
+        pass
+
+
+class WatermarkReadState(ReadersReadState):
+    """
+    Keeps read state as a per-(player, board) watermark, plus exceptions for individual posts.  A
+    post is read if it has a read exception, or if its id is at or below the watermark and it
+    doesn't have an unread exception.
+
+    A post moved to another board keeps its id, which can put it on the other side of the new
+    board's watermarks, so moving posts adds whatever exceptions are needed to keep who has read
+    them the same.
+
+    """
+
+    def annotate_unread(self, queryset, player, post_field='pk'):
+        from paxboards.models import BoardReadMark, PostReadMark
+
+        watermark = BoardReadMark.objects.filter(db_account=player, db_board=OuterRef('db_board'))
+        exceptions = PostReadMark.objects.filter(db_account=player, db_post=OuterRef(post_field))
+
+        queryset = queryset.annotate(
+            readmark_through=Coalesce(Subquery(watermark.values('db_read_through')[:1],
+                                               output_field=IntegerField()), Value(0)),
+            readmark_read=Exists(exceptions.filter(db_read=True)),
+            readmark_unread=Exists(exceptions.filter(db_read=False)))
+
+        return queryset.annotate(unread=Case(
+            When(readmark_read=True, then=Value(False)),
+            When(readmark_unread=True, then=Value(True)),
+            When(**{post_field + '__lte': F('readmark_through'), 'then': Value(False)}),
+            default=Value(True), output_field=BooleanField()))
+
+    def read_counts(self, queryset, player):
+        return dict(self.annotate_unread(queryset, player).filter(unread=False).order_by()
+                    .values_list('db_board').annotate(read=Count('id')))
+
+    def mark_read(self, posts, player):
+        from paxboards.models import Post, PostReadMark
+
+        # Only touch the read state at all if something is newly read.
+        unread = set(self.annotate_unread(Post.objects.filter(pk__in=[p.id for p in posts]), player)
+                     .filter(unread=True).values_list('id', flat=True))
+        posts = [p for p in posts if p.id in unread]
+
+        for board, board_posts in self._by_board(posts).items():
+            with transaction.atomic():
+                mark = self._watermark(board, player)
+                below = [p.id for p in board_posts if p.id <= mark.db_read_through]
+                above = [p.id for p in board_posts if p.id > mark.db_read_through]
+
+                if below:
+                    PostReadMark.objects.filter(db_account=player, db_post__in=below).delete()
+                if above:
+                    PostReadMark.objects.bulk_create([PostReadMark(db_account=player, db_post_id=i, db_read=True)
+                                                      for i in above], ignore_conflicts=True)
+                    self._advance(mark)
+
+    def mark_unread(self, posts, player):
+        from paxboards.models import PostReadMark
+
+        for board, board_posts in self._by_board(posts).items():
+            with transaction.atomic():
+                mark = self._watermark(board, player)
+                below = [p.id for p in board_posts if p.id <= mark.db_read_through]
+                above = [p.id for p in board_posts if p.id > mark.db_read_through]
+
+                if above:
+                    PostReadMark.objects.filter(db_account=player, db_post__in=above).delete()
+                if below:
+                    PostReadMark.objects.filter(db_account=player, db_post__in=below).delete()
+                    PostReadMark.objects.bulk_create([PostReadMark(db_account=player, db_post_id=i, db_read=False)
+                                                      for i in below], ignore_conflicts=True)
+
+    def mark_boards_read(self, boards, player):
+        from paxboards.models import Post, BoardReadMark, PostReadMark
+
+        if not boards:
+            return 0
+
+        with transaction.atomic():
+            posts = Post.objects.get_queryset().by_boards(boards)
+            unread = self.annotate_unread(posts, player).filter(unread=True).count()
+
+            last = dict(Post.objects.filter(db_board__in=boards).order_by().values_list('db_board')
+                        .annotate(last=Max('id')))
+            BoardReadMark.objects.bulk_create([BoardReadMark(db_account=player, db_board_id=board_id)
+                                               for board_id in last], ignore_conflicts=True)
+            BoardReadMark.objects.filter(db_account=player, db_board__in=list(last)).update(
+                db_read_through=Case(*[When(db_board=board_id, then=Value(read_through))
+                                       for board_id, read_through in last.items()],
+                                     output_field=IntegerField()))
+            PostReadMark.objects.filter(db_account=player, db_post__db_board__in=boards).delete()
+
+        return unread
+
+    def readers(self, posts):
+        from paxboards.models import BoardReadMark, PostReadMark
+
+        marks = {}
+        for board_id, account_id, read_through in BoardReadMark.objects \
+                .filter(db_board__in=set(p.db_board_id for p in posts)) \
+                .values_list('db_board', 'db_account', 'db_read_through'):
+            marks.setdefault(board_id, []).append((account_id, read_through))
+
+        readers = dict((p.id, set(account_id for account_id, read_through in marks.get(p.db_board_id, [])
+                                  if p.id <= read_through)) for p in posts)
+
+        for post_id, account_id, read in PostReadMark.objects.filter(db_post__in=list(readers)) \
+                .values_list('db_post', 'db_account', 'db_read'):
+            if read:
+                readers[post_id].add(account_id)
+            else:
+                readers[post_id].discard(account_id)
+
+        return readers
+
+    def add_reads(self, reads):
+        from paxboards.models import Post, BoardDB, BoardReadMark, PostReadMark
+
+        if not reads:
+            return
+
+        # Everything goes in as exceptions first, then each player's watermark on each board is
+        # moved up over them, so they don't stay as one row per post.  As in mark_boards_read,
+        # this takes a few queries per board, however many players there are.
+        with transaction.atomic():
+            PostReadMark.objects.bulk_create([PostReadMark(db_account_id=account_id, db_post_id=post_id, db_read=True)
+                                              for post_id, account_id in reads],
+                                             batch_size=500, ignore_conflicts=True)
+
+            boards = dict(Post.objects.filter(pk__in=set(post_id for post_id, account_id in reads))
+                          .values_list('id', 'db_board'))
+            pairs = set((boards[post_id], account_id) for post_id, account_id in reads if post_id in boards)
+            account_ids = set(account_id for board_id, account_id in pairs)
+
+            BoardReadMark.objects.bulk_create([BoardReadMark(db_account_id=account_id, db_board_id=board_id)
+                                               for board_id, account_id in pairs],
+                                              batch_size=500, ignore_conflicts=True)
+            marks = {}
+            for mark_id, board_id, account_id, read_through in BoardReadMark.objects \
+                    .filter(db_board__in=set(boards.values()), db_account__in=account_ids) \
+                    .values_list('id', 'db_board', 'db_account', 'db_read_through'):
+                if (board_id, account_id) in pairs:
+                    marks[board_id, account_id] = (mark_id, read_through)
+
+            exceptions = {}
+            for mark_id, post_id, board_id, account_id in PostReadMark.objects \
+                    .filter(db_account__in=account_ids, db_post__db_board__in=set(boards.values()), db_read=True) \
+                    .values_list('id', 'db_post', 'db_post__db_board', 'db_account'):
+                if (board_id, account_id) in marks and post_id > marks[board_id, account_id][1]:
+                    exceptions.setdefault((board_id, account_id), {})[post_id] = mark_id
+
+            advanced = []
+            covered = []
+            for board in BoardDB.objects.filter(pk__in=set(boards.values())):
+                board_marks = dict((account_id, (read_through, exceptions.get((board_id, account_id), {})))
+                                   for (board_id, account_id), (mark_id, read_through) in marks.items()
+                                   if board_id == board.id)
+                for account_id, read_through in self._read_through(board, board_marks):
+                    mark_id, previous = marks[board.id, account_id]
+                    if read_through > previous:
+                        advanced.append((mark_id, read_through))
+                        covered.extend(mark for post_id, mark in board_marks[account_id][1].items()
+                                       if post_id <= read_through)
+
+            for start in range(0, len(advanced), 500):
+                chunk = advanced[start:start + 500]
+                BoardReadMark.objects.filter(pk__in=[mark_id for mark_id, read_through in chunk]).update(
+                    db_read_through=Case(*[When(pk=mark_id, then=Value(read_through))
+                                           for mark_id, read_through in chunk],
+                                         output_field=IntegerField()))
+            for start in range(0, len(covered), 500):
+                PostReadMark.objects.filter(pk__in=covered[start:start + 500]).delete()
+
+    def _read_through(self, board, marks):
+        """
+        Works out how far each of several players' watermarks on a board can move up, as
+        _advance does for one, with a few queries for the whole board.
+
+        Args:
+            board (BoardDB): The board.
+            marks (dict): Account id to a tuple of (current watermark, read exceptions above
+                it), the exceptions being anything keyed by post id.
+
+        Returns:
+            A list of (account id, new watermark) pairs.
+
+        """
+        from paxboards.models import Post
+
+        if not marks:
+            return []
+
+        posts = Post.objects.get_queryset()
+        active = posts.filter(posts.active_filter(board))
+        lowest = min(read_through for read_through, read in marks.values())
+        highest = max(max([read_through] + list(read)) for read_through, read in marks.values())
+
+        # Only the active posts up to the highest watermark or exception can be read past, and the
+        # first one after that is unread by everyone.
+        candidates = list(active.filter(pk__gt=lowest, pk__lte=highest).order_by('id').values_list('id', flat=True))
+        beyond = active.filter(pk__gt=highest).order_by('id').values_list('id', flat=True).first()
+        last = None
+
+        results = []
+        for account_id, (read_through, read) in marks.items():
+            first_unread = next((post_id for post_id in candidates if post_id > read_through and post_id not in read),
+                                beyond)
+
+            if first_unread:
+                results.append((account_id, first_unread - 1))
+            else:
+                if last is None:
+                    last = posts.filter(db_board=board).aggregate(last=Max('id'))['last'] or 0
+                results.append((account_id, last))
+
+        return results
+
+    def before_move(self, post_ids):
+        from paxboards.models import Post
+
+        return self.readers(Post.objects.filter(pk__in=list(post_ids)).values_list('id', 'db_board_id', named=True))
+
+    def after_move(self, post_ids, board, before):
+        from paxboards.models import Post, PostReadMark
+
+        after = self.readers(Post.objects.filter(pk__in=list(post_ids)).values_list('id', 'db_board_id', named=True))
+
+        # Neither kind of exception can be there already: a read exception would have kept the
+        # post read after the move, and an unread one kept it unread before.
+        marks = []
+        for post_id, readers in before.items():
+            marks.extend(PostReadMark(db_account_id=account_id, db_post_id=post_id, db_read=True)
+                         for account_id in readers - after.get(post_id, set()))
+            marks.extend(PostReadMark(db_account_id=account_id, db_post_id=post_id, db_read=False)
+                         for account_id in after.get(post_id, set()) - readers)
+        PostReadMark.objects.bulk_create(marks, batch_size=500, ignore_conflicts=True)
+
+    def _by_board(self, posts):
+        boards = {}
+        for p in posts:
+            boards.setdefault(p.db_board, []).append(p)
+        return boards
+
+    def _watermark(self, board, player):
+        from paxboards.models import BoardReadMark
+
+        mark, created = BoardReadMark.objects.get_or_create(db_account=player, db_board=board)
+        return mark
+
+    def _advance(self, mark):
+        """
+        Moves a watermark up past any run of read posts just above it, and drops the exceptions
+        it now covers, so the exceptions stay sparse when posts are read in order.  Posts which
+        have expired off the board can no longer be read, so they don't hold the watermark back.
+
+        """
+        from paxboards.models import Post, PostReadMark
+
+        board = mark.db_board
+        player_reads = PostReadMark.objects.filter(db_account=mark.db_account, db_read=True)
+
+        posts = Post.objects.get_queryset()
+        first_unread = posts.filter(posts.active_filter(board), pk__gt=mark.db_read_through) \
+            .exclude(pk__in=player_reads.values('db_post')).order_by('id').values_list('id', flat=True).first()
+
+        if first_unread:
+            read_through = first_unread - 1
+        else:
+            read_through = posts.filter(db_board=board).aggregate(last=Max('id'))['last'] or 0
+
+        if read_through <= mark.db_read_through:
+            return
+
+        mark.db_read_through = read_through
+        mark.save()
+        player_reads.filter(db_post__db_board=board, db_post__lte=read_through).delete()
+
+
+def migrate_readers(board):
+    """
+    Builds watermarks for one board from the Post.db_readers table.  Each player's watermark is
+    put just below the oldest active post they haven't read, and anything they've read above
+    that becomes an exception.  It's safe to run more than once.
+
+    Args:
+        board (BoardDB): The board to migrate.
+
+    Returns:
+        The number of players whose read state was migrated.
+
+    """
+    from paxboards.models import Post, BoardReadMark, PostReadMark
+
+    posts = Post.objects.get_queryset()
+    active = list(posts.filter(posts.active_filter(board)).order_by('id').values_list('id', flat=True))
+    last = posts.filter(db_board=board).aggregate(last=Max('id'))['last'] or 0
+
+    reads = {}
+    for account_id, post_id in Post.db_readers.through.objects.filter(post__db_board=board) \
+            .values_list('accountdb_id', 'post_id'):
+        reads.setdefault(account_id, set()).add(post_id)
+
+    with transaction.atomic():
+        for account_id, read in reads.items():
+            read_through = last
+            for post_id in active:
+                if post_id not in read:
+                    read_through = post_id - 1
+                    break
+
+            BoardReadMark.objects.filter(db_account_id=account_id, db_board=board).delete()
+            BoardReadMark.objects.create(db_account_id=account_id, db_board=board, db_read_through=read_through)
+
+            PostReadMark.objects.filter(db_account_id=account_id, db_post__db_board=board).delete()
+            PostReadMark.objects.bulk_create([PostReadMark(db_account_id=account_id, db_post_id=i, db_read=True)
+                                              for i in read if i > read_through])
+
+    return len(reads)
+
+
+def get_read_state():
+    """
+    Returns the read state handler chosen by the PAXBOARDS_READ_STATE setting.
+
+    Returns:
+        A ReadersReadState or WatermarkReadState object.
+
+    """
+    if getattr(settings, "PAXBOARDS_READ_STATE", "readers") == "watermark":
+        return WatermarkReadState()
+
+    return ReadersReadState()
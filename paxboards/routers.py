@@ -0,0 +1,169 @@
+"""
+Read-replica routing for Paxboards.
+
+Listing boards and reading threads make up most of the boards' queries.  On a busy game these can
+be sent to a read replica of the database, leaving the primary for writes.  To do so, add the
+replica to DATABASES, then in your settings file:
+
+    DATABASE_ROUTERS = ["paxboards.routers.ReplicaRouter"]
+    PAXBOARDS_READ_DATABASE = "replica"
+
+Reads of posts and boards then go to the replica, and everything else (writes included) to the
+primary, PAXBOARDS_WRITE_DATABASE ("default" unless you say otherwise).
+
+A replica lags a little behind the primary, so a player who has just posted, or just marked a post
+read, might not see it yet.  To avoid that, each player's reads stick to the primary for
+PAXBOARDS_STICKY_SECONDS (5 by default) after they last wrote anything to the boards; set it to
+comfortably more than your replica's usual lag.  Reads are only sent to the replica when it's
+known who they're for (in bboard, bbadmin and the web views), so background scripts and anything
+else always read from the primary, as do reads inside a transaction.
+
+Posts and boards are normally kept in a cache shared by the whole server (Evennia's idmapper), so
+each is only loaded once.  Rows read from the replica might be behind, so they're left out of it:
+other players never see them, and they're thrown away with the command or page that read them.
+A post read from the replica can still be saved, but without the fields which the boards keep up
+to date with bulk updates on the primary (its post number, board, parent and thread summary), so
+a stale copy can't write old values back.
+
+"""
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import DEFERRED
+
+READ_DATABASE = getattr(settings, "PAXBOARDS_READ_DATABASE", None)
+WRITE_DATABASE = getattr(settings, "PAXBOARDS_WRITE_DATABASE", "default")
+STICKY_SECONDS = getattr(settings, "PAXBOARDS_STICKY_SECONDS", 5)
+
+_local = threading.local()
+
+# When each player last wrote to the boards, by account id; None is for writes made for no one in
+# particular.
+_last_write = {}
+
+
+@contextmanager
+def acting_as(account):
+    """
+    Makes the board queries within the block on behalf of a player, so they can read from the
+    replica, and see their own writes.
+
+    Args:
+        account (AccountDB): The player, or None.
+
+    """
+    previous = getattr(_local, "actor", None)
+    _local.actor = account.id if account else None
+    try:
+        yield
+    finally:
+        _local.actor = previous
+
+
+def command_actor(func):
+    """
+    Decorates a command's func(), making its queries on behalf of the command's account.
+
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with acting_as(self.account):
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+def request_actor(view):
+    """
+    Decorates a view, making its queries on behalf of the logged in player, if any.
+
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with acting_as(request.user if request.user.is_authenticated else None):
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def is_replica(alias):
+    """
+    Returns whether a database alias is the read replica.
+
+    """
+    return bool(READ_DATABASE) and alias == READ_DATABASE
+
+
+def uncached_from_db(cls, db, field_names, values):
+    """
+    Builds a model instance from a row read from the replica, as Model.from_db does, but without
+    adding it to the idmapper cache.  If the cache already holds the object, that's used instead.
+
+    """
+    if len(values) != len(cls._meta.concrete_fields):
+        values_iter = iter(values)
+        values = [next(values_iter) if f.attname in field_names else DEFERRED for f in cls._meta.concrete_fields]
+
+    cached = cls.get_cached_instance(values[cls._meta.concrete_fields.index(cls._meta.pk)])
+    if cached is not None:
+        return cached
+
+    # type.__call__ skips the idmapper's metaclass, which is what caches new instances.
+    instance = type.__call__(cls, *values)
+    instance._state.adding = False
+    instance._state.db = db
+    return instance
+
+
+def _routed(model):
+    from .models import Post, BoardDB
+
+    return model._meta.concrete_model in (Post, BoardDB)
+
+
+class ReplicaRouter(object):
+    """
+    Sends reads of posts and boards to PAXBOARDS_READ_DATABASE, except for players who've
+    written in the last PAXBOARDS_STICKY_SECONDS; see the module docstring.  Other models are
+    left to the other routers, or the default database.
+
+    """
+
+    def db_for_read(self, model, **hints):
+        if not READ_DATABASE or not _routed(model):
+            return None
+
+        actor = getattr(_local, "actor", None)
+        if actor is None or connections[WRITE_DATABASE].in_atomic_block:
+            return WRITE_DATABASE
+
+        last = _last_write.get(actor)
+        if last is not None and time.monotonic() - last < STICKY_SECONDS:
+            return WRITE_DATABASE
+
+        return READ_DATABASE
+
+    def db_for_write(self, model, **hints):
+        if not READ_DATABASE or model._meta.app_label != "paxboards":
+            return None
+
+        now = time.monotonic()
+        if len(_last_write) > 1000:
+            for actor, last in list(_last_write.items()):
+                if now - last >= STICKY_SECONDS:
+                    _last_write.pop(actor, None)
+
+        _last_write[getattr(_local, "actor", None)] = now
+        return WRITE_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary, so objects read from either can be
+        # related to each other.
+        if READ_DATABASE and set([obj1._state.db, obj2._state.db]) <= set([READ_DATABASE, WRITE_DATABASE]):
+            return True
+
+        return None
@@ -0,0 +1,153 @@
+"""
+Background maintenance for Paxboards.
+
+BoardExpiryScript periodically clears expired posts off every board with an expiry limit.  What
+happens to them is set by PAXBOARDS_EXPIRY_POLICY in your settings file:
+
+    PAXBOARDS_EXPIRY_POLICY = "archive"     # copy them to the ArchivedPost table (the default)
+    PAXBOARDS_EXPIRY_POLICY = "delete"      # just delete them
+
+Pinned posts are never touched, and nor are posts which still have replies on the board.  Start
+the script with `bbadmin/expire`, which also shows what its last run did.
+
+DigestScript sends out the hourly digests of new posts (see paxboards.notify).  It's started the
+first time anyone sets a subscription to `bboard/sub <board>=hourly`.
+
+"""
+import time
+
+from django.conf import settings
+from django.db.models import Q
+from evennia.utils import delay, logger
+from typeclasses.scripts import Script
+
+from .boards import DefaultBoard
+from .models import Post
+from .notify import flush_digests
+
+
+class BoardExpiryScript(Script):
+    """
+    Expires old posts off the boards.  Each run works through the boards one batch of posts at a
+    time, handing control back to the server between batches, so a large backlog never holds
+    anything else up for long.
+
+    The counts for the most recent run are kept in self.db.last_run, and the running totals in
+    self.db.totals.
+
+    """
+
+    def at_script_creation(self):
+        self.key = "paxboards_expiry"
+        self.desc = "Expires old posts off the boards"
+        self.interval = getattr(settings, "PAXBOARDS_EXPIRY_INTERVAL", 3600)
+        self.persistent = True
+
+        self.db.batch_size = 500
+        self.db.last_run = None
+        self.db.totals = {"posts": 0, "readers": 0}
+
+    def at_repeat(self):
+        if self.ndb.run:
+            # The last run is still working through its batches.
+            return
+
+        self.ndb.run = {"started": time.time(), "boards": 0, "posts": 0, "readers": 0,
+                        "policy": getattr(settings, "PAXBOARDS_EXPIRY_POLICY", "archive")}
+
+        try:
+            board_ids = list(DefaultBoard.objects.filter(Q(db_expiry_maxposts__isnull=False) |
+                                                         Q(db_expiry_duration__isnull=False))
+                             .order_by('id').values_list('id', flat=True))
+            self.expire_batch(board_ids)
+        except Exception:
+            # A run left marked as in progress would stop every later one from starting.
+            self.ndb.run = None
+            raise
+
+    def expire_batch(self, board_ids):
+        """
+        Expires one batch of posts from the first of the given boards, then schedules the next
+        batch, moving on to the next board once the first has nothing left to expire.
+
+        Args:
+            board_ids (list): The ids of the boards still to be done.
+
+        """
+        run = self.ndb.run
+        try:
+            if not board_ids:
+                self.finish_run()
+                return
+
+            board = DefaultBoard.objects.filter(pk=board_ids[0]).first()
+            batch_size = self.db.batch_size or 500
+            posts = 0
+
+            if board:
+                try:
+                    posts, readers = Post.objects.expire(board, limit=batch_size,
+                                                         archive=run["policy"] != "delete")
+                except Exception:
+                    logger.log_trace("Paxboards: unable to expire posts on board %s." % board.id)
+                    posts, readers = 0, 0
+
+                run["posts"] += posts
+                run["readers"] += readers
+
+            if posts < batch_size:
+                run["boards"] += 1
+                board_ids = board_ids[1:]
+
+            delay(0, self.expire_batch, board_ids)
+        except Exception:
+            # As in at_repeat: end the run, so the next one can start.
+            self.ndb.run = None
+            raise
+
+    def finish_run(self):
+        """
+        Records the counts for the run just finished.
+
+        """
+        run = self.ndb.run
+        run["seconds"] = round(time.time() - run["started"], 2)
+
+        totals = self.db.totals or {"posts": 0, "readers": 0}
+        totals["posts"] += run["posts"]
+        totals["readers"] += run["readers"]
+
+        self.db.last_run = run
+        self.db.totals = totals
+        self.ndb.run = None
+
+        if run["posts"]:
+            logger.log_info("Paxboards: expired %i posts (%i reader rows, policy %s) from %i boards in %.2fs." %
+                            (run["posts"], run["readers"], run["policy"], run["boards"], run["seconds"]))
+
+
+class DigestScript(Script):
+    """
+    Sends out the waiting hourly digests to every connected player who takes one, in one pass.
+    Players who aren't connected get theirs when they next log in instead.
+
+    The number of players messaged by the most recent run is kept in self.db.last_run.
+
+    """
+
+    def at_script_creation(self):
+        self.key = "paxboards_digest"
+        self.desc = "Sends out hourly digests of new posts"
+        self.interval = getattr(settings, "PAXBOARDS_DIGEST_INTERVAL", 3600)
+        self.persistent = True
+
+        self.db.last_run = None
+
+    def at_repeat(self):
+        from evennia import SESSION_HANDLER
+
+        connected = [a.id for a in SESSION_HANDLER.all_connected_accounts()]
+        try:
+            self.db.last_run = flush_digests("hourly", accounts=connected) if connected else 0
+        except Exception:
+            logger.log_trace("Paxboards: unable to send digests.")
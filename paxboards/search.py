@@ -0,0 +1,290 @@
+"""
+Full-text search for Paxboards.
+
+Posts are indexed by subject, poster name and text.  By default the backend is chosen to suit the
+configured database: an FTS5 table on SQLite, a tsvector table on PostgreSQL, and plain substring
+matching (with no index) anywhere else.  To pick one explicitly, set PAXBOARDS_SEARCH_BACKEND in
+your settings file to the python path of a SearchBackend class, e.g.
+
+    PAXBOARDS_SEARCH_BACKEND = "paxboards.search.SearchBackend"
+
+The index tables are created whenever `evennia migrate` is run, or failing that on first use.
+Posts made before the index existed can be added with `bbadmin/reindex`.
+
+The index is written through the database posts are written to, and searched as part of the post
+query itself, so with a read replica (see paxboards.routers) searches are run against the replica
+along with the rest of the post reads.  Running `evennia migrate --database <alias>` on a
+database creates its index tables too.
+
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, router, DatabaseError
+from django.db.models import Q
+from django.utils.module_loading import import_string
+from evennia.utils import logger
+
+_BACKEND = None
+
+# How many results to show at once, in-game and on the web.
+SEARCH_PAGE_SIZE = getattr(settings, "PAXBOARDS_SEARCH_PAGE_SIZE", 20)
+
+
+def _connection(using=None):
+    """
+    Returns the connection to the given database, or to the one posts are written to.
+
+    """
+    from paxboards.models import Post
+
+    return connections[using or router.db_for_write(Post)]
+
+
+class SearchBackend(object):
+    """
+    The fallback backend, which just does substring matching on the posts themselves.  It keeps no
+    index, so there's nothing to keep in sync.
+
+    """
+
+    def setup(self, using=None):
+        """
+        Creates whatever tables the backend needs, if they don't already exist.
+
+        Args:
+            using (str): The database to create them in; by default, the one posts are written to.
+
+        """
+        pass
+
+    def index(self, posts):
+        """
+        Adds the given posts to the index, replacing any earlier entries for them.
+
+        Args:
+            posts (list): The Post objects to index.
+
+        """
+        pass
+
+    def remove(self, post_ids):
+        """
+        Removes the given posts from the index.
+
+        Args:
+            post_ids (list): The ids of the posts to remove.
+
+        """
+        pass
+
+    def search(self, queryset, searchstring):
+        """
+        Narrows a queryset of posts down to those matching the search string, best matches first.
+
+        Args:
+            queryset (QuerySet): The posts to search within.
+            searchstring (str): What to search for.
+
+        Returns:
+            A queryset of Post objects.
+
+        """
+        return queryset.filter(Q(db_text__icontains=searchstring) | Q(db_subject__icontains=searchstring) |
+                               Q(db_poster_name__icontains=searchstring)).order_by('db_date_created')
+
+
+class SqliteSearchBackend(SearchBackend):
+    """
+    Indexes posts in an SQLite FTS5 virtual table, keyed by post id, and ranks matches with bm25.
+    Subject matches count for more than poster matches, which count for more than text matches.
+
+    """
+    table = "paxboards_post_fts"
+
+    def setup(self, using=None):
+        with _connection(using).cursor() as cursor:
+            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS " + self.table +
+                           " USING fts5(subject, poster, text)")
+
+    def index(self, posts):
+        rows = [(p.id, p.db_subject, p.db_poster_name, p.db_text or "") for p in posts]
+        if not rows:
+            return
+
+        with _connection().cursor() as cursor:
+            cursor.executemany("DELETE FROM " + self.table + " WHERE rowid = %s", [(r[0],) for r in rows])
+            cursor.executemany("INSERT INTO " + self.table + " (rowid, subject, poster, text) "
+                               "VALUES (%s, %s, %s, %s)", rows)
+
+    def remove(self, post_ids):
+        if not post_ids:
+            return
+
+        with _connection().cursor() as cursor:
+            cursor.executemany("DELETE FROM " + self.table + " WHERE rowid = %s", [(i,) for i in post_ids])
+
+    def search(self, queryset, searchstring):
+        # Quote each word so FTS5 never sees operators or stray punctuation, and match prefixes
+        # so partial words still turn something up.
+        words = re.findall(r"\w+", searchstring, re.UNICODE)
+        if not words:
+            return queryset.none()
+
+        match = " ".join('"' + w + '"*' for w in words)
+        post_table = queryset.model._meta.db_table
+
+        return queryset.extra(tables=[self.table],
+                              where=[self.table + ".rowid = " + post_table + ".id", self.table + " MATCH %s"],
+                              params=[match],
+                              select={"search_rank": "bm25(" + self.table + ", 10.0, 5.0, 1.0)"},
+                              order_by=["search_rank"])
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Indexes posts in a tsvector table with a GIN index, and ranks matches with ts_rank.  The
+    text search configuration can be set with PAXBOARDS_SEARCH_CONFIG (default 'english').
+
+    """
+    table = "paxboards_post_search"
+
+    def __init__(self):
+        self.config = getattr(settings, "PAXBOARDS_SEARCH_CONFIG", "english")
+
+    def setup(self, using=None):
+        with _connection(using).cursor() as cursor:
+            cursor.execute("CREATE TABLE IF NOT EXISTS " + self.table + " ("
+                           "post_id integer PRIMARY KEY REFERENCES paxboards_post (id) ON DELETE CASCADE, "
+                           "document tsvector NOT NULL)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS " + self.table + "_document ON " + self.table +
+                           " USING GIN (document)")
+
+    def index(self, posts):
+        rows = [(p.id, self.config, p.db_subject, self.config, p.db_poster_name, self.config, p.db_text or "")
+                for p in posts]
+        if not rows:
+            return
+
+        with _connection().cursor() as cursor:
+            cursor.executemany("INSERT INTO " + self.table + " (post_id, document) VALUES (%s, "
+                               "setweight(to_tsvector(%s, %s), 'A') || "
+                               "setweight(to_tsvector(%s, %s), 'B') || "
+                               "setweight(to_tsvector(%s, %s), 'D')) "
+                               "ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document", rows)
+
+    def remove(self, post_ids):
+        if not post_ids:
+            return
+
+        with _connection().cursor() as cursor:
+            cursor.execute("DELETE FROM " + self.table + " WHERE post_id = ANY(%s)", [list(post_ids)])
+
+    def search(self, queryset, searchstring):
+        post_table = queryset.model._meta.db_table
+
+        return queryset.extra(tables=[self.table],
+                              where=[self.table + ".post_id = " + post_table + ".id",
+                                     self.table + ".document @@ plainto_tsquery(%s, %s)"],
+                              params=[self.config, searchstring],
+                              select={"search_rank": "ts_rank(" + self.table + ".document, "
+                                                     "plainto_tsquery(%s, %s))"},
+                              select_params=[self.config, searchstring],
+                              order_by=["-search_rank"])
+
+
+def get_backend():
+    """
+    Returns the search backend in use, setting it up on first call.
+
+    Returns:
+        A SearchBackend object.
+
+    """
+    global _BACKEND
+    if _BACKEND:
+        return _BACKEND
+
+    path = getattr(settings, "PAXBOARDS_SEARCH_BACKEND", None)
+    vendor = _connection().vendor
+    if path:
+        backend = import_string(path)()
+    elif vendor == "sqlite":
+        backend = SqliteSearchBackend()
+    elif vendor == "postgresql":
+        backend = PostgresSearchBackend()
+    else:
+        backend = SearchBackend()
+
+    try:
+        backend.setup()
+    except DatabaseError:
+        # Most likely an SQLite built without FTS5.
+        logger.log_trace("Paxboards: unable to set up %s, falling back to basic search." %
+                         backend.__class__.__name__)
+        backend = SearchBackend()
+
+    _BACKEND = backend
+    return _BACKEND
+
+
+def index_posts(posts):
+    """
+    Adds or updates the given posts in the search index.
+
+    Args:
+        posts (list): The Post objects to index.
+
+    """
+    get_backend().index(posts)
+
+
+def remove_posts(post_ids):
+    """
+    Removes the given posts from the search index.
+
+    Args:
+        post_ids (list): The ids of the posts to remove.
+
+    """
+    get_backend().remove(post_ids)
+
+
+def search_posts(queryset, searchstring):
+    """
+    Narrows a queryset of posts down to those matching the search string, best matches first.
+    The result is an ordinary queryset, so it can be sliced or handed to a Paginator.
+
+    Args:
+        queryset (QuerySet): The posts to search within.
+        searchstring (str): What to search for.
+
+    Returns:
+        A queryset of Post objects.
+
+    """
+    return get_backend().search(queryset.order_by(), searchstring)
+
+
+def rebuild_index(after=0, batch_size=500):
+    """
+    Indexes one batch of existing posts, in id order.  Call it repeatedly, passing back the
+    returned id, until it returns None.
+
+    Args:
+        after (int): Only index posts with an id greater than this.
+        batch_size (int): The most posts to index at once.
+
+    Returns:
+        A tuple of (count, last_id), where count is how many posts were indexed and last_id is the
+        id to continue from, or None if there are no posts left.
+
+    """
+    from paxboards.models import Post
+
+    posts = list(Post.objects.filter(pk__gt=after).order_by('id')[:batch_size])
+    if not posts:
+        return 0, None
+
+    get_backend().index(posts)
+    return len(posts), posts[-1].id
@@ -1,3 +1,677 @@
-from django.test import TestCase
+"""
+Query-budget tests for Paxboards.
 
-# Create your tests here.
+Each bboard switch and web view is run against a set of boards, posts and replies, and the number
+of database queries it makes is checked against a fixed budget.  The fixture is then grown (more
+boards, and more posts on every board) and each case is run again, and must not make any more
+queries than it did the first time: a path which queries per post or per board fails here, with
+the SQL it ran printed so the culprit is easy to spot.  The plans of the main queries are also
+checked for full table scans (see paxboards.indexes).
+
+The read-replica router is tested against a second SQLite database standing in for the replica,
+which (unlike a real one) never catches up, so it's easy to tell which database a read went to.
+
+"""
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management import call_command
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.db.models import Exists, OuterRef
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from evennia.commands.default.tests import CommandTest
+from evennia.utils import create
+
+from .access import access_key, clear_access_cache
+from .boards import DefaultBoard
+from .cache import RENDER_CACHE
+from .commands import BoardCmd, BoardAdminCmd
+from .indexes import SCANS, check_queries, explain, find_scans
+from .models import Post, ArchivedPost, BoardDB, BoardReadMark, PostReadMark
+from .readstate import get_read_state
+from .scripts import BoardExpiryScript
+from . import routers
+from . import api, views
+
+
+class QueryBudgetTest(CommandTest):
+
+    # How many boards to start with, and how many threads (each with two replies) on each.
+    boards = 3
+    threads = 4
+
+    def setUp(self):
+        super(QueryBudgetTest, self).setUp()
+        self.board_list = []
+        self.grow(self.boards, self.threads)
+
+    def grow(self, boards, threads):
+        """
+        Adds boards, and threads to every board (and replies to the first thread on each),
+        leaving about half of the new posts unread.
+
+        Args:
+            boards (int): How many boards to add.
+            threads (int): How many threads to add to each board, old and new.
+
+        """
+        for b in range(boards):
+            board = DefaultBoard(db_key="Budget%i" % (len(self.board_list) + 1))
+            board.save()
+            board.locks.add("read:all();post:all();pin:all();edit:all();delete:all()")
+            board.set_subscribed(self.account, True)
+            self.board_list.append(board)
+
+        read = []
+        for board in self.board_list:
+            for t in range(threads):
+                root = board.create_post("Thread %i" % t, "The dragon came to market.", author_name="Poster")
+                reply = board.create_post("Re: Thread %i" % t, "The dragon left.", author_name="Poster", parent=root)
+                board.create_post("Re: Thread %i" % t, "The dragon is back.", author_name="Poster", parent=reply)
+                if t % 2:
+                    read.extend([root, reply])
+
+            # The first thread on each board gets longer too, so reading it costs more if that
+            # grows per reply.
+            first = Post.objects.filter(db_board=board, db_parent__isnull=True).order_by('id').first()
+            for t in range(threads):
+                board.create_post("Re: " + first.db_subject, "Another dragon.", author_name="Poster", parent=first)
+
+        get_read_state().mark_read(read, self.account)
+
+    def count_queries(self, func):
+        """
+        Runs a function with the caches emptied, returning the number of queries it made and the
+        SQL of each.
+
+        """
+        RENDER_CACHE.clear()
+        clear_access_cache()
+
+        with CaptureQueriesContext(connection) as context:
+            func()
+
+        return len(context), [q['sql'] for q in context.captured_queries]
+
+    def assertQueryBudget(self, budget, func):
+        """
+        Checks that a function makes no more than a given number of queries, both against the
+        starting fixture and against a larger one, and no more against the larger one.
+
+        Args:
+            budget (int): The most queries allowed.
+            func (callable): The function to run.  It's called once at each size, so it should
+                look up anything it needs (e.g. post numbers) afresh each time.
+
+        """
+        small, small_sql = self.count_queries(func)
+        self.grow(self.boards * 2, self.threads * 2)
+        large, large_sql = self.count_queries(func)
+
+        for label, count, sql in (("small", small, small_sql), ("large", large, large_sql)):
+            if count > budget:
+                self.fail("%i queries against the %s fixture, over the budget of %i:\n%s"
+                          % (count, label, budget, "\n".join(sql)))
+
+        if large > small:
+            self.fail("Queries grew from %i to %i with the fixture:\n%s"
+                      % (small, large, "\n".join(large_sql)))
+
+    def bboard(self, args):
+        return lambda: self.call(BoardCmd(), args, caller=self.account)
+
+    def bbadmin(self, args):
+        return lambda: self.call(BoardAdminCmd(), args, caller=self.account)
+
+    def request(self, data=None):
+        request = RequestFactory().get("/boards/", data)
+        request.user = self.account
+        request.session = SessionStore()
+        return request
+
+    def get(self, view, **kwargs):
+        def run():
+            self.assertEqual(view(self.request(), **kwargs).status_code, 200)
+
+        return run
+
+    def test_list(self):
+        self.assertQueryBudget(10, self.bboard(""))
+
+    def test_read_board(self):
+        self.assertQueryBudget(6, self.bboard("Budget1"))
+
+    def test_read_post(self):
+        self.assertQueryBudget(13, self.bboard("Budget1/3"))
+
+    def test_thread(self):
+        self.assertQueryBudget(14, self.bboard("/thread Budget1/3"))
+
+    def test_scan(self):
+        self.assertQueryBudget(10, self.bboard("/scan"))
+
+    def test_new(self):
+        self.assertQueryBudget(14, self.bboard("/new"))
+
+    def test_new_board(self):
+        self.assertQueryBudget(13, self.bboard("/new Budget1"))
+
+    def test_catchup_board(self):
+        self.assertQueryBudget(9, self.bboard("/catchup Budget1"))
+
+    def test_catchup_all(self):
+        self.assertQueryBudget(9, self.bboard("/catchup all"))
+
+    def test_post(self):
+        self.assertQueryBudget(15, self.bboard("/post Budget1/Budget=A new post."))
+
+    def test_reply(self):
+        self.assertQueryBudget(23, self.bboard("/reply Budget1/3=A new reply."))
+
+    def test_search(self):
+        self.assertQueryBudget(12, self.bboard("/search dragon"))
+
+    def test_edit(self):
+        self.assertQueryBudget(11, self.bboard("/edit Budget1/3=Changed."))
+
+    def test_delete(self):
+        self.assertQueryBudget(28, self.bboard("/delete Budget1/3"))
+
+    def test_pin(self):
+        self.assertQueryBudget(9, self.bboard("/pin Budget1/3"))
+
+    def test_admin_delete(self):
+        self.assertQueryBudget(29, self.bbadmin("/delete Budget1/2-8"))
+
+    def test_admin_move(self):
+        self.assertQueryBudget(27, self.bbadmin("/move Budget1/2-8=Budget2"))
+
+    def test_admin_purge(self):
+        self.assertQueryBudget(18, self.bbadmin("/purge Budget1=Poster"))
+
+    def test_web_boardlist(self):
+        self.assertQueryBudget(8, self.get(views.show_boardlist))
+
+    def test_web_board(self):
+        self.assertQueryBudget(3, self.get(views.show_board, board_id=self.board_list[0].id))
+
+    def test_web_thread(self):
+        self.assertQueryBudget(8, lambda: self.get(views.show_thread, board_id=self.board_list[0].id,
+                                                    post_id=self.board_list[0].posts()[0].id)())
+
+    def test_web_search(self):
+        def run():
+            self.assertEqual(views.search_posts(self.request({"q": "dragon"})).status_code, 200)
+
+        self.assertQueryBudget(7, run)
+
+    def test_api(self):
+        board = self.board_list[0]
+        self.assertQueryBudget(9, self.get(api.api_boards))
+        self.assertQueryBudget(5, self.get(api.api_board, board_id=board.id))
+        self.assertQueryBudget(10, lambda: self.get(api.api_thread, board_id=board.id, post_id=board.posts()[0].id)())
+
+    def test_plans(self):
+        for name, plan, scans in check_queries(self.board_list[0], self.account):
+            self.assertFalse(scans, "The %s query scans %s:\n%s" % (name, ", ".join(scans), plan))
+
+
+class ExplainTest(CommandTest):
+    """
+    Full scans of Paxboards tables are reported, whether or not the plan names them by an alias.
+
+    """
+
+    def setUp(self):
+        super(ExplainTest, self).setUp()
+        if connection.vendor not in SCANS:
+            self.skipTest("Plans from %s aren't understood." % connection.vendor)
+
+    def assertScans(self, queryset, tables):
+        self.assertEqual(find_scans(explain(queryset), str(queryset.query)), tables)
+
+    def test_unindexed(self):
+        self.assertScans(Post.objects.filter(db_subject="Dragons"), ["paxboards_post"])
+
+    def test_unindexed_subquery(self):
+        # Only the subquery, where the table has an alias, scans.
+        same_subject = Post.objects.filter(db_subject=OuterRef('db_subject')).exclude(pk=OuterRef('pk'))
+        self.assertScans(Post.objects.filter(pk=1).filter(Exists(same_subject)), ["paxboards_post"])
+
+    def test_indexed(self):
+        self.assertScans(Post.objects.filter(pk=1), [])
+
+
+class SequenceTest(CommandTest):
+    """
+    Post numbers are worked out arithmetically from each board's sequence (see
+    PostQuerySet.sequence_window), so these check that the numbers shown, post_number and
+    by_board_number all agree however pinning, expiry and deletion combine.
+
+    """
+
+    def setUp(self):
+        super(SequenceTest, self).setUp()
+        self.board = DefaultBoard(db_key="Numbers")
+        self.board.save()
+        self.queryset = Post.objects.get_queryset()
+        self.posts = [self.board.create_post("Post %i" % i, "Text.", author_name="Poster") for i in range(12)]
+
+    def age(self, posts, days):
+        # Oldest first, so posting order and date order still agree.
+        for minutes, post in enumerate(reversed(posts)):
+            post.db_date_created = timezone.now() - timedelta(days=days, minutes=minutes)
+            Post.objects.filter(pk=post.pk).update(db_date_created=post.db_date_created)
+
+    def pin(self, *posts):
+        for post in posts:
+            post.db_pinned = True
+            post.save()
+
+    def assertNumbering(self, expected):
+        shown = list(self.board.posts())
+        self.assertEqual([p.id for p in shown], [p.id for p in expected])
+
+        for number, post in enumerate(shown, start=1):
+            self.assertEqual(self.queryset.post_number(post), number)
+            self.assertEqual(self.queryset.by_board_number(self.board, number), post)
+        self.assertIsNone(self.queryset.by_board_number(self.board, len(shown) + 1))
+        self.assertEqual(list(self.queryset.by_board_range(self.board, 1, len(shown)).order_by('-db_pinned', 'id')),
+                         shown)
+
+        seqs = sorted(Post.objects.filter(db_board=self.board).values_list('db_seq', flat=True))
+        self.assertEqual(seqs, list(range(1, len(seqs) + 1)))
+
+    def test_plain(self):
+        self.assertNumbering(self.posts)
+
+    def test_pinned(self):
+        self.pin(self.posts[5], self.posts[9])
+        self.assertNumbering([self.posts[5], self.posts[9]] + self.posts[:5] + self.posts[6:9] + self.posts[10:])
+
+    def test_max_posts(self):
+        self.pin(self.posts[1], self.posts[10])
+        self.board.db_expiry_maxposts = 5
+        self.board.save()
+        self.assertNumbering([self.posts[1], self.posts[10]] + self.posts[8:10] + self.posts[11:])
+
+    def test_max_days(self):
+        self.age(self.posts[:4], 10)
+        self.pin(self.posts[1])
+        self.board.db_expiry_duration = 5
+        self.board.save()
+        self.assertNumbering([self.posts[1]] + self.posts[4:])
+
+        # Whichever limit is tighter wins.
+        self.board.db_expiry_maxposts = 6
+        self.board.save()
+        self.assertNumbering([self.posts[1]] + self.posts[-5:])
+
+        self.board.db_expiry_maxposts = 20
+        self.board.save()
+        self.assertNumbering([self.posts[1]] + self.posts[4:])
+
+    def test_delete(self):
+        reply = self.board.create_post("Re: Post 2", "A zebra.", author_name="Poster", parent=self.posts[2])
+        self.pin(self.posts[6])
+        self.board.db_expiry_maxposts = 8
+        self.board.save()
+
+        # Deleting a post takes its replies with it, and closes up the numbers of both.
+        self.posts[2].delete()
+        self.assertFalse(Post.objects.filter(pk=reply.id).exists())
+        self.assertEqual(list(Post.objects.search("zebra")), [])
+        self.assertNumbering([self.posts[6]] + self.posts[4:6] + self.posts[7:])
+
+        Post.objects.delete_posts(Post.objects.filter(pk__in=[self.posts[8].id, self.posts[10].id]))
+        self.assertNumbering([self.posts[6], self.posts[1]] + self.posts[3:6] + self.posts[7:8] +
+                             self.posts[9:10] + self.posts[11:])
+
+        # A full renumber changes nothing once the numbers are dense.
+        self.queryset.renumber(self.board)
+        self.assertNumbering([self.posts[6], self.posts[1]] + self.posts[3:6] + self.posts[7:8] +
+                             self.posts[9:10] + self.posts[11:])
+
+
+class ThreadSummaryTest(CommandTest):
+    """
+    A thread's summary counts replies to replies as well as replies to its first post, whether
+    it was bumped as the replies came in or recounted.
+
+    """
+
+    def setUp(self):
+        super(ThreadSummaryTest, self).setUp()
+        self.board = DefaultBoard(db_key="Threads")
+        self.board.save()
+        self.thread = self.board.create_post("Thread", "Text.", author_name="Poster")
+        reply = self.board.create_post("Re: Thread", "Text.", author_name="Replier", parent=self.thread)
+        nested = self.board.create_post("Re: Re: Thread", "Text.", author_name="Nested", parent=reply)
+        self.last = self.board.create_post("Re: Re: Re: Thread", "Text.", author_name="Deepest", parent=nested)
+        self.board.create_post("Other", "Text.", author_name="Poster")
+
+    def assertSummary(self, thread):
+        self.assertEqual(thread.db_total_posts, 4)
+        self.assertEqual(thread.db_last_post_id, self.last.id)
+        self.assertEqual(thread.db_last_poster, "Deepest")
+
+    def test_bumped(self):
+        self.assertSummary(Post.objects.get(pk=self.thread.id))
+
+    def test_recounted(self):
+        self.thread.update_thread_summary()
+        self.assertSummary(Post.objects.get(pk=self.thread.id))
+
+    def test_recounted_together(self):
+        Post.objects.update_thread_summaries([self.thread.id])
+        self.assertSummary(Post.objects.get(pk=self.thread.id))
+
+    def test_delete_nested(self):
+        self.last.delete()
+        thread = Post.objects.get(pk=self.thread.id)
+        self.assertEqual(thread.db_total_posts, 3)
+        self.assertEqual(thread.db_last_poster, "Nested")
+
+
+class AccessCacheTest(CommandTest):
+    """
+    Cached lock decisions are only reused while nothing they could depend on has changed.
+
+    """
+
+    def setUp(self):
+        super(AccessCacheTest, self).setUp()
+        self.board = DefaultBoard(db_key="Staff")
+        self.board.save()
+        self.board.locks.add("read:perm(Admin)")
+
+    def test_key(self):
+        key = access_key(self.board, self.account2, "read", False)
+        self.assertEqual(access_key(self.board, self.account2, "read", False), key)
+
+        self.account2.permissions.add("Admin")
+        self.assertNotEqual(access_key(self.board, self.account2, "read", False), key)
+
+    def test_quelled(self):
+        key = access_key(self.board, self.account, "read", False)
+        self.account.attributes.add("_quell", True)
+        self.assertNotEqual(access_key(self.board, self.account, "read", False), key)
+
+        self.account.attributes.remove("_quell")
+        self.assertEqual(access_key(self.board, self.account, "read", False), key)
+
+    def test_uncached(self):
+        self.board.locks.add("read:attr(foo)")
+        self.assertIsNone(access_key(self.board, self.account, "read", False))
+
+
+class ReadStateTest(CommandTest):
+    """
+    Both ways of keeping read state agree on who has read what, through moves and bulk reads.
+
+    """
+
+    def setUp(self):
+        super(ReadStateTest, self).setUp()
+        self.old = DefaultBoard(db_key="Old")
+        self.old.save()
+        self.new = DefaultBoard(db_key="New")
+        self.new.save()
+        self.old_posts = [self.old.create_post("Old %i" % i, "Text.", author_name="Poster") for i in range(3)]
+        self.new_posts = [self.new.create_post("New %i" % i, "Text.", author_name="Poster") for i in range(4)]
+
+    def check_move(self):
+        read_state = get_read_state()
+        read_state.mark_boards_read([self.new], self.account)
+        read_state.mark_read([self.old_posts[0]], self.account2)
+
+        posts = Post.objects.filter(pk__in=[p.id for p in self.old_posts[:2]])
+        before = read_state.readers(posts)
+        Post.objects.move_posts(posts, self.new)
+        self.assertEqual(read_state.readers(posts), before)
+        self.assertEqual(before[self.old_posts[0].id], {self.account2.id})
+        self.assertEqual(before[self.old_posts[1].id], set())
+
+    def test_move(self):
+        self.check_move()
+
+    @override_settings(PAXBOARDS_READ_STATE="watermark")
+    def test_move_watermark(self):
+        self.check_move()
+
+    def check_add_reads(self):
+        read_state = get_read_state()
+        reads = [(p.id, self.account.id) for p in self.old_posts + self.new_posts] + \
+                [(p.id, self.account2.id) for p in self.new_posts[:1] + self.new_posts[2:]]
+        read_state.add_reads(reads)
+
+        readers = read_state.readers(Post.objects.all())
+        self.assertEqual(set((post_id, account_id) for post_id, account_ids in readers.items()
+                             for account_id in account_ids), set(reads))
+
+    def test_add_reads(self):
+        self.check_add_reads()
+
+    @override_settings(PAXBOARDS_READ_STATE="watermark")
+    def test_add_reads_watermark(self):
+        self.check_add_reads()
+
+        # Read in order, the reads end up as watermarks; only the one read past a gap stays.
+        marks = dict(((board_id, account_id), read_through) for board_id, account_id, read_through in
+                     BoardReadMark.objects.values_list('db_board', 'db_account', 'db_read_through'))
+        self.assertEqual(marks[self.old.id, self.account.id], self.old_posts[-1].id)
+        self.assertEqual(marks[self.new.id, self.account.id], self.new_posts[-1].id)
+        self.assertEqual(marks[self.new.id, self.account2.id], self.new_posts[0].id)
+        self.assertEqual(list(PostReadMark.objects.values_list('db_post', 'db_account').order_by('db_post')),
+                         [(self.new_posts[2].id, self.account2.id), (self.new_posts[3].id, self.account2.id)])
+
+
+class ApiAccessTest(CommandTest):
+    """
+    The JSON API only shows boards which a player's read lock lets them read, and counts their
+    posts as bboard does.
+
+    """
+
+    def setUp(self):
+        super(ApiAccessTest, self).setUp()
+        clear_access_cache()
+        self.open = DefaultBoard(db_key="Open")
+        self.open.save()
+        self.open.locks.add("read:all()")
+        self.unlocked = DefaultBoard(db_key="Unlocked")
+        self.unlocked.save()
+
+    def get(self, view, **kwargs):
+        request = RequestFactory().get("/boards/api/")
+        request.user = self.account2
+        request.session = SessionStore()
+        return view(request, **kwargs)
+
+    def test_boards(self):
+        boards = json.loads(self.get(api.api_boards).content.decode())["boards"]
+        self.assertEqual([b["id"] for b in boards], [self.open.id])
+
+    def test_counts(self):
+        self.open.db_expiry_maxposts = 2
+        self.open.save()
+        for i in range(3):
+            self.open.create_post("Post %i" % i, "Text.", author_name="Poster")
+
+        board = json.loads(self.get(api.api_boards).content.decode())["boards"][0]
+        self.assertEqual(board["total_posts"], 2)
+        self.assertEqual(board["total_posts"], DefaultBoard.objects.annotate_counts([self.open])[0].total_count)
+
+    def test_board(self):
+        self.assertEqual(self.get(api.api_board, board_id=self.open.id).status_code, 200)
+        self.assertNotEqual(self.get(api.api_board, board_id=self.unlocked.id).status_code, 200)
+
+
+class ExpiryTest(CommandTest):
+    """
+    Expiry drops the cached renderings of what it removes, and the expiry script doesn't wedge
+    itself if a run fails.
+
+    """
+
+    def setUp(self):
+        super(ExpiryTest, self).setUp()
+        RENDER_CACHE.clear()
+        self.board = DefaultBoard(db_key="Expiring", db_expiry_maxposts=4)
+        self.board.save()
+        self.thread = self.board.create_post("Thread", "Text.", author_name="Poster")
+        self.reply = self.board.create_post("Re: Thread", "Text.", author_name="Poster", parent=self.thread)
+        for i in range(6):
+            self.board.create_post("Post %i" % i, "Text.", author_name="Poster")
+
+    def test_renderings_dropped(self):
+        self.thread.display_post(self.account, show_replies=True)
+        self.reply.display_post(self.account)
+        self.assertTrue(RENDER_CACHE.entries)
+
+        # The thread has a reply, so only the reply goes.
+        self.assertEqual(Post.objects.expire(self.board, limit=1)[0], 1)
+        self.assertFalse([key for key in RENDER_CACHE.entries if key[0] in (self.thread.id, self.reply.id)])
+
+    def check_archived_readers(self):
+        get_read_state().mark_read(self.board.posts()[:1], self.account)
+        get_read_state().mark_read([self.reply], self.account)
+        get_read_state().mark_read([self.reply], self.account2)
+
+        reply_id = self.reply.id
+        self.assertEqual(Post.objects.expire(self.board, limit=1), (1, 2))
+        archived = ArchivedPost.objects.get(db_original_id=reply_id)
+        self.assertEqual(set(archived.db_readers.all()), {self.account, self.account2})
+
+    def test_archived_readers(self):
+        self.check_archived_readers()
+
+    @override_settings(PAXBOARDS_READ_STATE="watermark")
+    def test_archived_readers_watermark(self):
+        self.check_archived_readers()
+
+    def test_failed_run(self):
+        script = create.create_script(BoardExpiryScript, autostart=False)
+        with mock.patch.object(DefaultBoard.objects, "filter", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                script.at_repeat()
+        self.assertIsNone(script.ndb.run)
+
+
+REPLICA = "paxboards_replica"
+
+
+@override_settings(DATABASE_ROUTERS=["paxboards.routers.ReplicaRouter"])
+class ReplicaRouterTest(TransactionTestCase):
+
+    # The replica is only added once the class is set up, so it can't be named here.
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        handle, cls.replica_file = tempfile.mkstemp(suffix=".db3")
+        os.close(handle)
+        default = connections.databases[DEFAULT_DB_ALIAS]
+        connections.databases[REPLICA] = dict(default, ENGINE="django.db.backends.sqlite3", NAME=cls.replica_file,
+                                              OPTIONS={}, TEST=dict(default["TEST"], NAME=None, MIRROR=None))
+        call_command("migrate", database=REPLICA, run_syncdb=True, interactive=False, verbosity=0)
+        super(ReplicaRouterTest, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(ReplicaRouterTest, cls).tearDownClass()
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.databases[REPLICA]
+        os.remove(cls.replica_file)
+
+    def setUp(self):
+        patcher = mock.patch.multiple(routers, READ_DATABASE=REPLICA, STICKY_SECONDS=60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        routers._last_write.clear()
+
+        self.poster = create.create_account("ReplicaPoster", "poster@example.com", "testpassword-poster")
+        self.reader = create.create_account("ReplicaReader", "reader@example.com", "testpassword-reader")
+
+        # Made for no one in particular, so it's only on the primary.
+        self.board = DefaultBoard(db_key="Replicated")
+        self.board.save()
+
+    def visible(self):
+        return Post.objects.filter(db_board_id=self.board.id).count()
+
+    def replicate(self):
+        """
+        Copies the boards and posts on the primary to the replica, as they stand.
+
+        """
+        tables = [(model._meta.db_table, [f.column for f in model._meta.concrete_fields]) for model in (BoardDB, Post)]
+        with connections[REPLICA].cursor() as cursor:
+            for table, columns in reversed(tables):
+                cursor.execute("DELETE FROM %s" % table)
+
+        for table, columns in tables:
+            with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+                cursor.execute("SELECT %s FROM %s" % (", ".join(columns), table))
+                rows = cursor.fetchall()
+            with connections[REPLICA].cursor() as cursor:
+                cursor.executemany("INSERT INTO %s (%s) VALUES (%s)" % (table, ", ".join(columns),
+                                                                        ", ".join(["%s"] * len(columns))), rows)
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(Post.objects.all().db, DEFAULT_DB_ALIAS)
+
+        with routers.acting_as(self.reader):
+            self.assertEqual(Post.objects.all().db, REPLICA)
+            self.assertFalse(DefaultBoard.objects.filter(db_key="Replicated").exists())
+            self.assertEqual(list(Post.objects.search("dragon")), [])
+
+    def test_writer_sticks_to_primary(self):
+        with routers.acting_as(self.poster):
+            self.board.create_post("Dragons", "The dragon came to market.", author_name="Poster",
+                                   author_player=self.poster)
+            self.assertEqual(Post.objects.all().db, DEFAULT_DB_ALIAS)
+            self.assertEqual(self.visible(), 1)
+            self.assertEqual(len(Post.objects.search("dragon")), 1)
+
+        with mock.patch.object(routers, "STICKY_SECONDS", 0), routers.acting_as(self.poster):
+            self.assertEqual(Post.objects.all().db, REPLICA)
+            self.assertEqual(self.visible(), 0)
+
+    def test_others_read_replica(self):
+        with routers.acting_as(self.poster):
+            self.board.create_post("Dragons", "The dragon came to market.", author_name="Poster",
+                                   author_player=self.poster)
+
+        with routers.acting_as(self.reader):
+            self.assertEqual(Post.objects.all().db, REPLICA)
+            self.assertEqual(self.visible(), 0)
+
+    def test_stale_copy(self):
+        posts = [self.board.create_post("Post %i" % i, "Text.", author_name="Poster") for i in range(4)]
+        self.replicate()
+
+        # The primary moves on before the replica catches up.
+        Post.objects.filter(pk=posts[1].id).delete()
+        Post.objects.get_queryset().renumber(self.board)
+        Post.flush_instance_cache()
+
+        with routers.acting_as(self.reader):
+            stale = Post.objects.get(pk=posts[3].id)
+            self.assertEqual(stale.db_seq, 4)
+            self.assertIsNone(Post.get_cached_instance(stale.id))
+
+            stale.db_pinned = True
+            stale.save()
+            stale.save()
+
+        seqs = sorted(Post.objects.filter(db_board_id=self.board.id).values_list('db_seq', flat=True))
+        self.assertEqual(seqs, [1, 2, 3])
+        self.assertTrue(Post.objects.get(pk=posts[3].id).db_pinned)
@@ -0,0 +1,223 @@
+"""
+Export and import of Paxboards boards, for backups, moving boards between games, or seeding a new
+one.
+
+Boards are written out as JSON Lines: one JSON object per line, first a "board" line for each
+board, then a "post" line for each post, oldest first, so a reply always comes after the post it
+replies to.
+
+    {"type": "board", "name": "Announcements", "locks": "read:all()", "max_posts": null, "max_days": 30}
+    {"type": "post", "id": 12, "board": "Announcements", "parent": null, "poster": "Tom",
+     "player": "tom", "subject": "Hello", "text": "...", "pinned": false,
+     "created": "2019-10-29T12:00:00+00:00", "readers": ["tom", "sara"]}
+
+Players are matched up by account name on import; posts by players the game doesn't have are
+still imported, under the same byline.  The export reads the posts a batch at a time from an
+iterator, so memory use stays flat however large the boards are, and the import writes them a
+batch at a time, each batch in its own transaction.
+
+Both are normally run through the management commands:
+
+    evennia paxboards_export --output boards.jsonl [--board Announcements ...]
+    evennia paxboards_import boards.jsonl
+
+The export is also available on the web, to superusers and Wizards, at /boards/export/.
+
+"""
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .boards import DefaultBoard
+from .models import Post
+from .readstate import get_read_state
+from .search import index_posts
+
+BATCH_SIZE = 500
+
+
+def export_lines(boards=None, batch_size=BATCH_SIZE):
+    """
+    Writes out boards and their posts as JSON Lines.  This is a generator, so the lines can be
+    streamed to a file or a web response as they're made.
+
+    Args:
+        boards (list): The boards to export, or None for all of them.
+        batch_size (int): How many posts to read (and look up readers for) at a time.
+
+    Yields:
+        Strings, each one line of JSON ending in a newline.
+
+    """
+    if boards is None:
+        boards = list(DefaultBoard.objects.order_by('id'))
+
+    names = {}
+    for board in boards:
+        names[board.id] = board.name
+        yield _line({"type": "board", "name": board.name, "locks": str(board.locks),
+                     "max_posts": board.db_expiry_maxposts, "max_days": board.db_expiry_duration})
+
+    from evennia.accounts.models import AccountDB
+
+    # Rows rather than Post objects, since every Post loaded stays in the idmapper cache.
+    read_state = get_read_state()
+    posts = Post.objects.filter(db_board__in=boards).order_by('id') \
+        .values_list('id', 'db_board_id', 'db_parent_id', 'db_poster_name', 'db_poster_player__username',
+                     'db_subject', 'db_text', 'db_pinned', 'db_date_created', named=True) \
+        .iterator(chunk_size=batch_size)
+
+    while True:
+        batch = list(islice(posts, batch_size))
+        if not batch:
+            break
+
+        readers = read_state.readers(batch)
+        usernames = dict(AccountDB.objects.filter(pk__in=set().union(*readers.values()))
+                         .values_list('id', 'username'))
+
+        for post in batch:
+            yield _line({"type": "post", "id": post.id, "board": names[post.db_board_id],
+                         "parent": post.db_parent_id, "poster": post.db_poster_name,
+                         "player": post.db_poster_player__username, "subject": post.db_subject,
+                         "text": post.db_text, "pinned": post.db_pinned,
+                         "created": post.db_date_created.isoformat(),
+                         "readers": sorted(usernames[i] for i in readers[post.id] if i in usernames)})
+
+
+def _line(record):
+    return json.dumps(record, sort_keys=True) + "\n"
+
+
+def import_lines(lines, batch_size=BATCH_SIZE):
+    """
+    Reads boards and posts from JSON Lines, as written by export_lines, and adds them to the game.
+    Boards which already exist (by name) have the posts added to them, and keep their settings.
+
+    Posts are inserted with bulk creates, a batch at a time, each batch in its own transaction,
+    along with their search index entries and read state.  Reply links are rebuilt as the
+    replies come in, and the boards' post numbers and thread summaries once everything is in.
+
+    Args:
+        lines (iterable): The lines to read, e.g. an open file.
+        batch_size (int): How many posts to insert at a time.
+
+    Returns:
+        A dictionary of counts: 'boards' created, 'posts' imported, 'readers' (reads recorded)
+        and 'skipped' (lines which couldn't be imported).
+
+    """
+    importer = _Importer(batch_size)
+    for line in lines:
+        line = line.strip()
+        if line:
+            importer.add(line)
+
+    return importer.finish()
+
+
+class _Importer(object):
+    """
+    Keeps track of an import in progress: the boards seen so far, the new id of every post
+    imported (so replies can find their parents), and the batch of posts waiting to go in.
+
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.boards = {}
+        self.ids = {}
+        self.threads = []
+        self.pending = []
+        self.counts = {"boards": 0, "posts": 0, "readers": 0, "skipped": 0}
+
+    def add(self, line):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            self.counts["skipped"] += 1
+            return
+
+        if record.get("type") == "board":
+            self.add_board(record)
+        elif record.get("type") == "post" and record.get("board") in self.boards:
+            self.pending.append(record)
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+        else:
+            self.counts["skipped"] += 1
+
+    def add_board(self, record):
+        board = DefaultBoard.objects.get_board_exact(record["name"])
+        if not board:
+            board = DefaultBoard(db_key=record["name"], db_expiry_maxposts=record.get("max_posts"),
+                                 db_expiry_duration=record.get("max_days"))
+            board.save()
+            if record.get("locks"):
+                board.locks.add(record["locks"])
+            self.counts["boards"] += 1
+
+        self.boards[record["name"]] = board
+
+    def flush(self):
+        """
+        Inserts the waiting batch of posts, in one transaction.
+
+        """
+        from evennia.accounts.models import AccountDB
+
+        records, self.pending = self.pending, []
+        if not records:
+            return
+
+        names = set(r.get("player") for r in records) | set(name for r in records for name in r.get("readers", []))
+        accounts = dict(AccountDB.objects.filter(username__in=names - {None}).values_list('username', 'id'))
+
+        with transaction.atomic():
+            posts = []
+            for r in records:
+                post = Post(db_board=self.boards[r["board"]], db_poster_player_id=accounts.get(r.get("player")),
+                            db_poster_name=r.get("poster") or "Unknown", db_subject=r.get("subject") or "",
+                            db_pinned=bool(r.get("pinned")), db_parent_id=self.ids.get(r.get("parent")))
+                post.set_text(r.get("text") or "")
+                posts.append(post)
+
+            posts = Post.objects.bulk_create_dated(posts, [parse_datetime(r["created"]) for r in records])
+
+            for record, post in zip(records, posts):
+                self.ids[record["id"]] = post.id
+
+            # Replies to posts earlier in this same batch only get their parent's new id now.
+            late = []
+            for record, post in zip(records, posts):
+                if not post.db_parent_id and record.get("parent") in self.ids:
+                    post.db_parent_id = self.ids[record["parent"]]
+                    late.append(post)
+            if late:
+                Post.objects.bulk_update(late, ['db_parent'])
+
+            self.threads.extend(post.id for post in posts if not post.db_parent_id)
+
+            reads = [(post.id, accounts[name]) for r, post in zip(records, posts)
+                     for name in r.get("readers", []) if name in accounts]
+            get_read_state().add_reads(reads)
+            index_posts(posts)
+
+        self.counts["posts"] += len(posts)
+        self.counts["readers"] += len(reads)
+
+    def finish(self):
+        """
+        Inserts the last batch, then redoes the post numbers and thread summaries of the boards
+        which were imported into.
+
+        """
+        self.flush()
+
+        for board in self.boards.values():
+            Post.objects.get_queryset().renumber(board)
+        Post.objects.update_thread_summaries(self.threads)
+
+        return self.counts
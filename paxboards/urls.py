@@ -1,10 +1,18 @@
 # URL patterns for the character app
 
 from django.conf.urls import url
-from paxboards.views import show_boardlist, show_board, show_thread, submit_post, submit_reply
+from paxboards.views import show_boardlist, show_board, show_thread, submit_post, submit_reply, search_posts, \
+    export_boards
+from paxboards.api import api_boards, api_board, api_thread
 
 urlpatterns = [
     url(r'^$', show_boardlist, name="boardlist"),
+    url(r'^search/$', search_posts, name="search"),
+    url(r'^export/$', export_boards, name="export"),
+    url(r'^export/(?P<board_id>\d+)/$', export_boards, name="export_board"),
+    url(r'^api/$', api_boards, name="api_boards"),
+    url(r'^api/(?P<board_id>\d+)/$', api_board, name="api_board"),
+    url(r'^api/(?P<board_id>\d+)/(?P<post_id>\d+)/$', api_thread, name="api_thread"),
     url(r'^(?P<board_id>\d+)/$', show_board, name="board"),
     url(r'^(?P<board_id>\d+)/(?P<post_id>\d+)/$', show_thread, name="thread"),
     url(r'^(?P<board_id>\d+)/post/$', submit_post, name="post"),
@@ -1,12 +1,23 @@
+from django.conf import settings
+from django.core.paginator import Paginator, InvalidPage
 from django.shortcuts import render
-from django.http import Http404, HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, HttpResponseForbidden, StreamingHttpResponse
 from .boards import DefaultBoard
 from .models import Post
-from evennia.utils import ansi
 from .forms import PostForm, ReplyForm
+from .search import SEARCH_PAGE_SIZE
+from .paging import keyset_page
+from .readstate import get_read_state
+from .routers import request_actor
+from .transfer import export_lines
+
+# How many threads to show on a board page, and how many replies on a thread page.
+BOARD_PAGE_SIZE = getattr(settings, "PAXBOARDS_BOARD_PAGE_SIZE", 25)
+THREAD_PAGE_SIZE = getattr(settings, "PAXBOARDS_THREAD_PAGE_SIZE", 25)
 
 # Create your views here.
 
+@request_actor
 def show_boardlist(request):
     if not request.user.is_authenticated or request.user.username == "":
         return render(request, 'login.html', {})
@@ -17,6 +28,7 @@ def show_boardlist(request):
     return render(request, 'boardlist.html', context)
 
 
+@request_actor
 def show_board(request, board_id):
     if not request.user.is_authenticated or request.user.username == "":
         return render(request, 'login.html', {})
@@ -29,7 +41,8 @@ def show_board(request, board_id):
 
         can_post = board.access(request.user, access_type="post", default=False)
 
-        threads = board.threads(request.user)
+        threads = keyset_page(board.threads(request.user), ['-db_pinned', '-db_last_post_on', '-id'],
+                              BOARD_PAGE_SIZE, after=request.GET.get('after'), before=request.GET.get('before'))
 
         context = {'board': board, 'threads': threads, 'can_post': can_post,
                    'board_id': board.id, 'page_title': 'Forums - ' + board.name}
@@ -40,6 +53,7 @@ def show_board(request, board_id):
         return render(request, 'board_noperm.html', {})
 
 
+@request_actor
 def show_thread(request, board_id, post_id):
     if not request.user.is_authenticated or request.user.username == "":
         return render(request, 'login.html', {})
@@ -53,15 +67,11 @@ def show_thread(request, board_id, post_id):
 
         can_post = board.access(request.user, access_type="post", default=False)
 
-        plaintext = ansi.strip_ansi(post.db_text)
-        setattr(post, 'plaintext', plaintext)
-        post.mark_read(request.user, True)
+        replies = keyset_page(Post.objects.filter(db_parent=post), ['db_date_created', 'id'], THREAD_PAGE_SIZE,
+                              after=request.GET.get('after'), before=request.GET.get('before'))
 
-        replies = Post.objects.filter(db_parent=post).order_by('db_date_created')
-        for r in replies:
-            plaintext = ansi.strip_ansi(r.db_text)
-            setattr(r, 'plaintext', plaintext)
-            r.mark_read(request.user, True)
+        # Everything on the page is marked read at once.
+        get_read_state().mark_read([post] + replies.rows, request.user)
 
         form = ReplyForm()
         context = {'board': board, 'post': post, 'replies': replies, 'can_post': can_post,
@@ -74,6 +84,27 @@ def show_thread(request, board_id, post_id):
         return Http404("Error accessing boards.")
 
 
+@request_actor
+def search_posts(request):
+    if not request.user.is_authenticated or request.user.username == "":
+        return render(request, 'login.html', {})
+
+    searchstring = request.GET.get('q', '').strip()
+    results = None
+
+    if searchstring:
+        boards = DefaultBoard.objects.get_readable_boards(request.user)
+        paginator = Paginator(Post.objects.search(searchstring, boards=boards), SEARCH_PAGE_SIZE)
+        try:
+            results = paginator.page(request.GET.get('page', 1))
+        except InvalidPage:
+            results = paginator.page(paginator.num_pages)
+
+    context = {'searchstring': searchstring, 'results': results, 'page_title': 'Forums - Search'}
+    return render(request, 'search.html', context)
+
+
+@request_actor
 def submit_post(request, board_id):
     if not request.user.is_authenticated or request.user.username == "":
         return render(request, 'login.html', {})
@@ -104,6 +135,7 @@ def submit_post(request, board_id):
         return Http404("Error accessing boards.")
 
 
+@request_actor
 def submit_reply(request, board_id, post_id):
     if not request.user.is_authenticated or request.user.username == "":
         return render(request, 'login.html', {})
@@ -133,3 +165,22 @@ def submit_reply(request, board_id, post_id):
     except (Board.DoesNotExist, Board.MultipleObjectsReturned, Post.DoesNotExist, Post.MultipleObjectsReturned):
         return Http404("Error accessing boards.")
 
+
+
+def export_boards(request, board_id=None):
+    if not request.user.is_authenticated or request.user.username == "":
+        return render(request, 'login.html', {})
+
+    if not (request.user.is_superuser or request.user.check_permstring("Wizards")):
+        return HttpResponseForbidden("Only staff can export the boards.")
+
+    boards = None
+    if board_id is not None:
+        boards = list(DefaultBoard.objects.filter(pk=board_id))
+        if not boards:
+            raise Http404("No such board.")
+
+    # The lines are made as the response is sent, so even a large export is never all in memory.
+    response = StreamingHttpResponse(export_lines(boards), content_type="application/x-ndjson")
+    response['Content-Disposition'] = 'attachment; filename="boards.jsonl"'
+    return response